@@ -0,0 +1,74 @@
+import json
+import sys
+import timeit
+from pathlib import Path
+
+"""请求解析 / 响应序列化微基准：pydantic 路径 vs 快速路径
+    解析：
+        - pydantic：json.loads + ChatRequest.model_validate（FastAPI 默认的请求体处理方式）
+        - pydantic_json：ChatRequest.model_validate_json（pydantic 自带的 JSON 解析，长文本上反而更慢，仅作参考）
+        - fast：RequestParser.parse_chat 强制走快速路径（fastjson.loads + TypeAdapter(List[ChatMessage]) 一次性校验消息列表）
+        - default：服务默认的解析器（请求体不小于 CHAT_FAST_PARSE_MIN_BYTES 默认值时才走快速路径），speedup 按它计算
+    序列化：JSONResponse(ChatResponse(...).model_dump()) vs FastJSONResponse(dict)
+    运行：python -m benchmarks.bench_parse  （在项目根目录）
+"""
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from src.app.core.fastjson import HAS_ORJSON, FastJSONResponse  # noqa: E402
+from src.app.llm.parsing import RequestLimits, RequestParser  # noqa: E402
+from src.app.llm.schemas import ChatRequest, ChatResponse  # noqa: E402
+
+# 与 RequestParser.from_env 的 CHAT_FAST_PARSE_MIN_BYTES 默认值一致
+DEFAULT_FAST_MIN_BYTES = 32768
+
+
+def _body(n_messages: int, content_chars: int) -> bytes:
+    messages = [{"role": "user" if i % 2 == 0 else "assistant", "content": ("长对话 history " * content_chars)[:content_chars]}
+                for i in range(n_messages)]
+    return json.dumps({"session_id": "s1", "messages": messages, "temperature": 0.7, "max_tokens": 256},
+                      ensure_ascii=False).encode("utf-8")
+
+
+CASES = {
+    "short_2x100": _body(2, 100),
+    "history_50x500": _body(50, 500),
+    "history_200x2000": _body(200, 2000),
+    "history_1000x500": _body(1000, 500),
+}
+
+
+# 每个函数单次调用的耗时（微秒）：取多轮中最快的一轮，减少噪声
+def _time_us(fn, seconds: float, repeat: int = 5) -> float:
+    number, total = timeit.Timer(fn).autorange()
+    number = max(1, int(number * seconds / repeat / max(total, 1e-9)))
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(seconds: float = 0.5) -> None:
+    # 基准只比较解析开销，不受默认限制影响
+    fast = RequestParser(RequestLimits(0, 0, 0, 0), fast=True)
+    default = RequestParser(RequestLimits(0, 0, 0, 0), fast=True, fast_min_bytes=DEFAULT_FAST_MIN_BYTES)
+    print(f"orjson: {'yes' if HAS_ORJSON else 'no (stdlib json fallback)'}")
+    print(f"{'case':<20}{'bytes':>10}{'pydantic (us)':>16}{'pydantic_json (us)':>20}{'fast (us)':>12}"
+          f"{'default (us)':>14}{'speedup':>10}")
+    for name, raw in CASES.items():
+        assert fast.parse_chat(raw).messages == ChatRequest.model_validate_json(raw).messages
+        old = _time_us(lambda: ChatRequest.model_validate(json.loads(raw)), seconds)
+        old_json = _time_us(lambda: ChatRequest.model_validate_json(raw), seconds)
+        forced = _time_us(lambda: fast.parse_chat(raw), seconds)
+        new = _time_us(lambda: default.parse_chat(raw), seconds)
+        print(f"{name:<20}{len(raw):>10}{old:>16.1f}{old_json:>20.1f}{forced:>12.1f}{new:>14.1f}{old / new:>9.2f}x")
+
+    answer = "回答 answer " * 200
+    old = _time_us(lambda: JSONResponse(ChatResponse(trace_id="t", session_id="s", answer=answer).model_dump()),
+                   seconds)
+    new = _time_us(lambda: FastJSONResponse({"trace_id": "t", "session_id": "s", "answer": answer}), seconds)
+    print(f"{'response':<20}{'':>10}{old:>16.1f}{'':>20}{new:>12.1f}{'':>14}{old / new:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)
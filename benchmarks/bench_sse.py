@@ -0,0 +1,33 @@
+import sys
+import timeit
+from pathlib import Path
+
+"""SSE 编码微基准：sse_event(...).encode() vs sse_event_bytes(...)
+    运行：python -m benchmarks.bench_sse  （在项目根目录）
+"""
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src.app.core.sse import sse_event, sse_event_bytes  # noqa: E402
+
+CASES = {
+    "token_ascii": ("token", "hello"),
+    "token_cjk": ("token", "你好"),
+    "token_multiline": ("token", "line1\nline2\n"),
+    "usage_dict": ("usage", {"trace_id": "abc", "provider": "ollama", "model": "qwen2.5:7b",
+                             "latency_ms": 1234, "token_events": 321}),
+}
+
+
+def main(number: int = 200_000) -> None:
+    print(f"{'case':<18}{'str+encode (ns)':>18}{'bytes (ns)':>14}{'speedup':>10}")
+    for name, (event, data) in CASES.items():
+        assert sse_event(event, data).encode("utf-8") == sse_event_bytes(event, data)
+        old = timeit.timeit(lambda: sse_event(event, data).encode("utf-8"), number=number) / number * 1e9
+        new = timeit.timeit(lambda: sse_event_bytes(event, data), number=number) / number * 1e9
+        print(f"{name:<18}{old:>18.0f}{new:>14.0f}{old / new:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, fields
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+"""本地假 Ollama 服务（压测 / 基准测试用）
+    实现 /api/generate（流式 + 非流式）以及 /api/tags、/api/ps，行为可配置：
+        - FAKE_OLLAMA_PROMPT_DELAY_MS（默认 50）：prompt 评估耗时，即首 token 之前的等待
+        - FAKE_OLLAMA_TPS（默认 100）：生成速度（tokens/s），0 表示不等待
+        - FAKE_OLLAMA_CHUNK_TOKENS（默认 1）：流式时每个 NDJSON 帧包含多少个 token
+        - FAKE_OLLAMA_TOKEN（默认 "tok "）：每个 token 的文本
+        - FAKE_OLLAMA_ERROR_RATE（默认 0）：请求直接返回 500 的比例
+        - FAKE_OLLAMA_STREAM_ERROR_RATE（默认 0）：流式输出到一半时返回 {"error": ...} 的比例
+        - FAKE_OLLAMA_MODEL（默认 "qwen2.5:7b"）：/api/tags、/api/ps 报告的模型
+    生成的 token 数等于请求里的 options.num_predict，最终帧带上 eval_count / eval_duration 等统计。
+    运行：python -m benchmarks.fake_ollama --port 11435 --tps 200
+"""
+
+
+@dataclass
+class FakeConfig:
+    prompt_delay_ms: float = 50.0
+    tps: float = 100.0
+    chunk_tokens: int = 1
+    token: str = "tok "
+    error_rate: float = 0.0
+    stream_error_rate: float = 0.0
+    model: str = "qwen2.5:7b"
+
+    @classmethod
+    def from_env(cls) -> "FakeConfig":
+        cfg = cls()
+        for f in fields(cls):
+            raw = os.getenv(f"FAKE_OLLAMA_{f.name.upper()}")
+            if raw is not None:
+                setattr(cfg, f.name, type(getattr(cfg, f.name))(raw))
+        return cfg
+
+    # 转成环境变量（load 脚本启动子进程时使用）
+    def to_env(self) -> dict:
+        return {f"FAKE_OLLAMA_{f.name.upper()}": str(getattr(self, f.name)) for f in fields(self)}
+
+
+def create_app(config: FakeConfig = None) -> FastAPI:
+    cfg = config or FakeConfig.from_env()
+    app = FastAPI()
+    app.state.config = cfg
+    app.state.requests = 0
+
+    def final_frame(n_tokens: int, prompt: str, started: float, eval_s: float) -> dict:
+        return {
+            "model": cfg.model,
+            "response": "",
+            "done": True,
+            "context": [1, 2, 3],
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "load_duration": 0,
+            "prompt_eval_count": max(1, len(prompt) // 4),
+            "prompt_eval_duration": int(cfg.prompt_delay_ms * 1e6),
+            "eval_count": n_tokens,
+            "eval_duration": int(eval_s * 1e9),
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": cfg.model, "model": cfg.model}]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": cfg.model, "model": cfg.model}]}
+
+    @app.post("/api/generate")
+    async def generate(req: Request):
+        app.state.requests += 1
+        payload = await req.json()
+        started = time.perf_counter()
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            return JSONResponse({"error": "injected failure"}, status_code=500)
+        n_tokens = int((payload.get("options") or {}).get("num_predict", 128))
+        prompt = payload.get("prompt", "")
+        if not prompt and not payload.get("context"):
+            # 与 Ollama 一致：空 prompt 只加载模型（预热）
+            return {"model": cfg.model, "response": "", "done": True, "done_reason": "load"}
+        delay = 1.0 / cfg.tps if cfg.tps > 0 else 0.0
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(cfg.prompt_delay_ms / 1000 + delay * n_tokens)
+            body = final_frame(n_tokens, prompt, started, delay * n_tokens)
+            body["response"] = cfg.token * n_tokens
+            return Response(json.dumps(body), media_type="application/json")
+
+        fail_at = random.randint(0, max(0, n_tokens - 1)) if random.random() < cfg.stream_error_rate else None
+
+        async def frames():
+            await asyncio.sleep(cfg.prompt_delay_ms / 1000)
+            eval_start = time.perf_counter()
+            sent = 0
+            next_at = eval_start
+            while sent < n_tokens:
+                if fail_at is not None and sent >= fail_at:
+                    yield json.dumps({"error": "injected stream failure"}).encode() + b"\n"
+                    return
+                k = min(cfg.chunk_tokens, n_tokens - sent)
+                # 按绝对时间排期，避免 sleep 误差累积导致实际速度偏低
+                next_at += delay * k
+                wait = next_at - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                sent += k
+                yield json.dumps({"model": cfg.model, "response": cfg.token * k, "done": False}).encode() + b"\n"
+            yield json.dumps(final_frame(n_tokens, prompt, started, time.perf_counter() - eval_start)).encode() + b"\n"
+
+        return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+    return app
+
+
+# uvicorn benchmarks.fake_ollama:app 使用的默认实例（配置来自环境变量）
+app = create_app()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="fake Ollama server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    defaults = FakeConfig.from_env()
+    for f in fields(FakeConfig):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", type=type(getattr(defaults, f.name)),
+                            default=getattr(defaults, f.name))
+    args = parser.parse_args()
+
+    import uvicorn
+
+    cfg = FakeConfig(**{f.name: getattr(args, f.name) for f in fields(FakeConfig)})
+    uvicorn.run(create_app(cfg), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
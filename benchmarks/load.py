@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+"""压测：用假 Ollama 驱动 /chat 和 /chat/stream，测量服务自身的开销
+    默认在本地启动两个子进程：假 Ollama（benchmarks.fake_ollama）+ 本服务（uvicorn src.app.main:app），
+    按给定的并发档位逐档压测，输出：
+        - TTFT（首 token 延迟）、端到端延迟的 p50 / p95 / p99（毫秒）
+        - 单个流的 tokens/s 分位数、整体请求吞吐（req/s）和 token 吞吐（tokens/s）
+        - 服务进程的 CPU 时间 / token（读取 /proc，只在 Linux 上可用）
+    结果写入 JSON 文件（带 git commit），可以和其他提交的结果对比：
+        python -m benchmarks.load --concurrency 1,8,32 --requests 200 --out bench.json
+        python -m benchmarks.load --compare old.json bench.json
+    已有服务时用 --url 指定地址（此时不启动子进程，也不统计服务端 CPU）。
+"""
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# 读取进程累计 CPU 时间（用户态 + 内核态，秒）；非 Linux 返回 None
+def process_cpu_s(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            parts = f.read().rsplit(")", 1)[1].split()
+        return (int(parts[11]) + int(parts[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _wait_ready(url: str, timeout_s: float = 20.0, status: Optional[int] = None) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            code = httpx.get(url, timeout=1).status_code
+            if code == status if status is not None else code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def _spawn(args: List[str], env: dict) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-m", *args], cwd=ROOT, env={**os.environ, **env})
+
+
+# 单个请求的结果
+class Sample:
+    __slots__ = ("ok", "ttft_s", "latency_s", "tokens")
+
+    def __init__(self, ok: bool, ttft_s: Optional[float], latency_s: float, tokens: int):
+        self.ok = ok
+        self.ttft_s = ttft_s
+        self.latency_s = latency_s
+        self.tokens = tokens
+
+
+async def _one_stream(client: httpx.AsyncClient, payload: dict) -> Sample:
+    t0 = time.perf_counter()
+    ttft = None
+    tokens = 0
+    ok = False
+    event = None
+    async with client.stream("POST", "/chat/stream", json=payload) as r:
+        async for line in r.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - t0
+            elif line.startswith("data: ") and event == "usage":
+                usage = json.loads(line[6:])
+                tokens = (usage.get("backend_stats") or {}).get("eval_count") or usage.get("token_events", 0)
+            elif event == "done":
+                ok = r.status_code == 200
+    return Sample(ok, ttft, time.perf_counter() - t0, tokens)
+
+
+async def _one_chat(client: httpx.AsyncClient, payload: dict) -> Sample:
+    t0 = time.perf_counter()
+    r = await client.post("/chat", json=payload)
+    latency = time.perf_counter() - t0
+    ok = r.status_code == 200
+    # 真实 token 数取自响应体的 usage.tokens（后端没有返回统计时记 0）
+    tokens = ((r.json().get("usage") or {}).get("tokens") or 0) if ok else 0
+    return Sample(ok, latency if ok else None, latency, tokens)
+
+
+async def run_level(url: str, endpoint: str, concurrency: int, requests: int, max_tokens: int,
+                    provider: str, server_pid: Optional[int]) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    samples: List[Sample] = []
+    counter = iter(range(requests))
+    call = _one_stream if endpoint == "/chat/stream" else _one_chat
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def worker():
+            for i in counter:
+                # 每个请求的内容都不同，避免被响应缓存 / 单飞合并折叠
+                payload = {"provider": provider, "max_tokens": max_tokens,
+                           "messages": [{"role": "user", "content": f"benchmark request {i}"}]}
+                try:
+                    samples.append(await call(client, payload))
+                except httpx.HTTPError:
+                    samples.append(Sample(False, None, 0.0, 0))
+
+        cpu0 = process_cpu_s(server_pid) if server_pid else None
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+        cpu1 = process_cpu_s(server_pid) if server_pid else None
+
+    ok = [s for s in samples if s.ok]
+    total_tokens = sum(s.tokens for s in ok)
+    per_stream_tps = [s.tokens / (s.latency_s - s.ttft_s) for s in ok
+                      if s.ttft_s is not None and s.latency_s > s.ttft_s and s.tokens > 1]
+    cpu_s = cpu1 - cpu0 if cpu0 is not None and cpu1 is not None else None
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "tokens_per_s_total": round(total_tokens / elapsed, 1) if elapsed else None,
+        "ttft_ms": percentiles([s.ttft_s * 1000 for s in ok if s.ttft_s is not None]),
+        "latency_ms": percentiles([s.latency_s * 1000 for s in ok]),
+        "stream_tokens_per_s": percentiles(per_stream_tps),
+        "server_cpu_s": round(cpu_s, 3) if cpu_s is not None else None,
+        "server_cpu_ms_per_token": round(cpu_s * 1000 / total_tokens, 4) if cpu_s is not None and total_tokens else None,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# 对比两次结果：按 (endpoint, concurrency) 对齐，打印关键指标的变化
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path, encoding="utf-8") as f:
+        old = {(r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)["results"]
+    print(f"{'endpoint':<14}{'conc':>5}{'rps':>16}{'ttft p95 ms':>22}{'cpu ms/token':>22}")
+    for r in new:
+        o = old.get((r["endpoint"], r["concurrency"]))
+        if o is None:
+            continue
+
+        def cell(a, b):
+            return f"{a}->{b}" if a is not None and b is not None else "-"
+
+        print(f"{r['endpoint']:<14}{r['concurrency']:>5}{cell(o['throughput_rps'], r['throughput_rps']):>16}"
+              f"{cell(o['ttft_ms']['p95'], r['ttft_ms']['p95']):>22}"
+              f"{cell(o['server_cpu_ms_per_token'], r['server_cpu_ms_per_token']):>22}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="load test /chat and /chat/stream against a fake Ollama")
+    parser.add_argument("--url", help="existing server to target (skip spawning processes)")
+    parser.add_argument("--endpoints", default="/chat/stream,/chat")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="requests per level")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--provider", default="ollama")
+    parser.add_argument("--fake-tps", type=float, default=200.0)
+    parser.add_argument("--fake-prompt-delay-ms", type=float, default=20.0)
+    parser.add_argument("--fake-chunk-tokens", type=int, default=1)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from benchmarks.fake_ollama import FakeConfig
+
+    fake_cfg = FakeConfig(prompt_delay_ms=args.fake_prompt_delay_ms, tps=args.fake_tps,
+                          chunk_tokens=args.fake_chunk_tokens, error_rate=args.fake_error_rate)
+    procs: List[subprocess.Popen] = []
+    server_pid = None
+    url = args.url
+    try:
+        if url is None:
+            fake_port, app_port = _free_port(), _free_port()
+            procs.append(_spawn(["uvicorn", "benchmarks.fake_ollama:app", "--port", str(fake_port),
+                                 "--log-level", "warning"], fake_cfg.to_env()))
+            _wait_ready(f"http://127.0.0.1:{fake_port}/api/tags")
+            server_env = {
+                "OLLAMA_BASE_URL": f"http://127.0.0.1:{fake_port}",
+                # 压测服务本身的开销：访问日志只采样一小部分（准入控制默认不限制并发）
+                "LOG_SAMPLE_RATE": os.getenv("LOG_SAMPLE_RATE", "0.01"),
+                # 预热完成（/ready 返回 200）后再开始计时，不把冷启动算进第一档的结果
+                "CHAT_WARMUP": os.getenv("CHAT_WARMUP", "1"),
+            }
+            server = _spawn(["uvicorn", "src.app.main:app", "--port", str(app_port), "--log-level", "warning"],
+                            server_env)
+            procs.append(server)
+            server_pid = server.pid
+            url = f"http://127.0.0.1:{app_port}"
+            _wait_ready(f"{url}/ready", status=200)
+
+        results = []
+        for endpoint in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+            for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+                r = asyncio.run(run_level(url, endpoint, level, args.requests, args.max_tokens, args.provider,
+                                          server_pid))
+                results.append(r)
+                print(f"{endpoint:<14} c={level:<4} rps={r['throughput_rps']:<8} ttft_p50={r['ttft_ms']['p50']}ms "
+                      f"ttft_p99={r['ttft_ms']['p99']}ms cpu/token={r['server_cpu_ms_per_token']}ms errors={r['errors']}")
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=10)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "max_tokens": args.max_tokens,
+            "requests_per_level": args.requests,
+            "fake_ollama": fake_cfg.to_env() if args.url is None else None,
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,159 @@
+import hashlib
+import json
+import os
 import time
 import asyncio
-from fastapi import APIRouter, Request, HTTPException
+import anyio
+from typing import Optional
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
 
-from src.app.core.logging import get_trace_id # 链路追踪ID
-from src.app.llm.schemas import ChatRequest, ChatResponse # 请求/响应模型
-from src.app.llm.engines import get_engine # 引擎工厂函数
+from src.app.core.logging import get_trace_id, log_event # 链路追踪ID / 结构化日志
+from src.app.llm.schemas import ChatBatchRequest, ChatRequest, ChatResponse # 请求/响应模型
+from src.app.llm.engines import GenerationState, get_engine # 引擎工厂函数
 from fastapi.responses import StreamingResponse # 流式响应（重复导入，可删除）
-from src.app.core.sse import sse_event # SSE格式生成函数
+from src.app.core.sse import sse_event_bytes # SSE格式生成函数（字节级编码，与 sse_event 输出逐字节一致）
+from src.app.core.batching import batch_tokens, default_flush_bytes, default_flush_ms # token 合批
+from src.app.core import metrics # 指标（/metrics）
+from src.app.core.resumable import ReplayGap, frame, get_replay_store # 可续传的 SSE 流（Last-Event-ID）
+from src.app.core.fastjson import FastJSONResponse # 快速 JSON 响应（有 orjson 时用 orjson）
+from src.app.core.timing import SpanRecorder, backend_throughput, spans_of # 分阶段耗时
+from src.app.core.profiling import get_profiler # 慢请求采样分析（可选）
+from src.app.llm.parsing import InvalidRequest, get_request_parser # 请求体快速解析 + 大小限制
+from src.app.llm.cache import get_cache, is_cacheable, request_key # 响应缓存
+from src.app.llm.coalesce import get_coalescer # 相同请求单飞合并
+from src.app.llm.sessions import get_session_store, session_key # 服务端会话记忆（按调用方隔离）
+from src.app.llm.context import ContextTrim, get_context_budget # 按 token 预算裁剪上下文
+from src.app.llm.scheduler import AdmissionRejected, get_admission # 准入控制（并发上限 + 公平排队）
+
+# 租户标识的请求头（公平调度按租户划分）
+API_KEY_HEADER = "x-api-key"
+# 流式输出时检查客户端是否断开的最小间隔（秒）；检查本身不阻塞，只是避免每个 token 都检查一次
+DISCONNECT_CHECK_S = 0.1
+
+
+# 续传请求头：客户端最后收到的事件 id
+LAST_EVENT_ID_HEADER = "last-event-id"
+# 可续传流的 id（服务端生成，随响应头返回；重连时原样带上）
+STREAM_ID_HEADER = "x-stream-id"
+
+
+def last_event_id(req: Request) -> Optional[int]:
+    raw = req.headers.get(LAST_EVENT_ID_HEADER)
+    if raw is None:
+        return None
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return None
+
+
+# 发起请求的身份摘要：API key + session_id + 请求内容（provider / 消息 / 采样参数），续传时必须一致
+def stream_owner(req: Request, body: ChatRequest) -> str:
+    parts = (req.headers.get(API_KEY_HEADER) or "", body.session_id or "", request_key(body, None))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+# 给事件依次编上 id（未开启续传时使用）
+async def with_ids(source):
+    n = 0
+    try:
+        async for payload in source:
+            n += 1
+            yield frame(n, payload)
+    finally:
+        await source.aclose()
+
+
+# 从可续传的流里读取事件发给客户端；客户端断开时离开（宽限期后无人重连才取消生成）
+async def follow_stream(req: Request, stream, after_id: int, trace_id: str):
+    stream.attach()
+    checked_at = time.perf_counter()
+    try:
+        async for data in stream.follow(after_id):
+            yield data
+            now = time.perf_counter()
+            if now - checked_at >= DISCONNECT_CHECK_S:
+                checked_at = now
+                if await req.is_disconnected():
+                    return
+    except ReplayGap as e:
+        yield sse_event_bytes("error", {"trace_id": trace_id, "error": str(e)})
+    finally:
+        stream.detach()
+
+
+# /chat/batch 默认的并行条数
+def default_batch_parallelism() -> int:
+    return int(os.getenv("CHAT_BATCH_PARALLELISM", "4"))
+
+
+def _ndjson(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+# 读取请求体，超过 max_bytes 时立即返回 413：先看 Content-Length，没有时边读边数（0 表示不限制）
+async def read_body(req: Request, max_bytes: int) -> bytes:
+    def too_large():
+        return HTTPException(status_code=413, detail={"trace_id": get_trace_id(req),
+                                                      "error": f"request body exceeds {max_bytes} bytes"})
+
+    length = req.headers.get("content-length")
+    if max_bytes and length is not None and length.isdigit() and int(length) > max_bytes:
+        raise too_large()
+    chunks = []
+    size = 0
+    async for chunk in req.stream():
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise too_large()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _invalid(e: InvalidRequest) -> RequestValidationError:
+    return RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors])
+
+
+# 请求体依赖：代替 FastAPI 默认的 pydantic 解析（快速解码 + 轻量消息对象 + 大小限制），错误格式与默认的 422 一致
+async def chat_request(req: Request) -> ChatRequest:
+    parser = get_request_parser()
+    spans = spans_of(req)
+    with spans.span("read"):
+        raw = await read_body(req, parser.limits.max_body_bytes)
+    try:
+        with spans.span("parse"):
+            return parser.parse_chat(raw)
+    except InvalidRequest as e:
+        raise _invalid(e)
+
+
+async def batch_request(req: Request) -> ChatBatchRequest:
+    parser = get_request_parser()
+    raw = await read_body(req, parser.limits.max_batch_body_bytes)
+    try:
+        return parser.parse_batch(raw)
+    except InvalidRequest as e:
+        raise _invalid(e)
+
+
+# 请求体改由依赖解析后，OpenAPI 文档里补上原来的请求体 schema（把 $defs 内联，文档里不需要额外的 components）
+def _json_body(model) -> dict:
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return inline(defs[ref[len("#/$defs/"):]])
+            return {k: inline(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [inline(v) for v in node]
+        return node
+
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": inline(schema)}}}}
 
 
 # 创建一个路由实例，后续的接口都注册在这个实例上，方便模块化管理。
@@ -15,29 +161,226 @@ from src.app.core.sse import sse_event # SSE格式生成函数
 router = APIRouter()
 
 
-# 普通的同步聊天接口
-# 从请求的消息列表中提取用户最后一次发送的内容，拼接成模拟回复返回。
-@router.post("/chat", response_model=ChatResponse)
-def chat(req: Request, body: ChatRequest):
-    # 从请求上下文获取trace ID（链路追踪）
-    trace_id = get_trace_id(req)
+class PreparedPrompt:
+    """发给引擎之前组装好的内容
+        - store / turn：会话存储和本轮对话（无 session_id 或未开启时为 None）
+        - key：会话在存储里的 key（调用方身份 + session_id）
+        - messages：实际发给引擎的消息（已按 token 预算裁剪）
+        - state：传给引擎的 GenerationState（会话复用 context 时使用）
+        - trim：裁剪统计（未开启裁剪时为 None）
+    """
+
+    __slots__ = ("store", "key", "turn", "messages", "state", "trim")
+
+    def __init__(self, store, key, turn, messages, state, trim):
+        self.store = store
+        self.key = key
+        self.turn = turn
+        self.messages = messages
+        self.state = state
+        self.trim = trim
+
+
+# 组装上下文：ChatRequest.messages -> 会话记忆（拼历史 / 复用 context）-> 按 token 预算裁剪
+# 会话按调用方（API key，没有时为客户端 IP）+ session_id 隔离，不同调用方用同一个 session_id 互不可见
+def prepare_prompt(req: Request, body: ChatRequest, engine) -> PreparedPrompt:
+    model = getattr(engine, "model", None)
+    budget = get_context_budget()
+    token_budget = budget.budget(model, body.max_tokens) if budget is not None else None
+
+    store = get_session_store() if body.session_id else None
+    key = session_key(tenant_of(req), body.session_id) if store is not None else None
+    turn = None
+    if store is not None:
+        turn = store.begin(key, body.messages, engine, token_budget=token_budget,
+                           counter=budget.counter if budget is not None else None)
+    messages = turn.prompt_messages if turn is not None else body.messages
+    state = turn.state if turn is not None else None
+
+    trim = None
+    if budget is not None:
+        if turn is not None and turn.reused_context:
+            # 复用 context 时已确认 context + 新消息在预算内，只统计不裁剪
+            trim = ContextTrim(messages, len(state.context) + budget.counter.count_messages(messages))
+        else:
+            trim = budget.trim(messages, model, body.max_tokens)
+            messages = trim.messages
+    return PreparedPrompt(store, key, turn, messages, state, trim)
+
+
+# 公平调度的租户：优先 API key，其次 session_id，最后客户端 IP（不传 body 时只看 API key / IP，例如整个批量请求）
+def tenant_of(req: Request, body: Optional[ChatRequest] = None) -> str:
+    api_key = req.headers.get(API_KEY_HEADER)
+    if api_key:
+        return f"key:{api_key}"
+    if body is not None and body.session_id:
+        return f"session:{body.session_id}"
+    return f"ip:{req.client.host if req.client else 'unknown'}"
+
+
+# 申请一个执行名额；拿不到时直接返回 429/503 + Retry-After（未开启准入控制时返回 None）
+# tenant 不传时按 tenant_of(req, body) 计算
+async def admit(req: Request, body: ChatRequest, engine, trace_id: str, endpoint: str, tenant: Optional[str] = None):
+    controller = get_admission()
+    if controller is None:
+        return None
+    try:
+        return await controller.acquire(engine.name, getattr(engine, "model", None), tenant or tenant_of(req, body),
+                                        body.max_tokens)
+    except AdmissionRejected as e:
+        metrics.REQUESTS.inc(endpoint=endpoint, provider=engine.name, model=getattr(engine, "model", None) or "",
+                             outcome="rejected")
+        raise HTTPException(status_code=e.status_code, detail={"trace_id": trace_id, "error": e.reason},
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+# 非流式生成一个回答（/chat 和 /chat/batch 共用）：缓存 → 准入 → 引擎生成 → 写缓存 / 会话
+# 各阶段耗时写进 spans、后端吞吐（backend_throughput）写进 usage（不传时不对外报告）；
+# 失败时抛出 HTTPException（429/503 准入被拒，502 后端失败）
+async def answer_chat(req: Request, body: ChatRequest, trace_id: str, endpoint: str,
+                      spans: Optional[SpanRecorder] = None, tenant: Optional[str] = None,
+                      usage: Optional[dict] = None) -> str:
+    t0 = time.perf_counter()
+    spans = spans or SpanRecorder(t0)
     # 请求中的provider（mock/ollama）获取对应引擎实例
     engine = get_engine(body.provider)
+    labels = {"provider": engine.name, "model": getattr(engine, "model", None) or ""}
+
+    # 组装上下文：会话记忆（带 session_id 时拼出完整历史，必要时复用上一轮的 KV context）+ token 预算裁剪
+    with spans.span("prompt"):
+        prepared = prepare_prompt(req, body, engine)
+    turn = prepared.turn
 
+    # 确定性请求先查响应缓存，命中则直接返回（会话请求依赖服务端历史，不走缓存）
+    cache = get_cache() if turn is None and is_cacheable(body) else None
+    cache_key = request_key(body, getattr(engine, "model", None)) if cache is not None else None
+    if cache is not None:
+        with spans.span("cache"):
+            entry = cache.get(cache_key)
+        if entry is not None:
+            metrics.REQUESTS.inc(endpoint=endpoint, outcome="ok", **labels)
+            return entry.answer
+
+    # 准入控制：拿到执行名额才请求后端
+    with spans.span("queue"):
+        slot = await admit(req, body, engine, trace_id, endpoint, tenant)
+    # 引擎回填的阶段耗时和后端统计（Ollama 的 eval_count / eval_duration 等）
+    state = prepared.state or GenerationState()
     try:
-        # 调用引擎的非流式generate方法生成回复（Mock返回模拟内容，Ollama调用真实模型）
-        answer = engine.generate(body.messages, body.temperature, body.top_p, body.max_tokens)
+        # 调用引擎的异步非流式agenerate方法生成回复（Mock返回模拟内容，Ollama调用真实模型）
+        with spans.span("backend"):
+            answer = await engine.agenerate(prepared.messages, body.temperature, body.top_p, body.max_tokens,
+                                            state=state)
     except Exception as e:
+        metrics.REQUESTS.inc(endpoint=endpoint, outcome="error", **labels)
         # 捕获异常，返回502错误（网关错误），携带trace_id方便排查
         raise HTTPException(status_code=502, detail={"trace_id": trace_id, "error": f"{engine.name} failed: {str(e)}"})
+    finally:
+        if slot is not None:
+            slot.release()
+
+    for name, seconds in state.timings.items():
+        spans.add(name, seconds)
+    spans.merge_backend(state.stats)
+    # 真实的 token 数和速度（eval_count / eval_duration）
+    throughput = backend_throughput(state.stats)
+    if usage is not None:
+        usage.update(throughput)
+    if throughput.get("tokens_per_s"):
+        metrics.TOKENS_PER_SECOND.observe(throughput["tokens_per_s"], **labels)
+    if cache is not None:
+        cache.put(cache_key, (answer,))
+    if turn is not None:
+        prepared.store.commit(prepared.key, turn, answer, engine)
+    metrics.REQUESTS.inc(endpoint=endpoint, outcome="ok", **labels)
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=endpoint, **labels)
+    return answer
+
+
+# 普通的（非流式）聊天接口
+# 异步等待引擎的 agenerate，等待后端期间不占用 Starlette 线程池，/chat 并发不再受线程数限制。
+# 响应直接用 FastJSONResponse 序列化 dict（字段与 ChatResponse 一致），跳过 response_model 的校验和 jsonable_encoder
+# 分阶段耗时（读取 / 解析 / 组装 prompt / 排队 / 后端 / Ollama 的 prompt 评估与解码）放在 Server-Timing 响应头里，
+# 后端返回了统计时响应体带 usage（真实的 token 数和 tokens/s）
+@router.post("/chat", response_model=ChatResponse, response_class=FastJSONResponse, openapi_extra=_json_body(ChatRequest))
+async def chat(req: Request, body: ChatRequest = Depends(chat_request)):
+    # 从请求上下文获取trace ID（链路追踪）
+    trace_id = get_trace_id(req)
+    spans = spans_of(req)
+    profiler = get_profiler()
+    probe = profiler.begin(trace_id) if profiler is not None else None
+    usage = {}
+    try:
+        answer = await answer_chat(req, body, trace_id, "chat", spans, usage=usage)
+    finally:
+        spans.mark("total")
+        if probe is not None:
+            profiler.end(probe, spans.to_dict(), endpoint="chat")
+    # 返回与 ChatResponse 模型字段一致的响应
+    content = {"trace_id": trace_id, "session_id": body.session_id, "answer": answer}
+    if usage:
+        content["usage"] = usage
+    response = FastJSONResponse(content)
+    response.headers["server-timing"] = spans.server_timing()
+    return response
+
+
+"""批量聊天接口：/chat/batch
+    离线任务（评测、批量摘要）一次提交多条 ChatRequest，不用为每条请求单独走一遍 HTTP 和中间件：
+        - 最多 parallelism 条同时执行（不传时用 CHAT_BATCH_PARALLELISM，默认 4）；
+        - 每条仍然单独经过缓存 / 准入控制，所以 provider / model 的并发上限同样生效，
+          且整个批次按同一个租户（API key，没有时为客户端 IP；不看各条的 session_id）参与公平调度，不会挤占交互式请求；
+        - 结果按完成顺序以 NDJSON（每行一个 JSON）流式返回，带上条目下标 index；
+        - 单条失败只在该条结果里返回 error / status，不影响其他条目；最后一行是汇总（done=true）。
+"""
+@router.post("/chat/batch", openapi_extra=_json_body(ChatBatchRequest))
+async def chat_batch(req: Request, body: ChatBatchRequest = Depends(batch_request)):
+    trace_id = get_trace_id(req)
+    parallelism = min(body.parallelism or default_batch_parallelism(), len(body.items))
+    tenant = tenant_of(req)
+
+    async def run_one(index: int, item: ChatRequest) -> dict:
+        item_trace = f"{trace_id}:{index}"
+        try:
+            answer = await answer_chat(req, item, item_trace, "chat_batch", tenant=tenant)
+        except HTTPException as e:
+            detail = e.detail.get("error") if isinstance(e.detail, dict) else e.detail
+            return {"index": index, "trace_id": item_trace, "status": e.status_code, "error": detail}
+        except Exception as e:
+            return {"index": index, "trace_id": item_trace, "status": 500, "error": str(e)}
+        return {"index": index, "trace_id": item_trace, "session_id": item.session_id, "answer": answer}
+
+    async def gen():
+        start = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        pending = iter(enumerate(body.items))
+
+        # 固定数量的 worker 依次领取条目，完成一条就把结果放进队列
+        async def worker():
+            for index, item in pending:
+                await results.put(await run_one(index, item))
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(parallelism)]
+        failed = 0
+        try:
+            for _ in range(len(body.items)):
+                result = await results.get()
+                failed += "error" in result
+                yield _ndjson(result)
+            yield _ndjson({"done": True, "trace_id": trace_id, "total": len(body.items), "failed": failed,
+                           "latency_ms": int((time.perf_counter() - start) * 1000)})
+        finally:
+            # 客户端断开时取消还没跑完的条目
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
 
-    # 返回符合ChatResponse模型的响应
-    return ChatResponse(trace_id=trace_id, session_id=body.session_id, answer=answer)
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
 
 """实现了标准化、可监控、可异常处理的 SSE 流式响应
     标准化的SSE响应：
         - 事件类型区分：meta初始化、token回复内容、usage统计、done结束、error异常。前端可按类型异常差异化处理
-        - 数据格式统一：所有事件都通过sse_event生成，符合SSE标准，避免前端解析异常
+        - 数据格式统一：所有事件都通过sse_event_bytes生成，符合SSE标准，避免前端解析异常
     可监控：
         - 链路追踪：全流程携带 trace_id，日志 / 错误 / 统计都包含，便于定位问题；
         - 性能统计：记录耗时、token 数，可分析接口性能瓶颈；
@@ -53,29 +396,159 @@ def chat(req: Request, body: ChatRequest):
         - error 事件精准展示错误，提升用户体验。
 """
 # 流式响应的异步聊天接口
-@router.post("/chat/stream")
-async def chat_stream(req: Request, body: ChatRequest):
+@router.post("/chat/stream", openapi_extra=_json_body(ChatRequest))
+async def chat_stream(req: Request, body: ChatRequest = Depends(chat_request)):
+    t0 = time.perf_counter()
     # 从请求上下文获取trace ID（链路追踪）
     trace_id = get_trace_id(req)
+    # 分阶段耗时，生成结束时放进 usage 事件
+    spans = spans_of(req)
+
+    # 断线重连（x-stream-id + Last-Event-ID）：接上仍在进行 / 刚结束的生成，从断点之后回放，不再请求后端；
+    # 流只能由发起它的同一个请求（同样的请求体和 API key）接上
+    replay = get_replay_store()
+    resume_from = last_event_id(req)
+    stream_id = req.headers.get(STREAM_ID_HEADER)
+    if replay is not None and resume_from is not None and stream_id:
+        stream = replay.get(stream_id)
+        if stream is not None:
+            if not stream.owned_by(stream_owner(req, body)):
+                raise HTTPException(status_code=403, detail={"trace_id": trace_id,
+                                                             "error": "stream belongs to a different request"})
+            if not stream.can_resume(resume_from):
+                raise HTTPException(status_code=409, detail={"trace_id": trace_id,
+                                                             "error": "events after Last-Event-ID are no longer buffered"})
+            return StreamingResponse(follow_stream(req, stream, resume_from, trace_id), media_type="text/event-stream",
+                                     headers={STREAM_ID_HEADER: stream.key})
+
     # 请求中的provider（mock/ollama）获取对应引擎实例
     engine = get_engine(body.provider)
+    labels = {"provider": engine.name, "model": getattr(engine, "model", None) or ""}
+
+    # 组装上下文：会话记忆（带 session_id 时拼出完整历史，必要时复用上一轮的 KV context）+ token 预算裁剪
+    with spans.span("prompt"):
+        prepared = prepare_prompt(req, body, engine)
+    turn = prepared.turn
+    trim = prepared.trim
+
+    # 确定性请求先查响应缓存；命中时把缓存的 token 序列按正常事件回放，不请求后端
+    # 会话请求依赖服务端历史，不走缓存和单飞合并
+    cache = get_cache() if turn is None and is_cacheable(body) else None
+    cache_key = request_key(body, getattr(engine, "model", None)) if cache is not None else None
+    cached = None
+    if cache is not None:
+        with spans.span("cache"):
+            cached = cache.get(cache_key)
+    cache_state = "bypass" if cache is None else ("hit" if cached is not None else "miss")
+    # 未命中缓存时，相同的并发确定性请求（temperature=0）合并为一次上游生成；采样请求每次应得到不同的回答，不合并
+    coalescer = get_coalescer() if cached is None and turn is None and is_cacheable(body) else None
+
+    # 准入控制：缓存命中和加入已有合并生成的请求不占用后端名额；其余请求先拿名额再开始流式响应，
+    # 拿不到名额时直接返回 429/503，而不是先返回 200 再在 SSE 里报错
+    slot = None
+    coalesce_key = None
+    if cached is None:
+        if coalescer is not None:
+            coalesce_key = cache_key or request_key(body, getattr(engine, "model", None))
+        if coalesce_key is None or not coalescer.has_flight(coalesce_key):
+            with spans.span("queue"):
+                slot = await admit(req, body, engine, trace_id, "chat_stream")
+    queue = {"queue_wait_ms": slot.wait_ms if slot else 0, "queue_depth": slot.queue_depth if slot else 0}
+
+    async def replay_cached():
+        for token in cached.tokens:
+            yield token
 
     # 定义异步生成器函数（核心：逐段产生响应数据）
-    async def gen():
+    # check_disconnect：由本生成器自己检测客户端断开（未开启续传时）；开启续传时生成在后台运行，由读取方检测
+    async def gen(check_disconnect: bool):
+        nonlocal slot
         start = time.perf_counter() # 记录开始时间（统计耗时）
         token_count = 0 # 统计返回的token数量
+        tokens = [] # 缓存未命中 / 会话请求时收集 token，正常结束后写入缓存或会话
+        state = prepared.state or GenerationState() # 引擎回填的后端统计（Ollama 的 eval_count 等）
+        collect = cache_state == "miss" or turn is not None
+        sub = None # 单飞合并的订阅（leader 或跟随者）
+        slot_owner = "request" # 执行名额由谁归还：本请求结束时归还，或交给合并的生成
+        first_at = last_at = 0.0 # 首个 / 上一个 token 事件的时间（首 token 延迟、token 间隔）
+        checked_at = time.perf_counter() # 上一次检查客户端是否断开的时间
+        source = None # token 来源（引擎流 / 缓存回放 / 合并订阅，可能套一层合批），结束时显式关闭
+        # 结果：ok / error；中途因客户端断开而结束（主动检测到断开、任务被取消、生成器被关闭）时保持 cancelled
+        outcome = "cancelled"
+        metrics.STREAMS_IN_FLIGHT.inc(provider=engine.name)
+        # 慢请求采样：在实际执行生成的 task 里登记（开启续传时是后台 task）
+        profiler = get_profiler()
+        probe = profiler.begin(trace_id) if profiler is not None else None
 
         # 把 trace / provider 发出去，前端好做初始化
-        yield sse_event("meta", {"trace_id": trace_id, "provider": engine.name})
+        yield sse_event_bytes("meta", {"trace_id": trace_id, "provider": engine.name, "resumable": replay is not None, **queue})
 
         try:
-            # 调用引擎的stream方法（异步迭代器），逐token获取回复
-            async for token in engine.stream(body.messages, body.temperature, body.top_p, body.max_tokens):
+            # 调用引擎的stream方法（异步迭代器），逐token获取回复；缓存命中时回放缓存内容
+            if cached is not None:
+                source = replay_cached()
+            elif coalescer is not None:
+                # 准入时要加入的生成在开始响应前已经结束：本请求会成为 leader，先补拿名额。
+                # 检查和 subscribe 之间没有 await，拿到名额后再有同样的生成出现时按跟随者处理（直接归还名额）
+                if slot is None and not coalescer.has_flight(coalesce_key):
+                    with spans.span("queue"):
+                        slot = await admit(req, body, engine, trace_id, "chat_stream")
+                    if slot is not None:
+                        queue.update(queue_wait_ms=slot.wait_ms, queue_depth=slot.queue_depth)
+                # leader 的名额交给合并的生成，在上游结束时归还；跟随者（期间已有同样的生成）直接归还
+                sub = coalescer.subscribe(coalesce_key, lambda: engine.stream(prepared.messages, body.temperature, body.top_p, body.max_tokens, state=state),
+                                          on_done=slot.release if slot is not None else None, state=state)
+                if sub.leader:
+                    slot_owner = "flight"
+                elif slot is not None:
+                    slot.release()
+                source = sub
+            else:
+                source = engine.stream(prepared.messages, body.temperature, body.top_p, body.max_tokens, state=state)
+            # 合批：首个 token 立即发送，之后按时间窗口 / 字节阈值合并相邻片段，减少小事件和 send 次数
+            flush_ms = body.stream_flush_ms if body.stream_flush_ms is not None else default_flush_ms()
+            if flush_ms > 0:
+                flush_bytes = body.stream_flush_bytes or default_flush_bytes()
+                source = batch_tokens(source, flush_ms, flush_bytes)
+            async for token in source:
+                now = time.perf_counter()
+                if token_count == 0:
+                    first_at = now
+                    spans.mark("ttft", now)
+                    metrics.TTFT_SECONDS.observe(now - t0, **labels)
+                else:
+                    metrics.INTER_TOKEN_SECONDS.observe(now - last_at, **labels)
+                last_at = now
                 token_count += 1 # 统计token数
-                yield sse_event("token", token) # 推送token事件，逐段返回数据给前端
+                if collect:
+                    tokens.append(token)
+                yield sse_event_bytes("token", token) # 推送token事件，逐段返回数据给前端
+                # 客户端已断开（例如关闭了浏览器标签页）：不再读取上游，finally 中关闭上游流让 Ollama 停止生成
+                if check_disconnect and now - checked_at >= DISCONNECT_CHECK_S:
+                    checked_at = now
+                    if await req.is_disconnected():
+                        return
+
+            # 跟随者没有自己请求后端：用 leader 的后端统计（token 数 / 耗时）
+            if sub is not None and not sub.leader and sub.state is not None:
+                state.stats.update(sub.state.stats)
+            # 合并场景只由 leader 写缓存
+            if cache_state == "miss" and (sub is None or sub.leader):
+                cache.put(cache_key, tokens)
+            if turn is not None:
+                prepared.store.commit(prepared.key, turn, "".join(tokens), engine)
 
             # 计算耗时（毫秒）
             latency_ms = int((time.perf_counter() - start) * 1000)
+            # 分阶段耗时：引擎的 connect + 解码 + Ollama 自己统计的 prompt 评估 / 解码耗时
+            for name, seconds in state.timings.items():
+                spans.add(name, seconds)
+            if token_count > 1:
+                spans.add("decode", last_at - first_at)
+            spans.merge_backend(state.stats)
+            spans.mark("total")
+            # 真实的 token 数和速度（eval_count / eval_duration）；token_events 只是发出的事件（分片）数
+            throughput = backend_throughput(state.stats)
 
             # 推送使用统计（usage事件）：包含性能、模型、token数等
             usage = {
@@ -84,24 +557,84 @@ async def chat_stream(req: Request, body: ChatRequest):
                 "model": getattr(engine, "model", None),
                 "latency_ms": latency_ms,
                 "token_events": token_count,
+                "cache": cache_state,
+                "coalesced": sub is not None and not sub.leader,
+                **queue,
             }
-            yield sse_event("usage", usage)
-            yield sse_event("done", "[DONE]") # 推送结束事件，前端停止接收
+            if turn is not None:
+                # context：复用了上一轮的 KV context，只发送了新消息；history：发送了完整历史
+                usage["session"] = "context" if turn.reused_context else "history"
+            if state.stats:
+                # 后端统计：Ollama 最终帧的 prompt_eval_count / eval_count / *_duration（纳秒）
+                usage["backend_stats"] = state.stats
+            usage.update(throughput)
+            usage["timings"] = spans.to_dict()
+            if trim is not None:
+                # 上下文裁剪统计：估算的 prompt token 数、被丢弃的消息数 / token 数
+                usage["prompt_tokens_est"] = trim.prompt_tokens
+                usage["dropped_messages"] = trim.dropped_messages
+                usage["dropped_tokens"] = trim.dropped_tokens
+            yield sse_event_bytes("usage", usage)
+            yield sse_event_bytes("done", "[DONE]") # 推送结束事件，前端停止接收
+
+            # 指标：整段耗时、吞吐（优先用后端的 eval_count / eval_duration）
+            outcome = "ok"
+            metrics.REQUESTS.inc(endpoint="chat_stream", outcome="ok", **labels)
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint="chat_stream", **labels)
+            if throughput.get("tokens_per_s"):
+                metrics.TOKENS_PER_SECOND.observe(throughput["tokens_per_s"], **labels)
+            elif token_count > 1 and last_at > first_at:
+                metrics.TOKENS_PER_SECOND.observe((token_count - 1) / (last_at - first_at), **labels)
 
-            # 打印日志：便于后端监控
-            print(f"[stream] trace={trace_id} provider={engine.name} model={usage['model']} latency_ms={latency_ms} token_events={token_count}")
+            # 结构化日志（后台线程写出，不阻塞事件循环）：便于后端监控
+            log_event("stream", trace_id=trace_id, provider=engine.name, model=usage["model"], latency_ms=latency_ms,
+                      token_events=token_count, timings=usage["timings"])
 
         except Exception as e:
+            outcome = "error"
+            metrics.REQUESTS.inc(endpoint="chat_stream", outcome="error", **labels)
             latency_ms = int((time.perf_counter() - start) * 1000)
             err = {
                 "trace_id": trace_id,
                 "provider": engine.name,
                 "model": getattr(engine, "model", None),
                 "latency_ms": latency_ms,
-                "error": f"{engine.name} failed: {str(e)}",
+                "error": e.detail["error"] if isinstance(e, HTTPException) else f"{engine.name} failed: {str(e)}",
             }
+            # 流中途出错时响应状态已经是 200，单独记一条错误日志（不参与采样）
+            log_event("stream_error", force=True, **err)
             # 异常时返回带trace_id的错误信息
-            yield sse_event("error", err)
+            yield sse_event_bytes("error", err)
+        finally:
+            metrics.STREAMS_IN_FLIGHT.dec(provider=engine.name)
+            metrics.STREAM_TOKENS.inc(token_count, outcome=outcome, **labels)
+            if probe is not None:
+                if "total" not in spans.spans:
+                    spans.mark("total")
+                profiler.end(probe, spans.to_dict(), endpoint="chat_stream", outcome=outcome)
+            # 显式关闭 token 来源：引擎流会关闭 httpx 响应（断开与 Ollama 的连接，Ollama 随即停止生成）。
+            # 任务被取消时仍在取消范围内，关闭过程需要屏蔽取消，否则第一次 await 就会再次被取消
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                with anyio.CancelScope(shield=True):
+                    try:
+                        await aclose()
+                    except Exception:
+                        pass
+            # 离开合并的生成；最后一个订阅者离开时取消上游
+            if sub is not None:
+                sub.close()
+            if slot is not None and slot_owner == "request":
+                slot.release()
+            if outcome == "cancelled":
+                metrics.REQUESTS.inc(endpoint="chat_stream", outcome="cancelled", **labels)
+                log_event("stream_cancelled", trace_id=trace_id, provider=engine.name, model=labels["model"],
+                          latency_ms=int((time.perf_counter() - start) * 1000), token_events=token_count)
 
+    # 开启续传时生成在后台运行，写入回放缓冲区，本次响应和之后的重连都从缓冲区读取；流 id 放在响应头里
+    if replay is not None:
+        stream = replay.start(gen(check_disconnect=False), owner=stream_owner(req, body))
+        return StreamingResponse(follow_stream(req, stream, 0, trace_id), media_type="text/event-stream",
+                                 headers={STREAM_ID_HEADER: stream.key})
     # 返回流式响应，指定媒体类型为纯文本
-    return StreamingResponse(gen(), media_type="text/event-stream")
+    return StreamingResponse(with_ids(gen(check_disconnect=True)), media_type="text/event-stream")
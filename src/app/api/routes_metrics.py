@@ -0,0 +1,110 @@
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.app.core.metrics import REGISTRY
+from src.app.core.resumable import get_replay_store
+from src.app.llm.cache import get_cache
+from src.app.llm.coalesce import get_coalescer
+from src.app.llm.engines import get_registry
+from src.app.llm.scheduler import get_admission
+from src.app.llm.sessions import get_session_store
+
+"""指标接口：GET /metrics（Prometheus 文本格式）
+    请求路径上直接记录的指标见 src/app/core/metrics.py；
+    缓存、准入队列、合并中的生成、会话数这些已有统计，在抓取时通过回调读取，不在热路径上重复计数。
+"""
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter()
+
+
+def _cache_events():
+    cache = get_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return [({"event": e}, stats[k]) for e, k in (("hit", "hits"), ("miss", "misses"), ("eviction", "evictions"))]
+
+
+def _cache_bytes():
+    cache = get_cache()
+    return [] if cache is None else [({}, cache.stats()["bytes"])]
+
+
+def _queue_depth():
+    controller = get_admission()
+    if controller is None:
+        return []
+    return [({"provider": p}, n) for p, n in controller.stats()["queued"].items()]
+
+
+def _active_slots():
+    controller = get_admission()
+    if controller is None:
+        return []
+    return [({"provider": p}, n) for p, n in controller.stats()["active"].items()]
+
+
+def _coalesced_flights():
+    coalescer = get_coalescer()
+    return [] if coalescer is None else [({}, coalescer.in_flight())]
+
+
+def _sessions():
+    store = get_session_store()
+    return [] if store is None else [({}, store.stats()["sessions"])]
+
+
+def _replay_streams():
+    store = get_replay_store()
+    if store is None:
+        return []
+    stats = store.stats()
+    return [({"state": "active"}, stats["active"]), ({"state": "finished"}, stats["streams"] - stats["active"])]
+
+
+def _replay_bytes():
+    store = get_replay_store()
+    return [] if store is None else [({}, store.stats()["bytes"])]
+
+
+def _backends():
+    for engine in get_registry().engines().values():
+        pool = getattr(engine, "backends", None)
+        if pool is not None:
+            yield from ((engine.name, b) for b in pool.backends)
+
+
+def _backend_outstanding():
+    return [({"provider": p, "backend": b.url}, b.outstanding) for p, b in _backends()]
+
+
+def _backend_up():
+    now = time.monotonic()
+    return [({"provider": p, "backend": b.url}, int(b.healthy and not b.circuit_open(now))) for p, b in _backends()]
+
+
+REGISTRY.callback("chat_cache_events_total", "Response cache lookups and evictions", ("event",), _cache_events,
+                  kind="counter")
+REGISTRY.callback("chat_cache_bytes", "Bytes held by the response cache", (), _cache_bytes)
+REGISTRY.callback("chat_admission_queue_depth", "Requests waiting for an execution slot", ("provider",),
+                  _queue_depth)
+REGISTRY.callback("chat_admission_active", "Execution slots currently held", ("provider",), _active_slots)
+REGISTRY.callback("chat_coalesced_flights", "Upstream generations shared by coalesced streams", (),
+                  _coalesced_flights)
+REGISTRY.callback("chat_sessions", "Server-side sessions held in memory", (), _sessions)
+REGISTRY.callback("chat_resumable_streams", "SSE streams held for Last-Event-ID resume", ("state",), _replay_streams)
+REGISTRY.callback("chat_resumable_bytes", "Bytes held by SSE replay buffers", (), _replay_bytes)
+REGISTRY.callback("llm_backend_outstanding", "In-flight requests per backend host", ("provider", "backend"),
+                  _backend_outstanding)
+REGISTRY.callback("llm_backend_up", "1 if the backend is healthy and its circuit is closed", ("provider", "backend"),
+                  _backend_up)
+
+
+@router.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,23 @@
+import os
+from typing import Dict
+
+"""环境变量配置的小工具"""
+
+
+# 布尔开关：1/true/yes/on 视为开启
+def env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+# 解析 "name=123,other=456" 形式的整数映射（模型名里可能带 ":"，按最后一个 "=" 切分）
+def parse_int_map(raw: str) -> Dict[str, int]:
+    result = {}
+    for item in (raw or "").split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if sep and name:
+            result[name.strip()] = int(value)
+    return result
+
+
+def env_int_map(name: str, default: str = "") -> Dict[str, int]:
+    return parse_int_map(os.getenv(name, default))
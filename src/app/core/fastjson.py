@@ -0,0 +1,33 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+"""快速 JSON 编解码
+    安装了 orjson 时用它解析请求体、序列化响应（长对话的大请求体上明显快于标准库 json），
+    没装时退回标准库 json，行为一致：
+        - loads 接受 bytes / str，解析失败抛出 json.JSONDecodeError（orjson 的异常是它的子类）；
+        - dumps 输出紧凑的 UTF-8 字节（与 JSONResponse 的默认格式一致：不转义非 ASCII、无多余空格）。
+"""
+
+JSONDecodeError = json.JSONDecodeError
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    dumps = orjson.dumps
+    HAS_ORJSON = True
+except ImportError:
+    loads = json.loads
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+    HAS_ORJSON = False
+
+
+class FastJSONResponse(JSONResponse):
+    """用 dumps 序列化的 JSONResponse；接口直接返回 dict，跳过 response_model 的校验和 jsonable_encoder"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
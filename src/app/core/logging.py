@@ -1,38 +1,223 @@
+import json
+import os
+import queue
+import random
+import sys
+import threading
 import time
 import uuid
+from typing import Any, Dict, Optional, TextIO
 from fastapi import FastAPI, Request
 
+"""链路追踪 + 耗时统计中间件，以及非阻塞的结构化日志输出
+    中间件是纯 ASGI 实现（不使用 @app.middleware("http") 即 BaseHTTPMiddleware）：
+        - 不给每个响应（尤其是很长的 SSE 流）额外包一层任务 + 队列；
+        - 同时记录响应头发出的时间（header_ms）和响应体真正发完的时间（total_ms），
+          流式接口的 total_ms 才是完整耗时。
+    日志不在事件循环里同步 print，而是放进有界队列，由后台线程写成一行一条的 JSON：
+        - 队列满时直接丢弃（计数），请求处理永远不会被日志阻塞；
+        - 采样：LOG_SAMPLE_RATE（默认 1）按比例记录普通请求，5xx 和错误总是记录；
+        - 限流：LOG_RATE_LIMIT（默认 0，不限制）每秒最多写多少条，超出的丢弃（计数）；
+        - LOG_QUEUE_SIZE（默认 10000）：队列长度上限。
+"""
+
 # 定义 trace ID 在HTTP头中的键名，用于在请求 / 响应头中传递 trace ID
 TRACE_ID_HEADER = "x-trace-id"
+_TRACE_ID_HEADER_BYTES = TRACE_ID_HEADER.encode("latin-1")
 
 # 从请求对象中获取 trace ID
 def get_trace_id(req: Request) -> str:
     # 在接口处理函数中，可以通过这个函数快速获取当前请求的 trace ID，方便日志记录、业务逻辑关联等。
     return getattr(req.state, "trace_id", "no-trace")
 
+
+class LogSink:
+    """队列 + 后台线程的 JSON 日志输出"""
+
+    def __init__(self, stream: Optional[TextIO] = None, sample_rate: float = 1.0, rate_limit: float = 0.0,
+                 max_queue: int = 10000):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.rate_limit = rate_limit
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # 令牌桶（每秒 rate_limit 个令牌，桶容量同为 rate_limit）
+        self._tokens = rate_limit
+        self._refilled_at = time.monotonic()
+        self.written = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+        self.dropped = 0
+
+    # 提交一条日志；force=True 的记录（错误）不参与采样
+    def emit(self, record: Dict[str, Any], force: bool = False) -> bool:
+        if not force and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        if self.rate_limit > 0 and not self._take_token():
+            self.rate_limited += 1
+            return False
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            try:
+                if record is None:
+                    return
+                stream = self.stream or sys.stdout
+                stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                # 队列里暂时没有更多记录时再 flush，批量写出
+                if self._queue.empty():
+                    stream.flush()
+                self.written += 1
+            except Exception:
+                self.dropped += 1
+            finally:
+                self._queue.task_done()
+
+    # 等待队列中已有的记录写完（测试 / 关闭时使用）
+    def flush(self, timeout_s: float = 1.0) -> None:
+        deadline = time.monotonic() + timeout_s
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    # 写完剩余记录后停止后台线程
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=1.0)
+        self._thread = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+            "dropped": self.dropped,
+        }
+
+    @classmethod
+    def from_env(cls) -> "LogSink":
+        return cls(
+            sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "1")),
+            rate_limit=float(os.getenv("LOG_RATE_LIMIT", "0")),
+            max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        )
+
+
+_sink: Optional[LogSink] = None
+
+
+# 获取全局日志输出（首次使用时按环境变量创建）
+def get_log_sink() -> LogSink:
+    global _sink
+    if _sink is None:
+        _sink = LogSink.from_env()
+    return _sink
+
+
+# 替换全局日志输出，返回旧的
+def set_log_sink(sink: Optional[LogSink]) -> Optional[LogSink]:
+    global _sink
+    old, _sink = _sink, sink
+    return old
+
+
+# 记录一条结构化日志（event 为日志类型，例如 "request" / "stream"）
+def log_event(event: str, force: bool = False, **fields: Any) -> None:
+    get_log_sink().emit({"ts": round(time.time(), 3), "event": event, **fields}, force=force)
+
+
+class TraceTimingMiddleware:
+    """纯 ASGI 中间件：trace ID + 响应头 / 响应体耗时 + 访问日志"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # 生成或获取 trace ID
+        # 优先从请求头中取 x-trace-id（比如客户端传递的），没有则生成 UUID 作为 trace ID
+        trace_id = None
+        for name, value in scope.get("headers", ()):
+            if name == _TRACE_ID_HEADER_BYTES:
+                trace_id = value.decode("latin-1")
+                break
+        trace_id = trace_id or str(uuid.uuid4())
+        t0 = time.perf_counter()
+        # 将 trace ID 存入请求上下文（request.state.trace_id），供后续接口逻辑使用；
+        # 请求开始时间（request.state.started_at）供分阶段耗时使用
+        state = scope.setdefault("state", {})
+        state["trace_id"] = trace_id
+        state["started_at"] = t0
+        status = 500
+        header_ms = None
+
+        async def send_wrapper(message):
+            nonlocal status, header_ms
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header_ms = (time.perf_counter() - t0) * 1000
+                # 将 trace ID 写入响应头，让客户端能拿到这个 ID（方便排查问题）
+                headers = [(k, v) for k, v in message.get("headers", ()) if k.lower() != _TRACE_ID_HEADER_BYTES]
+                headers.append((_TRACE_ID_HEADER_BYTES, trace_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # 响应体全部发完（或异常结束）时才记录完整耗时
+            total_ms = (time.perf_counter() - t0) * 1000
+            log_event(
+                "request",
+                force=error is not None or status >= 500,
+                trace_id=trace_id,
+                method=scope.get("method"),
+                path=scope.get("path"),
+                status=status,
+                header_ms=round(header_ms, 1) if header_ms is not None else None,
+                total_ms=round(total_ms, 1),
+                **({"error": error} if error else {}),
+            )
+
+
 """日志中间件安装函数
-    FastAPI 的 middleware("http") 是全局 HTTP 中间件，会拦截所有的 HTTP 请求和响应，执行顺序是：
-    客户端请求 → 中间件前置逻辑 → 接口处理函数 → 中间件后置逻辑 → 客户端响应
+    作为最外层的 ASGI 中间件包住整个应用，执行顺序是：
+    客户端请求 → 生成 trace ID → 接口处理函数 → 响应头（记录 header_ms）→ 响应体发完（记录 total_ms、写日志）
 """
 def install_logging_middleware(app: FastAPI) -> None:
-    @app.middleware("http")
-    async def add_trace_and_timing(request: Request, call_next):
-        # 生成或获取 trace ID
-        # 优先从请求头中取 x-trace-id（比如客户端传递的），没有则生成 UUID 作为 trace ID
-        trace_id = request.headers.get(TRACE_ID_HEADER) or str(uuid.uuid4())
-        # 将 trace ID 存入请求上下文，供后续接口逻辑使用
-        request.state.trace_id = trace_id
-
-        # 记录请求开始时间（秒级时间戳）
-        t0 = time.time()
-        # 执行后续逻辑（调用接口处理函数，获取响应）
-        response = await  call_next(request)
-        # 计算请求耗时（转换为毫秒，保留1位小数）
-        cost_ms = (time.time() - t0) * 1000
-
-        # 将 trace ID 写入响应头，让客户端能拿到这个 ID（方便排查问题）
-        response.headers[TRACE_ID_HEADER] = trace_id
-        # 打印结构化日志，包含关键信息
-        print(f"[trace={trace_id}] {request.method} {request.url.path} {response.status_code} {cost_ms:.1f}ms")
-        # 返回响应给客户端
-        return response
\ No newline at end of file
+    app.add_middleware(TraceTimingMiddleware)
@@ -0,0 +1,286 @@
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+"""进程内指标（Prometheus 文本格式）
+    轻量的 Counter / Gauge / Histogram，实现上只有一次 dict 查找 + 一次加法（直方图多一次 bisect），
+    在 chat / chat_stream / 引擎里直接记录，通过 GET /metrics 以 Prometheus 文本格式导出。
+    多进程（uvicorn --workers N）模式：
+        设置 PROMETHEUS_MULTIPROC_DIR 后，每个 worker 定期（以及每次被抓取时）把自己的快照写到
+        <dir>/metrics_<pid>.json；/metrics 读取目录下所有快照合并后输出：
+            - counter / histogram：跨进程求和（已退出进程的累计值也保留）；
+            - gauge：只合并仍存活进程的值并求和（例如各 worker 的在途流数相加）。
+        METRICS_FLUSH_INTERVAL_S（默认 5）控制后台写快照的间隔。
+"""
+
+LabelValues = Tuple[str, ...]
+
+# 默认直方图桶（秒）：覆盖从几毫秒的 token 间隔到几十秒的整段生成
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"values": [[list(k), v] for k, v in self._values.items()]}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label -> [每个桶的计数（非累计）..., +Inf 桶计数, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"buckets": list(self.buckets), "values": [[list(k), list(v)] for k, v in self._values.items()]}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # 抓取时才计算的指标（例如缓存命中计数、队列深度），值由其他模块已有的统计提供
+        self._callbacks: Dict[str, Tuple[str, str, Tuple[str, ...], Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = {}
+        self._last_flush = 0.0
+        self._flusher: Optional[threading.Thread] = None
+
+    def _add(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    # 注册一个抓取时计算的指标：fn 返回 [(labels, value), ...]；kind 为 gauge 或 counter
+    def callback(self, name: str, help: str, labelnames: Sequence[str],
+                 fn: Callable[[], Iterable[Tuple[Dict[str, str], float]]], kind: str = "gauge") -> None:
+        self._callbacks[name] = (kind, help, tuple(labelnames), fn)
+
+    def snapshot(self) -> dict:
+        metrics = {}
+        for m in self._metrics.values():
+            metrics[m.name] = {"kind": m.kind, "help": m.help, "labelnames": list(m.labelnames), **m.snapshot()}
+        for name, (kind, help, labelnames, fn) in self._callbacks.items():
+            try:
+                rows = [[[str(labels.get(n, "")) for n in labelnames], float(v)] for labels, v in fn()]
+            except Exception:
+                rows = []
+            metrics[name] = {"kind": kind, "help": help, "labelnames": list(labelnames), "values": rows}
+        return {"pid": os.getpid(), "time": time.time(), "metrics": metrics}
+
+    # ---------- 多进程 ----------
+
+    def multiproc_dir(self) -> Optional[str]:
+        return os.getenv("PROMETHEUS_MULTIPROC_DIR") or None
+
+    # 把本进程快照写到共享目录（先写临时文件再原子替换，读方不会读到半个文件）
+    def flush(self) -> None:
+        directory = self.multiproc_dir()
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"metrics_{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+        self._last_flush = time.monotonic()
+
+    # 启动后台线程定期写快照（多进程模式下在 lifespan 启动时调用）
+    def start_flusher(self, interval_s: Optional[float] = None) -> None:
+        if not self.multiproc_dir() or (self._flusher is not None and self._flusher.is_alive()):
+            return
+        interval = interval_s if interval_s is not None else float(os.getenv("METRICS_FLUSH_INTERVAL_S", "5"))
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _collect_snapshots(self) -> List[dict]:
+        directory = self.multiproc_dir()
+        if not directory:
+            return [self.snapshot()]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    # ---------- 导出 ----------
+
+    def render(self) -> str:
+        merged: Dict[str, dict] = {}
+        for snap in self._collect_snapshots():
+            alive = _pid_alive(snap.get("pid"))
+            for name, m in snap["metrics"].items():
+                if m["kind"] == "gauge" and not alive:
+                    continue
+                target = merged.setdefault(name, {"kind": m["kind"], "help": m["help"], "labelnames": m["labelnames"],
+                                                  "buckets": m.get("buckets"), "values": {}})
+                for labels, value in m["values"]:
+                    key = tuple(labels)
+                    if m["kind"] == "histogram":
+                        row = target["values"].get(key)
+                        target["values"][key] = list(value) if row is None else [a + b for a, b in zip(row, value)]
+                    else:
+                        target["values"][key] = target["values"].get(key, 0.0) + value
+
+        lines = []
+        for name in sorted(merged):
+            m = merged[name]
+            lines.append(f"# HELP {name} {m['help']}")
+            lines.append(f"# TYPE {name} {m['kind']}")
+            names = m["labelnames"]
+            for key in sorted(m["values"]):
+                value = m["values"][key]
+                if m["kind"] == "histogram":
+                    cumulative = 0.0
+                    for bound, count in zip(list(m["buckets"]) + [math.inf], value[:-1]):
+                        cumulative += count
+                        le = 'le="' + _fmt_value(bound) + '"'
+                        lines.append(f"{name}_bucket{_fmt_labels(names, key, le)} {_fmt_value(cumulative)}")
+                    lines.append(f"{name}_sum{_fmt_labels(names, key)} {_fmt_value(value[-1])}")
+                    lines.append(f"{name}_count{_fmt_labels(names, key)} {_fmt_value(cumulative)}")
+                else:
+                    lines.append(f"{name}{_fmt_labels(names, key)} {_fmt_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid) -> bool:
+    if pid is None or pid == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError, OSError):
+        return True
+    return True
+
+
+# 全局指标注册表
+REGISTRY = MetricsRegistry()
+
+# ---------- 聊天服务的指标 ----------
+
+REQUESTS = REGISTRY.counter(
+    "chat_requests_total", "Chat requests by endpoint, provider, model and outcome",
+    ("endpoint", "provider", "model", "outcome"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "chat_request_duration_seconds", "End-to-end generation time per request",
+    ("endpoint", "provider", "model"))
+TTFT_SECONDS = REGISTRY.histogram(
+    "chat_time_to_first_token_seconds", "Time from request start to the first streamed token",
+    ("provider", "model"))
+INTER_TOKEN_SECONDS = REGISTRY.histogram(
+    "chat_inter_token_seconds", "Gap between consecutive streamed token events",
+    ("provider", "model"),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "chat_tokens_per_second", "Decode throughput per request (backend eval stats when available)",
+    ("provider", "model"),
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400))
+STREAM_TOKENS = REGISTRY.counter(
+    "chat_stream_token_events_total", "Token events sent on /chat/stream by outcome (ok, error, cancelled)",
+    ("provider", "model", "outcome"))
+STREAMS_IN_FLIGHT = REGISTRY.gauge(
+    "chat_streams_in_flight", "Currently open /chat/stream responses", ("provider",))
+BACKEND_SECONDS = REGISTRY.histogram(
+    "llm_backend_request_seconds", "Backend call latency (full response, or until headers for streams)",
+    ("provider", "model", "op"))
+BACKEND_ERRORS = REGISTRY.counter(
+    "llm_backend_errors_total", "Backend call failures", ("provider", "model", "op"))
@@ -0,0 +1,176 @@
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from src.app.core.logging import log_event
+
+"""慢请求采样分析器（可选）
+    分阶段耗时能说明慢在哪个阶段，但说明不了阶段里具体卡在哪一行代码。开启后（CHAT_PROFILE_SLOW_MS > 0）：
+        - 每个 /chat、/chat/stream 请求开始时登记一个探针，后台线程每隔 CHAT_PROFILE_INTERVAL_MS（默认 10）毫秒采样一次：
+            - task：请求所在 task 的协程调用链（正在 await 什么：排队、等 Ollama 响应头、读流……），按 async generator 展开；
+            - thread：事件循环线程此刻的调用栈（CPU 花在哪里，可能是别的请求）；
+        - 请求结束时总耗时超过阈值，把出现次数最多的调用栈（折叠格式：外层;内层）连同分阶段耗时
+          写一条 slow_request 日志（不参与采样）；没超过阈值的请求直接丢弃样本。
+    没有慢请求在进行时采样线程只是阻塞等待，不开启时（默认）完全没有开销。
+    环境变量：
+        - CHAT_PROFILE_SLOW_MS（默认 0，不开启）：慢请求阈值（毫秒）
+        - CHAT_PROFILE_INTERVAL_MS（默认 10）：采样间隔（毫秒）
+"""
+
+# 每个调用栈最多保留的帧数（取最内层）
+MAX_DEPTH = 40
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+# 线程调用栈：从最外层到最内层
+def _thread_stack(frame) -> List[str]:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return names
+
+
+# 协程的 await 链：协程 → 它正在 await 的协程 / async generator → ……
+def _await_chain(obj) -> List[str]:
+    names = []
+    for _ in range(MAX_DEPTH * 2):
+        if obj is None:
+            break
+        frame = getattr(obj, "cr_frame", None) or getattr(obj, "ag_frame", None) or getattr(obj, "gi_frame", None)
+        if frame is not None:
+            names.append(f"{_frame_name(frame)}:{frame.f_lineno}")
+        nxt = getattr(obj, "cr_await", None) or getattr(obj, "ag_await", None) or getattr(obj, "gi_yieldfrom", None)
+        if nxt is None and frame is None:
+            # async for 等待的是 async_generator_asend 之类的包装对象，没有公开属性指向生成器本身，从引用里找回来
+            nxt = next((r for r in gc.get_referents(obj) if hasattr(r, "ag_frame")), None)
+        obj = nxt
+    return names[-MAX_DEPTH:]
+
+
+class _Probe:
+    __slots__ = ("trace_id", "root", "thread_id", "started", "task_stacks", "thread_stacks", "samples")
+
+    def __init__(self, trace_id: str, root, thread_id: int):
+        self.trace_id = trace_id
+        self.root = root
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.task_stacks: Counter = Counter()
+        self.thread_stacks: Counter = Counter()
+        self.samples = 0
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms: float, interval_ms: float = 10.0, max_samples: int = 5000, top: int = 10,
+                 on_slow: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.threshold_ms = threshold_ms
+        self.interval_s = interval_ms / 1000
+        self.max_samples = max_samples
+        self.top = top
+        # 捕获到慢请求时的回调，默认写一条 slow_request 日志
+        self.on_slow = on_slow or (lambda record: log_event("slow_request", force=True, **record))
+        self._probes: Dict[int, _Probe] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.slow = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SlowRequestProfiler"]:
+        threshold_ms = float(os.getenv("CHAT_PROFILE_SLOW_MS", "0"))
+        if threshold_ms <= 0:
+            return None
+        return cls(threshold_ms, interval_ms=float(os.getenv("CHAT_PROFILE_INTERVAL_MS", "10")))
+
+    # 开始分析当前请求：在请求所在的 task 里调用（root 默认为当前 task）
+    def begin(self, trace_id: str, root=None) -> _Probe:
+        probe = _Probe(trace_id, root or asyncio.current_task(), threading.get_ident())
+        with self._lock:
+            self._probes[id(probe)] = probe
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return probe
+
+    # 请求结束：超过阈值时汇总样本并回调，返回记录；否则返回 None
+    def end(self, probe: _Probe, timings: Optional[Dict[str, float]] = None, **fields: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._probes.pop(id(probe), None)
+        elapsed_ms = (time.perf_counter() - probe.started) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return None
+        self.slow += 1
+        record = {
+            "trace_id": probe.trace_id,
+            "elapsed_ms": round(elapsed_ms, 1),
+            "samples": probe.samples,
+            "interval_ms": self.interval_s * 1000,
+            **fields,
+            "timings": timings or {},
+            "task_stacks": [{"stack": s, "count": n} for s, n in probe.task_stacks.most_common(self.top)],
+            "thread_stacks": [{"stack": s, "count": n} for s, n in probe.thread_stacks.most_common(self.top)],
+        }
+        self.on_slow(record)
+        return record
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                probes = list(self._probes.values())
+                if not probes:
+                    self._wake.clear()
+            if not probes:
+                self._wake.wait()
+                continue
+            self._sample(probes)
+            time.sleep(self.interval_s)
+
+    def _sample(self, probes: List[_Probe]) -> None:
+        frames = sys._current_frames()
+        for probe in probes:
+            if probe.samples >= self.max_samples:
+                continue
+            probe.samples += 1
+            try:
+                root = probe.root.get_coro() if isinstance(probe.root, asyncio.Task) else probe.root
+                chain = _await_chain(root)
+                if chain:
+                    probe.task_stacks[";".join(chain)] += 1
+                frame = frames.get(probe.thread_id)
+                if frame is not None:
+                    probe.thread_stacks[";".join(_thread_stack(frame))] += 1
+            except Exception:
+                # 采样时请求所在的线程还在运行，读到一半变化的调用链直接丢弃这次样本
+                pass
+
+
+_profiler: Optional[SlowRequestProfiler] = None
+_profiler_loaded = False
+
+
+# 获取全局慢请求分析器；未开启（CHAT_PROFILE_SLOW_MS=0）时返回 None
+def get_profiler() -> Optional[SlowRequestProfiler]:
+    global _profiler, _profiler_loaded
+    if not _profiler_loaded:
+        _profiler = SlowRequestProfiler.from_env()
+        _profiler_loaded = True
+    return _profiler
+
+
+# 替换全局慢请求分析器（None 表示关闭），返回旧的
+def set_profiler(profiler: Optional[SlowRequestProfiler]) -> Optional[SlowRequestProfiler]:
+    global _profiler, _profiler_loaded
+    old, _profiler, _profiler_loaded = _profiler, profiler, True
+    return old
@@ -0,0 +1,244 @@
+import asyncio
+import hmac
+import os
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+from src.app.core.config import env_flag
+
+"""可续传的 SSE 流（Last-Event-ID）
+    每个 SSE 事件都带递增的 id；生成过程与 HTTP 响应解耦：
+        - 生成（producer）在后台 task 中运行，把编好 id 的事件写进这个流的回放缓冲区（有界环形缓冲）；
+        - HTTP 响应（consumer）从缓冲区读取，首次请求从头读，重连时从 Last-Event-ID 之后读；
+        - 客户端断开后不立即取消生成，而是等待宽限期（grace）：期间重连（带 x-stream-id + Last-Event-ID）
+          直接接上仍在进行的生成，不会再次请求后端；宽限期内无人重连才取消上游生成；
+        - 生成结束后缓冲区再保留 ttl 秒，期间重连可以回放尾部。
+    续传凭证：每个流的 id 由服务端随机生成（不可猜测），通过 x-stream-id 响应头返回给客户端；
+    流上还记录发起请求的身份摘要（请求体 + API key），重连时摘要不一致直接拒绝，
+    不能靠客户端自己传的 x-trace-id 接上别人的流，trace id 重复也不会顶掉正在进行的流。
+    内存上限：每个流的缓冲区有字节上限（超出丢弃最旧的事件），全部流有总字节上限（超出先淘汰最早结束的流）。
+    环境变量：
+        - CHAT_RESUME_ENABLED（默认 0）：是否开启
+        - CHAT_RESUME_GRACE_S（默认 5）：断开后等待重连的宽限期（秒），0 表示断开即取消
+        - CHAT_RESUME_TTL_S（默认 60）：结束的流保留多久（秒）
+        - CHAT_RESUME_STREAM_BYTES（默认 1 MiB）：单个流的回放缓冲上限
+        - CHAT_RESUME_MAX_BYTES（默认 64 MiB）：全部流的缓冲总上限
+"""
+
+
+class ReplayGap(Exception):
+    """请求的 Last-Event-ID 已经被挤出回放缓冲区，无法无缝续传"""
+
+
+def frame(event_id: int, payload: bytes) -> bytes:
+    # SSE 的 id 行放在 event / data 之前，客户端重连时把最后收到的 id 放进 Last-Event-ID 请求头
+    return b"id: %d\n" % event_id + payload
+
+
+class ResumableStream:
+    def __init__(self, key: str, store: "ReplayStore", owner: str = ""):
+        self.key = key
+        # 发起请求的身份摘要，续传时必须一致
+        self.owner = owner
+        self._store = store
+        self.events: Deque[Tuple[int, bytes]] = deque()
+        self.bytes = 0
+        self.last_id = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.consumers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._grace: Optional[asyncio.TimerHandle] = None
+        # 是否仍计入存储的总字节数（被淘汰 / 替换后不再计入，后台生成仍可继续写给已连接的读取方）
+        self.tracked = True
+
+    # 追加一个事件（payload 为不含 id 的 SSE 字节），返回分配的 id
+    def append(self, payload: bytes) -> int:
+        self.last_id += 1
+        data = frame(self.last_id, payload)
+        self.events.append((self.last_id, data))
+        self.bytes += len(data)
+        self._store._account(self, len(data))
+        # 单个流超出上限：丢弃最旧的事件（至少保留最新一个）
+        while self.bytes > self._store.stream_bytes and len(self.events) > 1:
+            self._drop_oldest()
+        self._store._enforce(self)
+        self._notify()
+        return self.last_id
+
+    def _drop_oldest(self) -> None:
+        _, data = self.events.popleft()
+        self.bytes -= len(data)
+        self._store._account(self, -len(data))
+
+    def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._cancel_grace()
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    # after_id 之后的事件是否都还在缓冲区里（能否无缝续传）
+    def can_resume(self, after_id: int) -> bool:
+        return not self.events or self.events[0][0] <= after_id + 1
+
+    # 从 after_id 之后开始读取事件，直到流结束
+    async def follow(self, after_id: int = 0) -> AsyncIterator[bytes]:
+        if not self.can_resume(after_id):
+            raise ReplayGap(f"events after {after_id} are no longer buffered")
+        cursor = after_id
+        while True:
+            changed = self._changed
+            for event_id, data in list(self.events):
+                if event_id > cursor:
+                    cursor = event_id
+                    yield data
+            if self.done and cursor >= self.last_id:
+                return
+            if self.events and self.events[0][0] > cursor + 1:
+                # 读得太慢，未读的事件已经被挤出缓冲区
+                raise ReplayGap(f"consumer fell behind the replay buffer at {cursor}")
+            await changed.wait()
+
+    def attach(self) -> None:
+        self.consumers += 1
+        self._cancel_grace()
+
+    # 一个 consumer 离开；没有 consumer 且生成还在进行时，宽限期后取消生成
+    def detach(self) -> None:
+        self.consumers -= 1
+        if self.consumers > 0 or self.done or self.task is None:
+            return
+        grace = self._store.grace_s
+        if grace <= 0:
+            self.task.cancel()
+        else:
+            self._grace = self.loop.call_later(grace, self._expire)
+
+    def _expire(self) -> None:
+        self._grace = None
+        if self.consumers == 0 and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def _cancel_grace(self) -> None:
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+
+    def owned_by(self, owner: str) -> bool:
+        return hmac.compare_digest(self.owner, owner)
+
+    # 当前事件循环里能否继续使用：进行中的流绑定创建它的事件循环
+    def usable(self) -> bool:
+        return self.done or (self.loop is asyncio.get_running_loop() and not self.loop.is_closed())
+
+
+class ReplayStore:
+    def __init__(self, grace_s: float = 5.0, ttl_s: float = 60.0, stream_bytes: int = 1024 * 1024,
+                 max_bytes: int = 64 * 1024 * 1024):
+        self.grace_s = grace_s
+        self.ttl_s = ttl_s
+        self.stream_bytes = stream_bytes
+        self.max_bytes = max_bytes
+        self._streams: "OrderedDict[str, ResumableStream]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def _account(self, stream: ResumableStream, delta: int) -> None:
+        if stream.tracked:
+            self._bytes += delta
+
+    # 总量超出上限：先按结束时间淘汰已结束的流，仍然超出时从正在写入的流丢弃最旧事件
+    def _enforce(self, writing: ResumableStream) -> None:
+        if self._bytes <= self.max_bytes:
+            return
+        finished = sorted((s for s in self._streams.values() if s.done), key=lambda s: s.finished_at)
+        for s in finished:
+            if self._bytes <= self.max_bytes:
+                return
+            self._remove(s.key)
+        while self._bytes > self.max_bytes and len(writing.events) > 1:
+            writing._drop_oldest()
+
+    def _remove(self, key: str) -> None:
+        s = self._streams.pop(key, None)
+        if s is not None:
+            self._bytes -= s.bytes
+            s.tracked = False
+            self.evictions += 1
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for key in [k for k, s in self._streams.items() if s.done and now - s.finished_at > self.ttl_s]:
+            self._remove(key)
+
+    def get(self, key: str) -> Optional[ResumableStream]:
+        self._sweep()
+        s = self._streams.get(key)
+        if s is not None and not s.usable():
+            self._remove(key)
+            return None
+        return s
+
+    # 为一次新的生成创建流（流 id 由服务端随机生成，通过 stream.key 返回给客户端）；
+    # source 产出不带 id 的 SSE 事件字节，在后台 task 中写入缓冲区；owner 是发起请求的身份摘要
+    def start(self, source: AsyncIterator[bytes], owner: str = "") -> ResumableStream:
+        self._sweep()
+        key = secrets.token_urlsafe(16)
+        stream = ResumableStream(key, self, owner)
+        self._streams[key] = stream
+
+        async def pump():
+            try:
+                async for payload in source:
+                    stream.append(payload)
+            finally:
+                stream.finish()
+
+        stream.task = asyncio.get_running_loop().create_task(pump())
+        return stream
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streams": len(self._streams),
+            "active": sum(1 for s in self._streams.values() if not s.done),
+            "bytes": self._bytes,
+            "evictions": self.evictions,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ReplayStore":
+        return cls(
+            grace_s=float(os.getenv("CHAT_RESUME_GRACE_S", "5")),
+            ttl_s=float(os.getenv("CHAT_RESUME_TTL_S", "60")),
+            stream_bytes=int(os.getenv("CHAT_RESUME_STREAM_BYTES", str(1024 * 1024))),
+            max_bytes=int(os.getenv("CHAT_RESUME_MAX_BYTES", str(64 * 1024 * 1024))),
+        )
+
+
+_store: Optional[ReplayStore] = None
+_store_loaded = False
+
+
+# 获取全局回放存储；未开启（CHAT_RESUME_ENABLED=0）时返回 None
+def get_replay_store() -> Optional[ReplayStore]:
+    global _store, _store_loaded
+    if not _store_loaded:
+        if env_flag("CHAT_RESUME_ENABLED", "0"):
+            _store = ReplayStore.from_env()
+        _store_loaded = True
+    return _store
+
+
+# 替换全局回放存储（None 表示关闭），返回旧的
+def set_replay_store(store: Optional[ReplayStore]) -> Optional[ReplayStore]:
+    global _store, _store_loaded
+    old, _store, _store_loaded = _store, store, True
+    return old
@@ -1,5 +1,6 @@
 import json
-from typing import Any
+import os
+from typing import Any, Callable, Dict
 
 """SSE多行data的标准规范
     普通的SSE的data是单行的，但如过要推送包含换行符的文本（多行回复，代码块），SSE规定：
@@ -24,4 +25,53 @@ def sse_event(event: str, data: Any) -> str:
     data_lines = "".join([f"data: {line}\n" for line in lines])
 
     # SSE 框架：event + data + blank line
-    return f"event: {event}\n{data_lines}\n"
\ No newline at end of file
+    return f"event: {event}\n{data_lines}\n"
+
+
+"""字节级 SSE 编码（sse_event_bytes）
+    sse_event 每个 token 都要走 _to_text -> splitlines -> 列表推导 -> f-string，返回的 str 还要被 Starlette 再编码成 bytes。
+    sse_event_bytes 直接产出 bytes，且与 sse_event(...).encode("utf-8") 逐字节一致：
+        - 快速路径：不含换行的字符串（最常见的单行 token）只做一次编码和一次拼接；
+        - 常用事件类型的 "event: xxx\ndata: " 头部预先编码好；
+        - usage/meta/error 等结构化数据可选更快的 JSON 后端（SSE_JSON_BACKEND=orjson，需安装 orjson）。
+          注意 orjson 输出是紧凑格式（没有 ", " / ": " 中的空格），与默认输出语义相同但不再逐字节一致，因此默认关闭。
+"""
+
+# 预编码的事件头部（含第一行的 "data: " 前缀）
+_EVENT_PREFIXES: Dict[str, bytes] = {
+    name: f"event: {name}\ndata: ".encode("utf-8") for name in ("meta", "token", "usage", "done", "error")
+}
+
+
+def _event_prefix(event: str) -> bytes:
+    prefix = _EVENT_PREFIXES.get(event)
+    if prefix is None:
+        prefix = f"event: {event}\ndata: ".encode("utf-8")
+    return prefix
+
+
+def _load_json_backend() -> Callable[[Any], str]:
+    if os.getenv("SSE_JSON_BACKEND", "json").strip().lower() == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            return lambda data: orjson.dumps(data).decode("utf-8")
+    return lambda data: json.dumps(data, ensure_ascii=False)
+
+
+_dumps = _load_json_backend()
+
+
+def sse_event_bytes(event: str, data: Any) -> bytes:
+    if isinstance(data, str):
+        text = data
+    else:
+        text = _dumps(data)
+    # 快速路径：单行数据（isprintable 为 True 时一定不含换行符）
+    if text.isprintable():
+        return _event_prefix(event) + text.encode("utf-8") + b"\n\n"
+    # 其余直接按 sse_event 相同的逐行 data: 规则拆分（不含换行的非可打印文本拆出来也只有一行，结果不变）
+    lines = text.splitlines() or [""]
+    return _event_prefix(event) + "\ndata: ".join(lines).encode("utf-8") + b"\n\n"
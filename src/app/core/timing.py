@@ -0,0 +1,79 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from fastapi import Request
+
+"""单个请求的分阶段耗时（span 记录器）
+    慢请求只看总的 latency_ms 分不清时间花在哪里：排队、组装 prompt、连接 Ollama、prompt 评估、首 token 还是解码。
+    /chat、/chat/stream 的各个阶段都写进同一个 SpanRecorder（每个请求一个，挂在 request.state 上）：
+        - read / parse：读取请求体 / 解析校验
+        - prompt：组装上下文（会话记忆 + token 预算裁剪）；cache：查响应缓存；queue：准入排队
+        - connect：向后端发出请求到收到响应头（引擎写在 GenerationState.timings 里）；backend：/chat 的整个后端调用
+        - ttft：从请求开始到首个 token；decode：首个 token 到最后一个 token；total：整个请求
+        - backend_load / backend_prompt_eval / backend_eval：Ollama 最终帧里的 load_duration / prompt_eval_duration / eval_duration
+    结果以 {name}_ms 的形式放进 usage 事件，/chat 则放进 Server-Timing 响应头（浏览器开发者工具可以直接显示）。
+    记录器只是一个 dict + perf_counter，开销可以忽略，始终开启。
+"""
+
+
+class SpanRecorder:
+    __slots__ = ("started", "spans")
+
+    def __init__(self, started: Optional[float] = None):
+        # 请求开始的时间（perf_counter）；由中间件提供时包含读取请求头之后的全部耗时
+        self.started = started if started is not None else time.perf_counter()
+        # 阶段名 -> 耗时（秒），按记录顺序
+        self.spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    # 记录从请求开始到 at（默认现在）的耗时，例如 ttft、total
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        self.spans[name] = (at if at is not None else time.perf_counter()) - self.started
+
+    # 合并后端自己统计的耗时（Ollama 最终帧，单位纳秒）
+    def merge_backend(self, stats: Dict[str, Any]) -> None:
+        for key, name in (("load_duration", "backend_load"), ("prompt_eval_duration", "backend_prompt_eval"),
+                          ("eval_duration", "backend_eval")):
+            if stats.get(key):
+                self.spans[name] = stats[key] / 1e9
+
+    def to_dict(self) -> Dict[str, float]:
+        return {f"{name}_ms": round(s * 1000, 2) for name, s in self.spans.items()}
+
+    # Server-Timing 响应头：name;dur=毫秒，逗号分隔
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={s * 1000:.2f}" for name, s in self.spans.items())
+
+
+# 当前请求的记录器（第一次访问时创建，开始时间取中间件记录的请求开始时间）
+def spans_of(req: Request) -> SpanRecorder:
+    spans = getattr(req.state, "spans", None)
+    if spans is None:
+        spans = SpanRecorder(getattr(req.state, "started_at", None))
+        req.state.spans = spans
+    return spans
+
+
+# 后端统计换算成真实的 token 数和速度（eval_count 是 token 数；token 事件数只是分片数）
+def backend_throughput(stats: Dict[str, Any]) -> Dict[str, Any]:
+    result = {}
+    if stats.get("eval_count") is not None:
+        result["tokens"] = stats["eval_count"]
+        if stats.get("eval_duration"):
+            result["tokens_per_s"] = round(stats["eval_count"] / (stats["eval_duration"] / 1e9), 2)
+    if stats.get("prompt_eval_count") is not None:
+        result["prompt_tokens"] = stats["prompt_eval_count"]
+        if stats.get("prompt_eval_duration"):
+            result["prompt_tokens_per_s"] = round(stats["prompt_eval_count"] / (stats["prompt_eval_duration"] / 1e9), 2)
+    return result
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from src.app.core.config import env_flag
+from src.app.llm.schemas import ChatRequest
+
+"""进程内响应缓存（可选）
+    面向“确定性”请求（temperature=0，例如 FAQ 机器人、评测集）：相同请求直接返回上次的结果，不再请求 Ollama。
+        - key：ChatRequest 关键字段（provider/model/messages/temperature/top_p/max_tokens）的 sha256
+        - value：生成的 token 序列（/chat/stream 命中时可按原顺序回放为 token 事件）
+        - 淘汰：按字节数上限做 LRU 淘汰 + TTL 过期
+        - 统计：hits / misses / evictions 计数
+    环境变量：
+        - CHAT_CACHE_ENABLED（默认 0）：是否开启
+        - CHAT_CACHE_MAX_BYTES（默认 67108864，即 64MB）：缓存总字节上限
+        - CHAT_CACHE_TTL_S（默认 300）：条目存活时间（秒）
+"""
+
+# 每个条目的固定开销估算（key、元组、时间戳等对象头），用于字节预算
+_ENTRY_OVERHEAD = 256
+_TOKEN_OVERHEAD = 56
+
+
+# 计算请求的缓存 key；model 由引擎决定（请求里没有 model 字段）
+def request_key(body: ChatRequest, model: Optional[str]) -> str:
+    ident = {
+        "provider": body.provider,
+        "model": model,
+        "messages": [[m.role, m.content] for m in body.messages],
+        "temperature": body.temperature,
+        "top_p": body.top_p,
+        "max_tokens": body.max_tokens,
+    }
+    raw = json.dumps(ident, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# 只有确定性请求才缓存：temperature=0 时同样的输入应得到同样的输出
+def is_cacheable(body: ChatRequest) -> bool:
+    return body.temperature == 0
+
+
+class CacheEntry:
+    __slots__ = ("tokens", "size", "expires_at")
+
+    def __init__(self, tokens: Tuple[str, ...], size: int, expires_at: float):
+        self.tokens = tokens
+        self.size = size
+        self.expires_at = expires_at
+
+    @property
+    def answer(self) -> str:
+        return "".join(self.tokens)
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_s: float = 300.0):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            # 过期条目按淘汰处理
+            self._remove(key)
+            self.evictions += 1
+            self.misses += 1
+            return None
+        # LRU：命中后移到队尾（最近使用）
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, tokens: Sequence[str]) -> None:
+        tokens = tuple(tokens)
+        size = _ENTRY_OVERHEAD + len(key) + sum(len(t.encode("utf-8")) + _TOKEN_OVERHEAD for t in tokens)
+        # 单条超过总预算的结果不缓存
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(tokens, size, time.monotonic() + self.ttl_s)
+        self._bytes += size
+        # 超出字节预算时从最久未使用的一端淘汰
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            max_bytes=int(os.getenv("CHAT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl_s=float(os.getenv("CHAT_CACHE_TTL_S", "300")),
+        )
+
+
+_cache: Optional[ResponseCache] = None
+_cache_loaded = False
+
+
+# 获取全局响应缓存；未开启（CHAT_CACHE_ENABLED=0）时返回 None
+def get_cache() -> Optional[ResponseCache]:
+    global _cache, _cache_loaded
+    if not _cache_loaded:
+        if env_flag("CHAT_CACHE_ENABLED", "0"):
+            _cache = ResponseCache.from_env()
+        _cache_loaded = True
+    return _cache
+
+
+# 替换全局响应缓存（None 表示关闭），返回旧的缓存
+def set_cache(cache: Optional[ResponseCache]) -> Optional[ResponseCache]:
+    global _cache, _cache_loaded
+    old, _cache, _cache_loaded = _cache, cache, True
+    return old
@@ -0,0 +1,210 @@
+import asyncio
+import os
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set
+
+from src.app.core.config import env_flag
+
+"""相同请求的“单飞”合并（single-flight）
+    同一时刻多个完全相同的确定性流式请求（temperature=0，例如前端重试风暴）只向后端发起一次 engine.stream：
+        - 第一个请求成为 leader，驱动上游生成（后台 task）；
+        - 之后到达的相同请求作为订阅者挂到同一次生成上，先补发已产生的 token，再接收后续 token；
+        - 每个订阅者有独立的有界缓冲区，慢客户端溢出后只会断开它自己，不会拖慢其他订阅者；
+        - 最后一个订阅者离开时取消上游生成；
+        - 跟随者结束后可以从 subscription.state 读取 leader 的 GenerationState（后端统计）。
+    采样（temperature>0）的请求每次应得到不同的回答，不参与合并（由调用方判断）。
+    环境变量：
+        - CHAT_COALESCE_ENABLED（默认 1）：是否开启
+        - CHAT_COALESCE_BUFFER（默认 1024）：每个订阅者缓冲的最大 token 数
+"""
+
+
+class SubscriberOverflow(RuntimeError):
+    """订阅者消费太慢，缓冲区溢出后被断开"""
+
+
+class _Subscriber:
+    __slots__ = ("buffer", "maxsize", "wake", "overflowed")
+
+    def __init__(self, maxsize: int):
+        self.buffer: Deque[str] = deque()
+        self.maxsize = maxsize
+        self.wake = asyncio.Event()
+        self.overflowed = False
+
+    # 推入一个 token；缓冲区满时标记溢出，返回 False
+    def push(self, token: str) -> bool:
+        if len(self.buffer) >= self.maxsize:
+            self.overflowed = True
+            self.wake.set()
+            return False
+        self.buffer.append(token)
+        self.wake.set()
+        return True
+
+
+class _Flight:
+    """一次上游生成：保存已产生的 token 历史和当前的订阅者"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.tokens: List[str] = []
+        self.subscribers: Set[_Subscriber] = set()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+        # 上游结束（正常 / 异常 / 取消）后的回调，例如归还准入名额
+        self.on_done: Optional[Callable[[], None]] = None
+        # leader 传给引擎的 GenerationState，上游结束后跟随者从这里拿后端统计
+        self.state: Any = None
+
+
+class Subscription:
+    """订阅者视角的 token 流：async for token in subscription"""
+
+    def __init__(self, coalescer: "StreamCoalescer", flight: _Flight, subscriber: _Subscriber,
+                 backlog: List[str], leader: bool):
+        self._coalescer = coalescer
+        self._flight = flight
+        self._sub = subscriber
+        self._backlog = backlog
+        # 是否是驱动上游的第一个请求
+        self.leader = leader
+        self._closed = False
+
+    # leader 的 GenerationState（上游结束后才完整）
+    @property
+    def state(self) -> Any:
+        return self._flight.state
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        try:
+            # 先补发加入之前已经产生的 token
+            for token in self._backlog:
+                yield token
+            self._backlog = []
+            sub, flight = self._sub, self._flight
+            while True:
+                if sub.buffer:
+                    yield sub.buffer.popleft()
+                    continue
+                if sub.overflowed:
+                    raise SubscriberOverflow("subscriber buffer overflow")
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                sub.wake.clear()
+                await sub.wake.wait()
+        finally:
+            self.close()
+
+    # 离开这次生成；最后一个订阅者离开时取消上游
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._coalescer._detach(self._flight, self._sub)
+
+
+class StreamCoalescer:
+    def __init__(self, buffer_size: int = 1024):
+        self.buffer_size = buffer_size
+        self._flights: Dict[str, _Flight] = {}
+        # 上游实际发起的生成次数 / 合并到已有生成的订阅次数
+        self.upstream_calls = 0
+        self.joined = 0
+
+    # on_done / state：只在成为 leader 时登记，上游结束后调用 on_done，state 供跟随者读取后端统计
+    def subscribe(self, key: str, factory: Callable[[], AsyncIterator[str]],
+                  on_done: Optional[Callable[[], None]] = None, state: Any = None) -> Subscription:
+        flight = self._live_flight(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            self.upstream_calls += 1
+        else:
+            self.joined += 1
+        sub = _Subscriber(self.buffer_size)
+        # 在同一个事件循环步骤里拿历史快照并注册，保证不丢、不重 token
+        backlog = list(flight.tokens)
+        flight.subscribers.add(sub)
+        if leader:
+            flight.on_done = on_done
+            flight.state = state
+            flight.task = asyncio.create_task(self._pump(flight, factory))
+        return Subscription(self, flight, sub, backlog, leader)
+
+    def _live_flight(self, key: str) -> Optional[_Flight]:
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is not None and flight.task.get_loop() is not asyncio.get_running_loop():
+            # 残留在其他（已结束的）事件循环上的生成，不能再加入
+            return None
+        return flight
+
+    # 是否已有相同请求正在生成（加入它不需要新的后端名额）
+    def has_flight(self, key: str) -> bool:
+        return self._live_flight(key) is not None
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def _pump(self, flight: _Flight, factory: Callable[[], AsyncIterator[str]]) -> None:
+        source = factory()
+        try:
+            async for token in source:
+                flight.tokens.append(token)
+                for sub in list(flight.subscribers):
+                    if not sub.push(token):
+                        # 慢订阅者溢出：只断开它自己
+                        self._detach(flight, sub)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            for sub in flight.subscribers:
+                sub.wake.set()
+            if flight.on_done is not None:
+                flight.on_done()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _detach(self, flight: _Flight, sub: _Subscriber) -> None:
+        flight.subscribers.discard(sub)
+        if not flight.subscribers and not flight.done:
+            # 没有订阅者了：不再接受新的加入，并取消上游生成
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.task is not None:
+                flight.task.cancel()
+
+
+_coalescer: Optional[StreamCoalescer] = None
+_coalescer_loaded = False
+
+
+# 获取全局合并器；未开启（CHAT_COALESCE_ENABLED=0）时返回 None
+def get_coalescer() -> Optional[StreamCoalescer]:
+    global _coalescer, _coalescer_loaded
+    if not _coalescer_loaded:
+        if env_flag("CHAT_COALESCE_ENABLED", "1"):
+            _coalescer = StreamCoalescer(buffer_size=int(os.getenv("CHAT_COALESCE_BUFFER", "1024")))
+        _coalescer_loaded = True
+    return _coalescer
+
+
+# 替换全局合并器（None 表示关闭），返回旧的合并器
+def set_coalescer(coalescer: Optional[StreamCoalescer]) -> Optional[StreamCoalescer]:
+    global _coalescer, _coalescer_loaded
+    old, _coalescer, _coalescer_loaded = _coalescer, coalescer, True
+    return old
@@ -0,0 +1,150 @@
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.app.core.config import env_flag, env_int_map
+from src.app.llm.schemas import ChatMessage
+
+"""上下文组装：按 token 预算裁剪对话历史
+    位于 ChatRequest.messages 和引擎之间：
+        - 逐条估算消息的 token 数，并按内容哈希做记忆化，重复发送的历史不再重复计算；
+        - 预算 = 模型上下文长度 - max_tokens（给回复留出空间）；
+        - 保留全部 system 消息 + 从最新往回尽量多的对话轮次，超出预算的旧消息被丢弃；
+        - 丢弃的消息数 / token 数会在 usage 事件里返回。
+    环境变量：
+        - CHAT_CONTEXT_TRIM（默认 1）：是否开启裁剪
+        - CHAT_CONTEXT_LENGTH（默认 4096）：默认的模型上下文长度
+        - CHAT_CONTEXT_LENGTHS：按模型覆盖，例如 "qwen2.5:7b=32768,llama3:8b=8192"
+"""
+
+# 每条消息的格式开销（"role: " 前缀、换行等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _approx_tokens(text: str) -> int:
+    # 经验估算：ASCII 大约 4 个字符 1 个 token，CJK 等非 ASCII 字符大约 1 个字符 1 个 token
+    # 用 UTF-8 字节长度推算非 ASCII 字符数（常见 CJK 字符占 3 字节），避免逐字符的 Python 循环
+    n = len(text)
+    if text.isascii():
+        return (n + 3) // 4
+    non_ascii = min(n, (len(text.encode("utf-8")) - n) // 2)
+    return (n - non_ascii + 3) // 4 + non_ascii
+
+
+class TokenCounter:
+    """带记忆化的 token 计数器（key 为内容哈希，LRU 有界）"""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[bytes, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        n = self._memo.get(key)
+        if n is not None:
+            self.hits += 1
+            self._memo.move_to_end(key)
+            return n
+        self.misses += 1
+        n = _approx_tokens(text)
+        self._memo[key] = n
+        if len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+        return n
+
+    def count_message(self, m: ChatMessage) -> int:
+        return self.count(m.content) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages: List[ChatMessage]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+
+class ContextTrim:
+    """裁剪结果"""
+
+    __slots__ = ("messages", "prompt_tokens", "dropped_messages", "dropped_tokens")
+
+    def __init__(self, messages: List[ChatMessage], prompt_tokens: int, dropped_messages: int = 0,
+                 dropped_tokens: int = 0):
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.dropped_messages = dropped_messages
+        self.dropped_tokens = dropped_tokens
+
+
+class ContextBudget:
+    def __init__(self, default_length: int = 4096, lengths: Optional[Dict[str, int]] = None,
+                 counter: Optional[TokenCounter] = None):
+        self.default_length = default_length
+        self.lengths = lengths or {}
+        self.counter = counter or TokenCounter()
+
+    def context_length(self, model: Optional[str]) -> int:
+        return self.lengths.get(model or "", self.default_length)
+
+    # 本次请求可用于 prompt 的 token 预算
+    def budget(self, model: Optional[str], max_tokens: int) -> int:
+        return self.context_length(model) - max_tokens
+
+    def trim(self, messages: List[ChatMessage], model: Optional[str], max_tokens: int) -> ContextTrim:
+        return trim_messages(messages, self.budget(model, max_tokens), self.counter)
+
+    @classmethod
+    def from_env(cls) -> "ContextBudget":
+        return cls(
+            default_length=int(os.getenv("CHAT_CONTEXT_LENGTH", "4096")),
+            lengths=env_int_map("CHAT_CONTEXT_LENGTHS"),
+        )
+
+
+# 保留全部 system 消息 + 最新的若干条消息，使总 token 数不超过 budget；最新一条消息总是保留
+def trim_messages(messages: List[ChatMessage], budget: int, counter: TokenCounter) -> ContextTrim:
+    counts = [counter.count_message(m) for m in messages]
+    total = sum(counts)
+    if total <= budget:
+        return ContextTrim(list(messages), total)
+
+    keep = [False] * len(messages)
+    used = 0
+    for i, m in enumerate(messages):
+        if m.role == "system":
+            keep[i] = True
+            used += counts[i]
+    newest = True
+    for i in range(len(messages) - 1, -1, -1):
+        if keep[i]:
+            continue
+        if newest or used + counts[i] <= budget:
+            keep[i] = True
+            used += counts[i]
+            newest = False
+        else:
+            # 更旧的消息一律丢弃，保证保留的是连续的最近轮次
+            break
+
+    kept = [m for i, m in enumerate(messages) if keep[i]]
+    return ContextTrim(kept, used, len(messages) - len(kept), total - used)
+
+
+_budget: Optional[ContextBudget] = None
+_budget_loaded = False
+
+
+# 获取全局上下文预算；未开启（CHAT_CONTEXT_TRIM=0）时返回 None
+def get_context_budget() -> Optional[ContextBudget]:
+    global _budget, _budget_loaded
+    if not _budget_loaded:
+        if env_flag("CHAT_CONTEXT_TRIM", "1"):
+            _budget = ContextBudget.from_env()
+        _budget_loaded = True
+    return _budget
+
+
+# 替换全局上下文预算（None 表示关闭），返回旧的配置
+def set_context_budget(budget: Optional[ContextBudget]) -> Optional[ContextBudget]:
+    global _budget, _budget_loaded
+    old, _budget, _budget_loaded = _budget, budget, True
+    return old
@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from .pool import ClientPool
+
+"""多后端（多台 Ollama）路由
+    OLLAMA_BASE_URLS 配置多个地址时，每个请求按下面的规则选一台后端：
+        - 跳过被熔断（circuit open）或健康检查失败的后端；
+        - 优先选已经加载了目标模型的后端（/api/ps），其次是本地有这个模型的后端（/api/tags）；
+        - 同一档里选在途请求数（outstanding）最少的。
+    健康检查在后台定期执行（lifespan 中启动），同时刷新每台后端的已加载 / 可用模型列表。
+    熔断：连续失败 OLLAMA_BREAKER_FAILURES（默认 3）次后熔断 OLLAMA_BREAKER_COOLDOWN_S（默认 30）秒，
+    冷却期过后进入半开状态放行请求，成功则恢复，失败则再次熔断。
+    其他环境变量：
+        - OLLAMA_HEALTH_INTERVAL_S（默认 10）：健康检查间隔（秒）
+"""
+
+
+class Backend:
+    """一台后端的路由状态"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        # None 表示还没做过健康检查（未知时不按模型筛选）
+        self.models_available: Optional[Set[str]] = None
+        self.models_loaded: Optional[Set[str]] = None
+        self.failures = 0 # 连续失败次数
+        self.open_until = 0.0 # 熔断截止时间（monotonic），0 表示未熔断
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+
+    def circuit_open(self, now: float) -> bool:
+        return self.open_until > now
+
+    def state(self) -> Dict[str, object]:
+        now = time.monotonic()
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": "open" if self.circuit_open(now) else ("half_open" if self.open_until else "closed"),
+            "outstanding": self.outstanding,
+            "models_loaded": sorted(self.models_loaded) if self.models_loaded is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+def _model_names(data: dict) -> Set[str]:
+    names = set()
+    for m in data.get("models") or []:
+        for key in ("name", "model"):
+            if m.get(key):
+                names.add(m[key])
+    return names
+
+
+class BackendPool:
+    def __init__(self, urls: Iterable[str], pool: ClientPool, failure_threshold: int = 3, cooldown_s: float = 30.0,
+                 health_interval_s: float = 10.0):
+        self.backends: List[Backend] = [Backend(u) for u in urls]
+        if not self.backends:
+            raise ValueError("at least one backend url is required")
+        self.pool = pool
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.health_interval_s = health_interval_s
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_env(cls, urls: Iterable[str], pool: ClientPool) -> "BackendPool":
+        return cls(
+            urls,
+            pool,
+            failure_threshold=int(os.getenv("OLLAMA_BREAKER_FAILURES", "3")),
+            cooldown_s=float(os.getenv("OLLAMA_BREAKER_COOLDOWN_S", "30")),
+            health_interval_s=float(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "10")),
+        )
+
+    # 为一次请求挑选后端；exclude 为本次请求已经失败过的后端。没有可选后端时返回 None
+    def pick(self, model: str, exclude: Iterable[Backend] = ()) -> Optional[Backend]:
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        usable = [b for b in candidates if b.healthy and not b.circuit_open(now)]
+        if not usable:
+            # 全部不可用时仍然要尝试一台（熔断最早到期的），而不是直接拒绝请求
+            return min(candidates, key=lambda b: b.open_until)
+
+        def rank(b: Backend):
+            if b.models_loaded is not None and model in b.models_loaded:
+                tier = 0
+            elif b.models_available is None or model in b.models_available:
+                tier = 1
+            else:
+                tier = 2
+            return tier, b.outstanding
+
+        return min(usable, key=rank)
+
+    def record_success(self, backend: Backend) -> None:
+        backend.failures = 0
+        backend.open_until = 0.0
+        backend.last_error = None
+
+    def record_failure(self, backend: Backend, error: str) -> None:
+        backend.failures += 1
+        backend.last_error = error
+        # 半开状态下的失败，或连续失败达到阈值：熔断
+        if backend.open_until or backend.failures >= self.failure_threshold:
+            backend.open_until = time.monotonic() + self.cooldown_s
+
+    # 检查一台后端：/api/tags（可用模型）+ /api/ps（已加载模型）
+    async def check(self, backend: Backend) -> bool:
+        client = self.pool.async_client()
+        try:
+            tags = await client.get(f"{backend.url}/api/tags")
+            tags.raise_for_status()
+            ps = await client.get(f"{backend.url}/api/ps")
+            ps.raise_for_status()
+            backend.models_available = _model_names(tags.json())
+            backend.models_loaded = _model_names(ps.json())
+        except (httpx.HTTPError, ValueError) as e:
+            backend.healthy = False
+            backend.last_error = f"health check failed: {e!r}"
+            return False
+        finally:
+            backend.last_check = time.monotonic()
+        backend.healthy = True
+        return True
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(b) for b in self.backends))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.health_interval_s)
+
+    # 在当前事件循环里启动后台健康检查（只有一台后端时没有可选的，不启动）
+    def start(self) -> None:
+        if len(self.backends) < 2 or (self._health_task is not None and not self._health_task.done()):
+            return
+        self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        task, self._health_task = self._health_task, None
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def states(self) -> List[Dict[str, object]]:
+        return [b.state() for b in self.backends]
@@ -1,15 +1,56 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import  AsyncIterator, List
+from dataclasses import dataclass, field
+from typing import  Any, AsyncIterator, Dict, List, Optional
 from src.app.llm.schemas import ChatMessage
 
 
+# 一次生成的附加输入/输出（可选参数，不关心的引擎直接忽略）
+@dataclass
+class GenerationState:
+    # 输入：上一轮后端返回的 KV 上下文（Ollama /api/generate 的 context），用于复用 prompt 缓存
+    context: Optional[List[int]] = None
+    # 输出：本轮结束后后端返回的新 context
+    new_context: Optional[List[int]] = None
+    # 输出：后端返回的统计信息
+    stats: Dict[str, Any] = field(default_factory=dict)
+    # 输出：引擎内部的阶段耗时（秒），例如 connect：发出请求到收到响应头（见 src/app/core/timing.py）
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
 class LLMEngine(ABC):
     name: str = "base"
+    # 是否支持 GenerationState.context（会话 KV 上下文复用）
+    supports_context: bool = False
 
+    # 同步生成：保留给同步调用方（脚本/嵌入场景）使用
     @abstractmethod
-    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
+    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                 state: Optional[GenerationState] = None) -> str:
         raise NotImplementedError
 
+    # 异步生成：HTTP 接口使用；默认在线程池中调用同步的 generate，
+    # 有原生异步客户端的引擎应覆盖它（等待后端期间不占用线程池）
+    async def agenerate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                        state: Optional[GenerationState] = None) -> str:
+        return await asyncio.to_thread(self.generate, messages, temperature, top_p, max_tokens, state)
+
     @abstractmethod
-    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
-        raise NotImplementedError
\ No newline at end of file
+    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                     state: Optional[GenerationState] = None) -> str:
+        raise NotImplementedError
+
+    # 启动引擎的后台任务（例如多后端健康检查），在 lifespan 中调用；默认没有后台任务
+    async def start(self) -> None:
+        return None
+
+    # 启动预热：建立连接、预加载模型等，返回每台后端的结果（见 src/app/llm/warmup.py）；默认无需预热
+    async def warmup(self) -> List[Dict[str, Any]]:
+        return []
+
+    # 释放引擎持有的资源（连接池等），默认无资源需要释放
+    async def aclose(self) -> None:
+        return None
+
+    def close(self) -> None:
+        return None
@@ -1,7 +1,7 @@
 import asyncio
-from typing import AsyncIterator, List
+from typing import AsyncIterator, List, Optional
 from src.app.llm.schemas import ChatMessage
-from .base import LLMEngine
+from .base import GenerationState, LLMEngine
 
 """测试用的 Mock 引擎类 MockEngine
     实现非流式的 generate 方法：模拟 AI 生成回复（本质是返回用户最后一条输入的 “回声”）；
@@ -13,7 +13,8 @@ class MockEngine(LLMEngine):
     name = "mock"
 
     # generate（非流式生成回复）
-    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
+    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                 state: Optional[GenerationState] = None) -> str:
         last_user = ""
         # 反向遍历消息列表，找到最后一条用户信息
         for m in reversed(messages):
@@ -23,8 +24,14 @@ class MockEngine(LLMEngine):
         # 返回mock回复，截取前200个字符防止内容过长
         return f"[mock] you said: {last_user[:200]}"
 
+    # agenerate（异步非流式生成回复），mock 没有 I/O，直接复用 generate
+    async def agenerate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                        state: Optional[GenerationState] = None) -> str:
+        return self.generate(messages, temperature, top_p, max_tokens)
+
     # stream（流式生成回复）
-    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
+    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                     state: Optional[GenerationState] = None) -> str:
         # 调用 generate 拿到完整的 mock 回复
         text = self.generate(messages, temperature, top_p, max_tokens)
         # 逐字符遍历，模拟流式输出
@@ -1,23 +1,72 @@
+import asyncio
 import os
+import time
+from typing import AsyncIterator, List, Optional
 import httpx
-from typing import AsyncIterator, List
+from src.app.core import metrics
+from src.app.llm.ndjson import aiter_ndjson, final_stats
 from src.app.llm.schemas import ChatMessage
-from .base import LLMEngine
+from .backends import Backend, BackendPool
+from .base import GenerationState, LLMEngine
+from .pool import ClientPool, PoolConfig
 
 """对接本地 Ollama 服务的真实 AI 引擎类 OllamaEngine
     封装 Ollama 的 HTTP API 调用逻辑，对外提供统一的 generate（非流式）和 stream（异步流式）方法；
     支持配置 Ollama 服务地址、模型名称、超时时间，具备环境变量适配能力；
     将业务侧的 ChatMessage 消息列表转换为 Ollama 能识别的 prompt 格式，完成参数映射和请求发送。
+    HTTP 客户端来自引擎持有的 ClientPool（长连接复用），不再每次请求新建 httpx 客户端。
+    支持会话 KV 上下文复用：请求带上上一轮返回的 context，只需发送新消息，Ollama 复用已计算的 prompt 缓存；
+    OLLAMA_KEEP_ALIVE（例如 "30m"）控制模型在 Ollama 中常驻的时间，避免会话间隔中模型被卸载。
+    多后端：OLLAMA_BASE_URLS（逗号分隔）配置多台 Ollama，由 BackendPool 按负载 / 已加载模型选择后端；
+    请求在发出第一个 token 之前失败（连接失败、5xx、流中返回 error）时换一台后端重试，之后的失败直接抛出。
 """
 
+
+class OllamaStreamError(Exception):
+    """Ollama 以 200 返回、但在流里给出 {"error": ...} 的失败"""
+
+
+# 判断一次失败能否换后端重试，以及是否计入熔断：返回 (可重试, 计入熔断)
+def _classify(e: Exception):
+    if isinstance(e, httpx.HTTPStatusError):
+        code = e.response.status_code
+        if code >= 500:
+            return True, True
+        # 404：这台后端没有这个模型，换一台即可，后端本身没有问题
+        return code == 404, False
+    if isinstance(e, (httpx.TransportError, OllamaStreamError)):
+        return True, True
+    return False, False
+
+
 class OllamaEngine(LLMEngine):
     name = "ollama"
+    supports_context = True
 
-    def __init__(self, base_url: str | None = None, model: str | None = None, timeout_s: float | None = None):
-        # 分为三块优先级：传入的base_url > 环境变量OLLAMA_BASE_URL > 默认值(本地11434端口)
-        self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
+    def __init__(self, base_url: str | None = None, model: str | None = None, timeout_s: float | None = None,
+                 pool: ClientPool | None = None, base_urls: List[str] | None = None):
+        # 后端地址优先级：传入的base_urls / base_url > 环境变量OLLAMA_BASE_URLS > OLLAMA_BASE_URL > 默认值(本地11434端口)
+        if not base_urls:
+            env_urls = [u.strip() for u in os.getenv("OLLAMA_BASE_URLS", "").split(",") if u.strip()]
+            base_urls = [base_url] if base_url else env_urls or [os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")]
+        self.base_url = base_urls[0] # 第一台后端（兼容只有一台后端时的用法）
         self.model = model or os.getenv("OLLAMA_MODEL", "qwen2.5:7b")# 默认使用通义千问2.5 7B模型
         self.timeout_s = float(timeout_s or os.getenv("OLLAMA_TIMEOUT_S", "60"))# 请求超时时间60秒
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE") or None # 模型常驻时间，未设置时使用 Ollama 默认值
+        # 连接池：未传入时按 OLLAMA_POOL_* 环境变量创建
+        self.pool = pool or ClientPool(self.timeout_s, PoolConfig.from_env("OLLAMA"))
+        self.backends = BackendPool.from_env(base_urls, self.pool)
+
+    # 启动多后端的后台健康检查（在 lifespan 中调用）
+    async def start(self) -> None:
+        self.backends.start()
+
+    async def aclose(self) -> None:
+        await self.backends.stop()
+        await self.pool.aclose()
+
+    def close(self) -> None:
+        self.pool.close()
 
     # 辅助方法：消息转换成prompt形式，方便识别
     def _to_prompt(self, messages: List[ChatMessage]) -> str:
@@ -26,60 +75,171 @@ class OllamaEngine(LLMEngine):
             lines.append(f"{m.role}: {m.content}")
         return "\n".join(lines)
 
-    # 核心方法：generate（非流式生成回复）
-    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
-        # 转换消息为prompt
-        prompt = self._to_prompt(messages)
-        # 组装Ollama API的请求参数
+    # 辅助方法：组装 Ollama /api/generate 的请求参数
+    def _build_payload(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                       stream: bool, state: Optional[GenerationState] = None) -> dict:
         payload = {
             "model": self.model, # 初始化模型名
-            "prompt": prompt, # 转换后的prompt
-            "stream": False, # 非流式，一次性返回结果
+            "prompt": self._to_prompt(messages), # 转换后的prompt
+            "stream": stream, # 是否流式返回
             "options": { # 生成参数映射
                 "temperature": temperature, # 随机性
                 "top_p": top_p, # 核采样
                 "num_predict": max_tokens, # 最大token数
             },
         }
-        # 同步调用Ollama API
-        with httpx.Client(timeout=self.timeout_s) as client:
-            # 发出请求
-            r = client.post(f"{self.base_url}/api/generate", json=payload)
-            # 抛出HTTP错误，方便上层捕获
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        # 会话续写：带上上一轮的 context，prompt 中只有新消息
+        if state is not None and state.context:
+            payload["context"] = list(state.context)
+        return payload
+
+    # 辅助方法：记录 Ollama 最终响应中的 context（供下一轮复用）和统计信息（eval_count / eval_duration 等）
+    def _record_final(self, data: dict, state: Optional[GenerationState]) -> None:
+        if state is not None:
+            state.new_context = data.get("context")
+            state.stats.update(final_stats(data))
+
+    # 预热：对每台后端依次做健康检查（建立连接）、预加载模型（空 prompt + keep_alive）、1 个 token 的生成
+    async def warmup(self) -> List[dict]:
+        return list(await asyncio.gather(*(self._warm_backend(b) for b in self.backends.backends)))
+
+    async def _warm_backend(self, backend: Backend) -> dict:
+        client = self.pool.async_client()
+        result = {"url": backend.url, "model": self.model, "ok": False}
+        t = time.perf_counter()
+        if not await self.backends.check(backend):
+            result["error"] = backend.last_error
+            return result
+        result["connect_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        try:
+            # Ollama 收到空 prompt 时只加载模型，keep_alive 决定加载后常驻多久
+            preload = {"model": self.model, "prompt": "", "stream": False}
+            if self.keep_alive:
+                preload["keep_alive"] = self.keep_alive
+            t = time.perf_counter()
+            r = await client.post(f"{backend.url}/api/generate", json=preload)
             r.raise_for_status()
-            data = r.json() # 解析json响应
+            result["load_ms"] = round((time.perf_counter() - t) * 1000, 1)
+            t = time.perf_counter()
+            payload = self._build_payload([ChatMessage(role="user", content="hi")], 0.0, 1.0, 1, stream=False)
+            r = await client.post(f"{backend.url}/api/generate", json=payload)
+            r.raise_for_status()
+            result["generate_ms"] = round((time.perf_counter() - t) * 1000, 1)
+        except (httpx.HTTPError, ValueError) as e:
+            result["error"] = repr(e)
+            return result
+        # 刷新已加载模型列表（/ready 报告）
+        await self.backends.check(backend)
+        result["ok"] = True
+        return result
+
+    # 辅助方法：一次非流式请求在 backend 上成功：记录后端健康和耗时，回填 context / 统计
+    def _attempt_done(self, backend: Backend, data: dict, t0: float, state: Optional[GenerationState]) -> None:
+        self.backends.record_success(backend)
+        metrics.BACKEND_SECONDS.observe(time.perf_counter() - t0, provider=self.name, model=self.model, op="generate")
+        self._record_final(data, state)
+
+    # 辅助方法：一次请求在 backend 上失败：记错误指标、按 _classify 计入熔断，
+    # 返回能否换一台后端重试（tried 记录本次请求已失败的后端）；retry=False 时只记录、不重试
+    # （流式请求已经发出 token 之后的失败：同样计入熔断，否则发出首个 token 后总是断开的后端永远不会被熔断）
+    def _attempt_failed(self, backend: Backend, e: Exception, tried: List[Backend], op: str,
+                        retry: bool = True) -> bool:
+        metrics.BACKEND_ERRORS.inc(provider=self.name, model=self.model, op=op)
+        retryable, failure = _classify(e)
+        if failure:
+            self.backends.record_failure(backend, repr(e))
+        tried.append(backend)
+        return retry and retryable and self.backends.pick(self.model, tried) is not None
+
+    # 核心方法：agenerate（异步非流式生成回复），/chat 使用这个方法，不占用线程池
+    async def agenerate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                        state: Optional[GenerationState] = None) -> str:
+        payload = self._build_payload(messages, temperature, top_p, max_tokens, stream=False, state=state)
+        # 异步调用Ollama API（复用连接池中的长连接）
+        client = self.pool.async_client()
+        tried: List[Backend] = []
+        while True:
+            backend = self.backends.pick(self.model, tried)
+            t0 = time.perf_counter()
+            backend.outstanding += 1
+            try:
+                r = await client.post(f"{backend.url}/api/generate", json=payload)
+                # 抛出HTTP错误，方便上层捕获
+                r.raise_for_status()
+                data = r.json() # 解析json响应
+            except Exception as e:
+                if not self._attempt_failed(backend, e, tried, "generate"):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._attempt_done(backend, data, t0, state)
             return data.get("response", "") # 返回AI生成的回复内容
 
-    # 核心方法：stream（流式生成回复）
-    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int) -> str:
-        # 转换消息为prompt
-        prompt = self._to_prompt(messages)
-        # 组装Ollama API的请求参数
-        payload = {
-            "model": self.model, # 初始化模型名
-            "prompt": prompt, # 转换后的prompt
-            "stream": True, # 非流式，一次性返回结果
-            "options": { # 生成参数映射
-                "temperature": temperature, # 随机性
-                "top_p": top_p, # 核采样
-                "num_predict": max_tokens, # 最大token数
-            },
-        }
-        # 异步调用Ollama流式API
-        async with httpx.AsyncClient(timeout=self.timeout_s) as client:
-            # stream="POST" 表示异步流式接收响应
-            async with client.stream("POST", f"{self.base_url}/api/generate", json=payload) as r:
+    # 兼容方法：generate（同步非流式生成回复），保留给直接嵌入引擎的同步调用方
+    def generate(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                 state: Optional[GenerationState] = None) -> str:
+        payload = self._build_payload(messages, temperature, top_p, max_tokens, stream=False, state=state)
+        # 同步调用Ollama API（复用连接池中的长连接）
+        client = self.pool.sync_client()
+        tried: List[Backend] = []
+        while True:
+            backend = self.backends.pick(self.model, tried)
+            t0 = time.perf_counter()
+            backend.outstanding += 1
+            try:
+                r = client.post(f"{backend.url}/api/generate", json=payload)
                 r.raise_for_status()
-                # 逐行读取流式响应（Ollama每行返回一个JSON对象）
-                async for line in r.aiter_lines():
-                    if not line:
-                        continue
-                    try:
-                        obj = httpx.Response(200, content=line).json()
-                    except Exception:
-                        continue
-                    token = obj.get("response", "")
-                    if token:
-                        yield token # 逐个返回分片token，模拟打字机效果
-                    if obj.get("done"): # Ollama返回done=true表示流式结束
-                        break
\ No newline at end of file
+                data = r.json()
+            except Exception as e:
+                if not self._attempt_failed(backend, e, tried, "generate"):
+                    raise
+                continue
+            finally:
+                backend.outstanding -= 1
+            self._attempt_done(backend, data, t0, state)
+            return data.get("response", "")
+
+    # 核心方法：stream（流式生成回复）
+    async def stream(self, messages: List[ChatMessage], temperature: float, top_p: float, max_tokens: int,
+                     state: Optional[GenerationState] = None) -> str:
+        # 组装Ollama API的请求参数（流式，逐行返回）
+        payload = self._build_payload(messages, temperature, top_p, max_tokens, stream=True, state=state)
+        # 异步调用Ollama流式API（复用连接池中的长连接）
+        client = self.pool.async_client()
+        tried: List[Backend] = []
+        while True:
+            backend = self.backends.pick(self.model, tried)
+            sent = False # 是否已经向调用方发出过 token（发出之后不能再换后端重试）
+            t0 = time.perf_counter()
+            backend.outstanding += 1
+            try:
+                # stream="POST" 表示异步流式接收响应
+                async with client.stream("POST", f"{backend.url}/api/generate", json=payload) as r:
+                    r.raise_for_status()
+                    # 流式调用只统计到响应头返回为止（之后的耗时由首 token 延迟 / token 间隔直方图体现）
+                    connect = time.perf_counter() - t0
+                    metrics.BACKEND_SECONDS.observe(connect, provider=self.name, model=self.model, op="stream")
+                    if state is not None:
+                        state.timings["connect"] = connect
+                    # 增量解析原始字节流（Ollama每行返回一个JSON对象），跨块的半行由解码器拼接
+                    async for obj in aiter_ndjson(r.aiter_bytes()):
+                        if obj.get("error"):
+                            raise OllamaStreamError(obj["error"])
+                        token = obj.get("response", "")
+                        if token:
+                            sent = True
+                            yield token # 逐个返回分片token，模拟打字机效果
+                        if obj.get("done"): # Ollama返回done=true表示流式结束
+                            self._record_final(obj, state)
+                            break
+                self.backends.record_success(backend)
+                return
+            except Exception as e:
+                # 已经发出 token 之后不能换后端重试，但失败仍然计入熔断
+                if not self._attempt_failed(backend, e, tried, "stream", retry=not sent):
+                    raise
+            finally:
+                backend.outstanding -= 1
\ No newline at end of file
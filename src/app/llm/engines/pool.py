@@ -0,0 +1,104 @@
+import asyncio
+import importlib.util
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import httpx
+
+from src.app.core.config import env_flag
+
+"""后端 HTTP 连接池
+    每个后端（目前是 Ollama）持有一组在 app 生命周期内复用的 httpx 客户端（同步 + 异步各一个），
+    避免每次请求都重新建立 TCP 连接和连接池，降低首 token 延迟（TTFT）。
+    连接池参数可以按后端通过环境变量配置，例如 Ollama：
+        - OLLAMA_POOL_MAX_CONNECTIONS（默认 100）：最大连接数
+        - OLLAMA_POOL_MAX_KEEPALIVE（默认 20）：最大保活连接数
+        - OLLAMA_POOL_KEEPALIVE_EXPIRY_S（默认 30）：空闲保活连接的过期时间（秒）
+        - OLLAMA_POOL_HTTP2（默认 0）：是否启用 HTTP/2（需要安装 h2，未安装时自动降级为 HTTP/1.1）
+"""
+
+
+# 判断当前环境是否可以启用 HTTP/2（httpx 的 HTTP/2 支持依赖可选包 h2）
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry_s: float = 30.0
+    http2: bool = False
+
+    # 按后端前缀从环境变量读取连接池配置，例如 prefix="OLLAMA" -> OLLAMA_POOL_MAX_CONNECTIONS
+    @classmethod
+    def from_env(cls, prefix: str) -> "PoolConfig":
+        return cls(
+            max_connections=int(os.getenv(f"{prefix}_POOL_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv(f"{prefix}_POOL_MAX_KEEPALIVE", "20")),
+            keepalive_expiry_s=float(os.getenv(f"{prefix}_POOL_KEEPALIVE_EXPIRY_S", "30")),
+            http2=env_flag(f"{prefix}_POOL_HTTP2"),
+        )
+
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry_s,
+        )
+
+
+class ClientPool:
+    """一个后端对应的一组长连接客户端
+        - sync_client()：同步客户端，供同步 generate 使用
+        - async_client()：异步客户端，供 stream / 异步接口使用
+        客户端懒加载创建，由引擎注册表在 app 关闭时统一 aclose()。
+    """
+
+    def __init__(self, timeout_s: float, config: Optional[PoolConfig] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.timeout_s = timeout_s
+        self.config = config or PoolConfig()
+        # 只有在配置开启且安装了 h2 时才真正启用 HTTP/2
+        self.http2 = self.config.http2 and http2_available()
+        # 可选的自定义 transport（测试里用 httpx.MockTransport 注入假后端）
+        self._transport = transport
+        self._client: Optional[httpx.Client] = None
+        self._aclient: Optional[httpx.AsyncClient] = None
+        self._aclient_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def sync_client(self) -> httpx.Client:
+        if self._client is None:
+            kwargs = {}
+            if isinstance(self._transport, httpx.BaseTransport):
+                kwargs["transport"] = self._transport
+            self._client = httpx.Client(timeout=self.timeout_s, limits=self.config.limits(),
+                                        http2=self.http2, **kwargs)
+        return self._client
+
+    def async_client(self) -> httpx.AsyncClient:
+        # 异步连接池绑定创建它的事件循环；事件循环变化时（例如未进入 lifespan 的 TestClient）重新创建
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop or self._aclient.is_closed:
+            kwargs = {}
+            if isinstance(self._transport, httpx.AsyncBaseTransport):
+                kwargs["transport"] = self._transport
+            self._aclient = httpx.AsyncClient(timeout=self.timeout_s, limits=self.config.limits(),
+                                              http2=self.http2, **kwargs)
+            self._aclient_loop = loop
+        return self._aclient
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            # 只能在创建它的事件循环里关闭异步客户端
+            if self._aclient_loop is asyncio.get_running_loop():
+                await self._aclient.aclose()
+            self._aclient = None
+            self._aclient_loop = None
+        self.close()
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
@@ -0,0 +1,72 @@
+from typing import Callable, Dict, Optional
+
+from .base import LLMEngine
+from .mock import MockEngine
+from .ollama import OllamaEngine
+
+"""引擎注册表
+    在 FastAPI lifespan 中创建一次，app 生命周期内复用同一批引擎实例（以及它们持有的连接池），
+    关闭时统一释放连接；不再每次 get_engine() 都重新构造引擎和 httpx 客户端。
+    未进入 lifespan 的场景（例如直接 TestClient(app)）会懒加载一个默认注册表，行为与之前保持一致。
+"""
+
+
+class EngineRegistry:
+    def __init__(self, factories: Optional[Dict[str, Callable[[], LLMEngine]]] = None):
+        # provider -> 引擎构造函数（只在第一次使用时调用）
+        self._factories: Dict[str, Callable[[], LLMEngine]] = factories or {
+            "mock": MockEngine,
+            "ollama": OllamaEngine,
+        }
+        # provider -> 已创建的引擎实例
+        self._engines: Dict[str, LLMEngine] = {}
+
+    # 注册/替换一个 provider 的引擎实例（例如测试中注入带假 transport 的 OllamaEngine）
+    def register(self, provider: str, engine: LLMEngine) -> None:
+        self._engines[provider.lower()] = engine
+
+    def get(self, provider: str) -> LLMEngine:
+        p = (provider or "mock").lower()
+        if p not in self._factories and p not in self._engines:
+            p = "mock"
+        engine = self._engines.get(p)
+        if engine is None:
+            engine = self._factories[p]()
+            self._engines[p] = engine
+        return engine
+
+    def engines(self) -> Dict[str, LLMEngine]:
+        return dict(self._engines)
+
+    # 创建所有引擎并启动它们的后台任务（在 lifespan 启动时调用）
+    async def start(self) -> None:
+        for provider in self._factories:
+            await self.get(provider).start()
+
+    # 关闭所有引擎持有的连接池（在 lifespan 退出时调用）
+    async def aclose(self) -> None:
+        engines, self._engines = self._engines, {}
+        for engine in engines.values():
+            await engine.aclose()
+
+    def close(self) -> None:
+        engines, self._engines = self._engines, {}
+        for engine in engines.values():
+            engine.close()
+
+
+_registry: Optional[EngineRegistry] = None
+
+
+def get_registry() -> EngineRegistry:
+    global _registry
+    if _registry is None:
+        _registry = EngineRegistry()
+    return _registry
+
+
+# 替换全局注册表，返回旧的注册表（调用方负责关闭）
+def set_registry(registry: Optional[EngineRegistry]) -> Optional[EngineRegistry]:
+    global _registry
+    old, _registry = _registry, registry
+    return old
@@ -0,0 +1,75 @@
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+"""增量 NDJSON 解码器（Ollama 流式响应）
+    Ollama 的流式接口每行返回一个 JSON 对象。之前的做法是 aiter_lines() 先把字节解码成文本、按行切分，
+    再给每一行构造一个 httpx.Response 只为了调用 .json()，每个 token 都有不小的 CPU 开销。
+    这里直接处理 aiter_bytes() 的原始字节块：
+        - 按 b"\\n" 切行，跨块的半行留在缓冲区里等下一块拼上；
+        - 每行直接 json.loads(bytes)（安装了 orjson 时自动使用 orjson.loads）；
+        - 解析失败的行跳过（与之前的行为一致）。
+"""
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+    _DecodeError = (orjson.JSONDecodeError, ValueError)
+except ImportError:
+    _loads = json.loads
+    _DecodeError = (ValueError,)
+
+# Ollama 最终帧（done=true）里的统计字段
+STAT_FIELDS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+
+class NDJSONDecoder:
+    def __init__(self):
+        self._buf = b""
+
+    # 喂入一个字节块，返回其中所有完整行解析出的对象
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        data = self._buf + chunk if self._buf else chunk
+        if b"\n" not in data:
+            self._buf = data
+            return []
+        lines = data.split(b"\n")
+        self._buf = lines.pop()
+        return [obj for obj in map(_decode, lines) if obj is not None]
+
+    # 流结束时解析缓冲区里剩下的最后一行（没有以换行结尾）
+    def flush(self) -> List[Dict[str, Any]]:
+        data, self._buf = self._buf, b""
+        obj = _decode(data)
+        return [obj] if obj is not None else []
+
+
+def _decode(line: bytes):
+    if not line or line.isspace():
+        return None
+    try:
+        obj = _loads(line)
+    except _DecodeError:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+async def aiter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    decoder = NDJSONDecoder()
+    async for chunk in chunks:
+        for obj in decoder.feed(chunk):
+            yield obj
+    for obj in decoder.flush():
+        yield obj
+
+
+# 从 Ollama 最终帧中提取统计字段
+def final_stats(obj: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: obj[k] for k in STAT_FIELDS if k in obj}
@@ -0,0 +1,214 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+from src.app.core.config import env_flag
+from src.app.core.fastjson import JSONDecodeError, loads
+from src.app.llm.schemas import ChatBatchRequest, ChatMessage, ChatRequest
+
+"""请求体解析 + 大小限制
+    长对话时，用 pydantic 把几百条消息逐条校验成 ChatMessage 模型会占掉每个请求相当一部分 CPU；
+    而且原来的 schema 对消息条数、内容长度都没有限制，一个超大的请求体就能卡住一个 worker。
+    快速路径（CHAT_FAST_PARSE，默认 1；只用于不小于 CHAT_FAST_PARSE_MIN_BYTES 的请求体）：
+        - 用 fastjson.loads（有 orjson 时用 orjson）解码请求体；
+        - messages 先检查条数（超出上限时不再逐条校验），再用 TypeAdapter(List[ChatMessage]) 一次性校验构造，
+          结果是真正的 ChatMessage（序列化 / model_dump 与 pydantic 路径一致）；
+          其余标量字段仍交给 pydantic 校验，取值范围、默认值都与 ChatRequest 保持一致；
+        - 校验失败时返回与 FastAPI 相同格式的 422 错误列表。
+    快速路径要多调用一次 pydantic（标量字段和消息列表分开校验），小请求体上反而比一次 model_validate 慢
+    （benchmarks/bench_parse.py：2 条短消息约 0.5~0.7x，几十 KB 的长对话起才稳定更快），所以默认只有
+    请求体达到 CHAT_FAST_PARSE_MIN_BYTES（默认 32768）时才走快速路径，其余请求（以及关闭快速路径时）
+    整个请求体交给 pydantic 校验（与 FastAPI 默认的处理相同），同样执行下面的限制；两条路径的结果完全一致。
+    限制（0 表示不限制）：
+        - CHAT_MAX_BODY_BYTES（默认 4 MiB）：/chat、/chat/stream 的请求体字节数，超出返回 413（先看 Content-Length，读取中途超出也立即拒绝）
+        - CHAT_MAX_BATCH_BODY_BYTES（默认 32 MiB）：/chat/batch 的请求体字节数，超出返回 413
+        - CHAT_MAX_MESSAGES（默认 1000）：单个请求的消息条数，超出返回 422
+        - CHAT_MAX_CHARS（默认 1000000）：单个请求所有消息内容的总字符数，超出返回 422
+"""
+
+# 整个消息列表的校验器：一次调用在 pydantic-core 里校验并构造全部 ChatMessage，比逐条 model_validate 快得多
+_MESSAGES = TypeAdapter(List[ChatMessage])
+
+
+class InvalidRequest(Exception):
+    """请求体校验失败；errors 与 pydantic 的 ValidationError.errors() 格式相同（loc 不含 "body"）"""
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} validation error(s)")
+        self.errors = errors
+
+
+def _error(type_: str, loc: tuple, msg: str, input_: Any, ctx: Optional[dict] = None) -> Dict[str, Any]:
+    err = {"type": type_, "loc": loc, "msg": msg, "input": input_}
+    if ctx is not None:
+        err["ctx"] = ctx
+    return err
+
+
+class RequestLimits:
+    def __init__(self, max_body_bytes: int = 4 * 1024 * 1024, max_batch_body_bytes: int = 32 * 1024 * 1024,
+                 max_messages: int = 1000, max_chars: int = 1_000_000):
+        self.max_body_bytes = max_body_bytes
+        self.max_batch_body_bytes = max_batch_body_bytes
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+
+    @classmethod
+    def from_env(cls) -> "RequestLimits":
+        return cls(
+            max_body_bytes=int(os.getenv("CHAT_MAX_BODY_BYTES", str(4 * 1024 * 1024))),
+            max_batch_body_bytes=int(os.getenv("CHAT_MAX_BATCH_BODY_BYTES", str(32 * 1024 * 1024))),
+            max_messages=int(os.getenv("CHAT_MAX_MESSAGES", "1000")),
+            max_chars=int(os.getenv("CHAT_MAX_CHARS", "1000000")),
+        )
+
+    def too_many(self, n: int, prefix: tuple = ()) -> List[Dict[str, Any]]:
+        if not self.max_messages or n <= self.max_messages:
+            return []
+        return [_error("too_long", prefix + ("messages",), f"List should have at most {self.max_messages} items, not {n}",
+                       None, {"field_type": "List", "max_length": self.max_messages, "actual_length": n})]
+
+    # 检查消息条数 / 总字符数，返回错误列表（loc 以 prefix 开头）
+    def check_messages(self, messages: list, prefix: tuple = ()) -> List[Dict[str, Any]]:
+        loc = prefix + ("messages",)
+        errors = self.too_many(len(messages), prefix)
+        if errors:
+            return errors
+        if self.max_chars:
+            total = sum(len(m.content) for m in messages)
+            if total > self.max_chars:
+                return [_error("too_long", loc,
+                               f"Message content should have at most {self.max_chars} characters in total, not {total}",
+                               None, {"max_chars": self.max_chars, "actual_chars": total})]
+        return []
+
+
+# 快速校验 messages：先检查类型和条数（超出时不再逐条校验），再整体交给 pydantic-core 一次性构造 ChatMessage 列表；
+# 返回 ChatMessage 列表和错误列表
+def _parse_messages(raw: Any, limits: RequestLimits, prefix: tuple):
+    loc = prefix + ("messages",)
+    if not isinstance(raw, list):
+        return [], [_error("list_type", loc, "Input should be a valid list", raw)]
+    errors = limits.too_many(len(raw), prefix)
+    if errors:
+        return [], errors
+    try:
+        messages = _MESSAGES.validate_python(raw)
+    except ValidationError as e:
+        return [], _pydantic_errors(e, loc)
+    return messages, limits.check_messages(messages, prefix)
+
+
+def _pydantic_errors(e: ValidationError, prefix: tuple = ()) -> List[Dict[str, Any]]:
+    return [{**err, "loc": prefix + tuple(err["loc"])} for err in e.errors(include_url=False)]
+
+
+# 快速路径：一个已解码的 ChatRequest dict -> ChatRequest
+def chat_from_dict(data: Any, limits: RequestLimits, prefix: tuple = ()) -> ChatRequest:
+    if not isinstance(data, dict):
+        raise InvalidRequest([_error("model_type", prefix, "Input should be an object", data)])
+    if "messages" in data:
+        messages, errors = _parse_messages(data["messages"], limits, prefix)
+    else:
+        messages, errors = [], [_error("missing", prefix + ("messages",), "Field required", data)]
+    # 标量字段交给 pydantic（messages 先用空列表占位）
+    fields = {k: v for k, v in data.items() if k != "messages"}
+    fields["messages"] = []
+    try:
+        body = ChatRequest.model_validate(fields)
+    except ValidationError as e:
+        errors += _pydantic_errors(e, prefix)
+    if errors:
+        raise InvalidRequest(errors)
+    body.messages = messages
+    return body
+
+
+def _decode(raw: bytes) -> Any:
+    if not raw:
+        raise InvalidRequest([_error("missing", (), "Field required", None)])
+    try:
+        return loads(raw)
+    except JSONDecodeError as e:
+        raise InvalidRequest([_error("json_invalid", (e.pos,), "JSON decode error", {}, {"error": e.msg})])
+
+
+class RequestParser:
+    def __init__(self, limits: Optional[RequestLimits] = None, fast: bool = True, fast_min_bytes: int = 0):
+        self.limits = limits or RequestLimits()
+        self.fast = fast
+        # 走快速路径的最小请求体字节数（更小的请求体用 pydantic 路径更快）
+        self.fast_min_bytes = fast_min_bytes
+
+    @classmethod
+    def from_env(cls) -> "RequestParser":
+        return cls(RequestLimits.from_env(), fast=env_flag("CHAT_FAST_PARSE", "1"),
+                   fast_min_bytes=int(os.getenv("CHAT_FAST_PARSE_MIN_BYTES", "32768")))
+
+    def _use_fast(self, raw: bytes) -> bool:
+        return self.fast and len(raw) >= self.fast_min_bytes
+
+    # 解析 /chat、/chat/stream 的请求体；失败时抛出 InvalidRequest
+    def parse_chat(self, raw: bytes) -> ChatRequest:
+        data = _decode(raw)
+        if self._use_fast(raw):
+            return chat_from_dict(data, self.limits)
+        try:
+            body = ChatRequest.model_validate(data)
+        except ValidationError as e:
+            raise InvalidRequest(_pydantic_errors(e))
+        errors = self.limits.check_messages(body.messages)
+        if errors:
+            raise InvalidRequest(errors)
+        return body
+
+    # 解析 /chat/batch 的请求体：条目数、parallelism 交给 pydantic，每一条都按单个请求的限制检查
+    def parse_batch(self, raw: bytes) -> ChatBatchRequest:
+        data = _decode(raw)
+        if not self._use_fast(raw) or not isinstance(data, dict) or not isinstance(data.get("items"), list):
+            try:
+                batch = ChatBatchRequest.model_validate(data)
+            except ValidationError as e:
+                raise InvalidRequest(_pydantic_errors(e))
+            errors = []
+            for i, item in enumerate(batch.items):
+                errors += self.limits.check_messages(item.messages, ("items", i))
+            if errors:
+                raise InvalidRequest(errors)
+            return batch
+        items = data["items"]
+        try:
+            # 条目数（min / max）和 parallelism 由 pydantic 校验（条目先用占位），条目本身走快速路径
+            batch = ChatBatchRequest.model_validate({**data, "items": [{"messages": []}] * len(items)})
+        except ValidationError as e:
+            raise InvalidRequest(_pydantic_errors(e))
+        parsed = []
+        errors = []
+        for i, item in enumerate(items):
+            try:
+                parsed.append(chat_from_dict(item, self.limits, ("items", i)))
+            except InvalidRequest as e:
+                errors += e.errors
+        if errors:
+            raise InvalidRequest(errors)
+        batch.items = parsed
+        return batch
+
+
+_parser: Optional[RequestParser] = None
+
+
+# 获取全局请求解析器（限制和快速路径开关来自环境变量）
+def get_request_parser() -> RequestParser:
+    global _parser
+    if _parser is None:
+        _parser = RequestParser.from_env()
+    return _parser
+
+
+# 替换全局请求解析器，返回旧的（测试 / 基准用）
+def set_request_parser(parser: Optional[RequestParser]) -> Optional[RequestParser]:
+    global _parser
+    old, _parser = _parser, parser
+    return old
@@ -0,0 +1,233 @@
+import asyncio
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+from src.app.core.config import env_flag, env_int_map
+
+"""准入控制（admission control）：按 provider / model 限制并发 + 有界等待队列 + 加权公平调度
+    突发流量时不让几百个生成同时压到同一块 GPU 上，而是：
+        - 每个 provider、每个 model 各有并发上限（0 表示不限制）；
+        - 超出上限的请求进入有界等待队列，最多等待 max_wait_s 秒；队列长度按 provider 分别计算，
+          某个 provider 排满不会影响其他 provider，没有并发上限的 provider / model 永远不排队；
+        - 队列已满直接返回 429，等待超时返回 503，都带 Retry-After；
+        - 队列按租户（API key / session_id / 客户端 IP）做加权公平调度（WFQ）：
+          每个请求的代价按 max_tokens 估算，某个租户的请求越“重”，它后续请求的虚拟完成时间越靠后，
+          避免一个重度客户端饿死其他客户端。
+    环境变量：
+        - CHAT_ADMISSION_ENABLED（默认 1）：是否开启
+        - CHAT_PROVIDER_CONCURRENCY（默认空，不限制）：按 provider 的并发上限，例如 "ollama=8,mock=0"；
+          上限是这个 provider 全部后端合计的并发（OLLAMA_BASE_URLS 配了多台时按总容量填写）
+        - CHAT_MODEL_CONCURRENCY（默认空）：按 model 的并发上限，例如 "qwen2.5:7b=2"
+        - CHAT_QUEUE_MAX（默认 256）：每个 provider 的等待队列长度上限
+        - CHAT_QUEUE_MAX_WAIT_S（默认 30）：最长排队时间（秒）
+"""
+
+
+class AdmissionRejected(Exception):
+    """请求未能获得执行名额：429（队列已满）或 503（排队超时）"""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Slot:
+    """一个执行名额；用完必须 release()（可重复调用）"""
+
+    __slots__ = ("_ctl", "provider", "model", "wait_ms", "queue_depth", "granted_at", "_released")
+
+    def __init__(self, ctl: "AdmissionController", provider: str, model: str, wait_ms: int, queue_depth: int):
+        self._ctl = ctl
+        self.provider = provider
+        self.model = model
+        # 排队等待时间（毫秒）和入队时前面排着的请求数
+        self.wait_ms = wait_ms
+        self.queue_depth = queue_depth
+        self.granted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._ctl._release(self)
+
+
+class _Waiter:
+    __slots__ = ("provider", "model", "finish_tag", "start_tag", "future", "enqueued_at", "queue_depth")
+
+    def __init__(self, provider, model, start_tag, finish_tag, future, queue_depth):
+        self.provider = provider
+        self.model = model
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.queue_depth = queue_depth
+
+
+class AdmissionController:
+    def __init__(self, provider_limits: Optional[Dict[str, int]] = None, model_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 256, max_wait_s: float = 30.0):
+        self.provider_limits = provider_limits or {}
+        self.model_limits = model_limits or {}
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self._active_provider: Dict[str, int] = {}
+        self._active_model: Dict[str, int] = {}
+        self._waiters: List[_Waiter] = []
+        # 按 provider / model 统计的排队数：只有同一 provider / model 上有人排队时才不能走快速路径
+        self._queued_provider: Dict[str, int] = {}
+        self._queued_model: Dict[str, int] = {}
+        # WFQ：全局虚拟时间 + 每个租户上一个请求的虚拟完成时间
+        self._vtime = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        # 每个 provider 占用名额的平均时长（EWMA，秒），用于估算 Retry-After
+        self._avg_hold_s: Dict[str, float] = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _has_capacity(self, provider: str, model: str) -> bool:
+        p_limit = self.provider_limits.get(provider, 0)
+        if p_limit and self._active_provider.get(provider, 0) >= p_limit:
+            return False
+        m_limit = self.model_limits.get(model, 0)
+        if m_limit and self._active_model.get(model, 0) >= m_limit:
+            return False
+        return True
+
+    def _retry_after(self, provider: str) -> int:
+        capacity = self.provider_limits.get(provider, 0) or 1
+        hold = self._avg_hold_s.get(provider, 1.0)
+        return max(1, math.ceil(hold * (self._queued_provider.get(provider, 0) + 1) / capacity))
+
+    # 排队数：不传 provider 时为全部
+    def queue_depth(self, provider: Optional[str] = None) -> int:
+        if provider is None:
+            return len(self._waiters)
+        return self._queued_provider.get(provider, 0)
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        self._waiters.append(waiter)
+        self._queued_provider[waiter.provider] = self._queued_provider.get(waiter.provider, 0) + 1
+        self._queued_model[waiter.model] = self._queued_model.get(waiter.model, 0) + 1
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        self._waiters.remove(waiter)
+        self._queued_provider[waiter.provider] -= 1
+        self._queued_model[waiter.model] -= 1
+
+    async def acquire(self, provider: str, model: Optional[str], tenant: str, cost: int) -> Slot:
+        model = model or ""
+        # 虚拟开始时间 = max(当前虚拟时间, 该租户上一个请求的虚拟完成时间)；代价越大，完成时间越靠后
+        start_tag = max(self._vtime, self._tenant_finish.get(tenant, 0.0))
+        finish_tag = start_tag + max(1, cost)
+        depth = self._queued_provider.get(provider, 0)
+        if len(self._tenant_finish) > 10000:
+            # 完成时间不晚于当前虚拟时间的租户与“没出现过”等价，可以清理掉
+            self._tenant_finish = {t: f for t, f in self._tenant_finish.items() if f > self._vtime}
+
+        # 快速路径：同一 provider / model 上没人排队且有空闲名额，直接放行（不限并发的 provider 总是走这里）
+        if not self._queued_provider.get(provider) and not self._queued_model.get(model) \
+                and self._has_capacity(provider, model):
+            self._tenant_finish[tenant] = finish_tag
+            return self._grant(provider, model, start_tag, 0, 0)
+
+        if depth >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(429, self._retry_after(provider), "admission queue is full")
+
+        self._tenant_finish[tenant] = finish_tag
+        waiter = _Waiter(provider, model, start_tag, finish_tag, asyncio.get_running_loop().create_future(), depth)
+        self._enqueue(waiter)
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(waiter.future, self.max_wait_s)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._dequeue(waiter)
+            self.timeouts += 1
+            raise AdmissionRejected(503, self._retry_after(provider), "timed out waiting for capacity")
+        except asyncio.CancelledError:
+            # 排队中的请求被取消（例如客户端断开）：退出队列；已经拿到名额的要还回去
+            if waiter in self._waiters:
+                self._dequeue(waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                waiter.future.result().release()
+            raise
+
+    def _grant(self, provider: str, model: str, start_tag: float, wait_ms: int, depth: int) -> Slot:
+        self._vtime = max(self._vtime, start_tag)
+        self._active_provider[provider] = self._active_provider.get(provider, 0) + 1
+        self._active_model[model] = self._active_model.get(model, 0) + 1
+        self.admitted += 1
+        return Slot(self, provider, model, wait_ms, depth)
+
+    # 把空出来的名额按虚拟完成时间从小到大分给能运行的等待者
+    def _dispatch(self) -> None:
+        while self._waiters:
+            best = None
+            for w in self._waiters:
+                if w.future.done():
+                    continue
+                if self._has_capacity(w.provider, w.model) and (best is None or w.finish_tag < best.finish_tag):
+                    best = w
+            for w in [w for w in self._waiters if w.future.done()]:
+                self._dequeue(w)
+            if best is None:
+                return
+            self._dequeue(best)
+            wait_ms = int((time.monotonic() - best.enqueued_at) * 1000)
+            best.future.set_result(self._grant(best.provider, best.model, best.start_tag, wait_ms, best.queue_depth))
+
+    def _release(self, slot: Slot) -> None:
+        self._active_provider[slot.provider] -= 1
+        self._active_model[slot.model] -= 1
+        held = time.monotonic() - slot.granted_at
+        prev = self._avg_hold_s.get(slot.provider)
+        self._avg_hold_s[slot.provider] = held if prev is None else prev * 0.8 + held * 0.2
+        self._dispatch()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queue_depth": len(self._waiters),
+            "queued": {p: n for p, n in self._queued_provider.items() if n},
+            "active": dict(self._active_provider),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            provider_limits=env_int_map("CHAT_PROVIDER_CONCURRENCY"),
+            model_limits=env_int_map("CHAT_MODEL_CONCURRENCY"),
+            max_queue=int(os.getenv("CHAT_QUEUE_MAX", "256")),
+            max_wait_s=float(os.getenv("CHAT_QUEUE_MAX_WAIT_S", "30")),
+        )
+
+
+_controller: Optional[AdmissionController] = None
+_controller_loaded = False
+
+
+# 获取全局准入控制器；未开启（CHAT_ADMISSION_ENABLED=0）时返回 None
+def get_admission() -> Optional[AdmissionController]:
+    global _controller, _controller_loaded
+    if not _controller_loaded:
+        if env_flag("CHAT_ADMISSION_ENABLED", "1"):
+            _controller = AdmissionController.from_env()
+        _controller_loaded = True
+    return _controller
+
+
+# 替换全局准入控制器（None 表示关闭），返回旧的控制器
+def set_admission(controller: Optional[AdmissionController]) -> Optional[AdmissionController]:
+    global _controller, _controller_loaded
+    old, _controller, _controller_loaded = _controller, controller, True
+    return old
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 class ChatMessage(BaseModel):
     # 定义消息角色字段：只能是“system”、“user”、“assistant”中的一个，默认user
@@ -23,6 +23,16 @@ class ChatRequest(BaseModel):
     # 选择器，诉后端代码：“本次聊天请求，需要使用哪一个 AI 服务 / 模型引擎来处理并生成回复”。
     # 限制只能mock或ollama回复，避免传入无效值
     provider: Literal["mock", "ollama"] = "mock"
+    # 流式输出合批：时间窗口（毫秒）和字节阈值，先到先刷；不传时使用服务端默认值（SSE_FLUSH_MS / SSE_FLUSH_BYTES）
+    # 0 表示不合批，每个片段单独发送；首个 token 始终立即发送
+    stream_flush_ms: Optional[int] = Field(default=None, ge=0, le=1000, description="SSE token batching window in ms")
+    stream_flush_bytes: Optional[int] = Field(default=None, ge=1, le=65536, description="SSE token batching byte threshold")
+
+# 批量请求：/chat/batch，items 中每一条都是完整的 ChatRequest
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest] = Field(min_length=1, max_length=1000)
+    # 最多同时执行的条数；不传时使用服务端默认值（CHAT_BATCH_PARALLELISM）
+    parallelism: Optional[int] = Field(default=None, ge=1, le=64, description="max items generated concurrently")
 
 # ChatResponse响应模型
 class ChatResponse(BaseModel):
@@ -32,4 +42,7 @@ class ChatResponse(BaseModel):
     # 会话 ID -> 和 ChatRequest 中的 session_id 对应，返回客户端传入的会话 ID（如果有），用于维持用户的聊天上下文（比如多轮对话记忆）。
     session_id: Optional[str] = None
     # AI 针对用户请求生成的最终回复内容，也是响应中最核心的字段。
-    answer: str
\ No newline at end of file
+    answer: str
+    # 后端统计换算出的真实 token 数和速度：tokens / tokens_per_s / prompt_tokens / prompt_tokens_per_s
+    # （与 /chat/stream 的 usage 事件字段相同）；后端没有返回统计（mock、缓存命中）时省略
+    usage: Optional[Dict[str, Any]] = None
\ No newline at end of file
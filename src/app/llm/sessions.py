@@ -0,0 +1,182 @@
+import hashlib
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from src.app.core.config import env_flag
+from src.app.llm.context import TokenCounter
+from src.app.llm.engines.base import GenerationState, LLMEngine
+from src.app.llm.schemas import ChatMessage
+
+"""服务端会话记忆（按 session_id）
+    ChatRequest.session_id 存在时，服务端保存该会话的历史消息和 Ollama 返回的 KV context：
+        - 客户端后续只需发送新消息（仍然发送完整历史也可以，会自动识别已保存的前缀）；
+        - 引擎支持 context 时（Ollama），只把新消息作为 prompt，连同上一轮的 context 一起发送，
+          Ollama 复用已计算过的 prompt 缓存，长对话不用每轮重新做 prompt eval。
+    会话按“调用方 + session_id”隔离：存储的 key 由 session_key(owner, session_id) 生成，owner 是调用方身份
+    （API key，没有时为客户端 IP），其他调用方猜到或复用同一个 session_id 也读不到、改不了这段历史和 KV context。
+    有界存储：会话数上限 + 字节上限（LRU 淘汰）+ 空闲 TTL 过期。
+    环境变量：
+        - CHAT_SESSION_ENABLED（默认 1）：是否开启
+        - CHAT_SESSION_MAX（默认 10000）：最多保存的会话数
+        - CHAT_SESSION_MAX_BYTES（默认 268435456，即 256MB）：所有会话的字节上限
+        - CHAT_SESSION_IDLE_TTL_S（默认 1800）：会话空闲多久后过期（秒）
+"""
+
+_MESSAGE_OVERHEAD = 96
+_SESSION_OVERHEAD = 256
+
+
+class Session:
+    __slots__ = ("messages", "context", "backend", "size", "last_used")
+
+    def __init__(self, messages: List[ChatMessage], context: Optional[array], backend: str, size: int):
+        self.messages = messages
+        # Ollama 的 context 是 token id 列表，用 array 紧凑保存
+        self.context = context
+        # 产生 context 的 “引擎:模型”，换了模型 context 就不能复用
+        self.backend = backend
+        self.size = size
+        self.last_used = time.monotonic()
+
+
+class SessionTurn:
+    """一轮对话的准备结果
+        - history：本轮完整的对话历史（保存会话时使用）
+        - prompt_messages：实际发给引擎的消息（复用 context 时只有新消息）
+        - state：传给引擎的 GenerationState（带上一轮 context，结束后带回新 context）
+    """
+
+    __slots__ = ("history", "prompt_messages", "state", "reused_context")
+
+    def __init__(self, history: List[ChatMessage], prompt_messages: List[ChatMessage], state: GenerationState):
+        self.history = history
+        self.prompt_messages = prompt_messages
+        self.state = state
+        self.reused_context = state.context is not None
+
+
+# 会话存储的 key：调用方身份的摘要 + session_id（key 里不直接保存 API key）
+def session_key(owner: str, session_id: str) -> str:
+    return f"{hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32]}:{session_id}"
+
+
+def _backend_id(engine: LLMEngine) -> str:
+    return f"{engine.name}:{getattr(engine, 'model', None)}"
+
+
+def _same(a: ChatMessage, b: ChatMessage) -> bool:
+    return a.role == b.role and a.content == b.content
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 10000, max_bytes: int = 256 * 1024 * 1024, idle_ttl_s: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl_s = idle_ttl_s
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[Session]:
+        sess = self._sessions.get(session_id)
+        if sess is None:
+            return None
+        if time.monotonic() - sess.last_used > self.idle_ttl_s:
+            self.drop(session_id)
+            self.evictions += 1
+            return None
+        sess.last_used = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return sess
+
+    def drop(self, session_id: str) -> None:
+        sess = self._sessions.pop(session_id, None)
+        if sess is not None:
+            self._bytes -= sess.size
+
+    def save(self, session_id: str, messages: List[ChatMessage], context: Optional[List[int]], backend: str) -> None:
+        ctx = array("i", context) if context else None
+        size = _SESSION_OVERHEAD + len(session_id)
+        size += sum(len(m.content.encode("utf-8")) + _MESSAGE_OVERHEAD for m in messages)
+        if ctx is not None:
+            size += ctx.itemsize * len(ctx)
+        self.drop(session_id)
+        if size > self.max_bytes:
+            return
+        self._sessions[session_id] = Session(messages, ctx, backend, size)
+        self._bytes += size
+        # 超出会话数或字节上限时，从最久未使用的一端淘汰
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            oldest = next(iter(self._sessions))
+            self.drop(oldest)
+            self.evictions += 1
+
+    # 准备一轮对话：拼出完整历史，并决定是否复用上一轮的 context
+    # token_budget：prompt 可用的 token 预算；上一轮 context + 新消息超出预算时不再复用 context，
+    # 改为发送（随后会被裁剪的）完整历史
+    def begin(self, session_id: str, incoming: List[ChatMessage], engine: LLMEngine,
+              token_budget: Optional[int] = None, counter: Optional[TokenCounter] = None) -> SessionTurn:
+        sess = self.get(session_id)
+        if sess is None:
+            return SessionTurn(list(incoming), list(incoming), GenerationState())
+
+        stored = sess.messages
+        n = len(stored)
+        if len(incoming) >= n and all(_same(a, b) for a, b in zip(stored, incoming)):
+            # 客户端发来的是完整历史：已保存的部分是前缀，剩下的才是新消息
+            new_messages = list(incoming[n:])
+        elif len(incoming) > 1:
+            # 客户端发来了另一段完整历史（例如编辑了之前的消息）：以客户端为准，丢弃旧 context
+            return SessionTurn(list(incoming), list(incoming), GenerationState())
+        else:
+            # 只发来新消息：追加到已保存的历史后面
+            new_messages = list(incoming)
+
+        history = list(stored) + new_messages
+        if (engine.supports_context and sess.context is not None
+                and sess.backend == _backend_id(engine) and new_messages
+                and (token_budget is None or counter is None
+                     or len(sess.context) + counter.count_messages(new_messages) <= token_budget)):
+            return SessionTurn(history, new_messages, GenerationState(context=sess.context.tolist()))
+        return SessionTurn(history, history, GenerationState())
+
+    # 一轮对话成功结束：保存历史（含本轮回复）和新的 context
+    def commit(self, session_id: str, turn: SessionTurn, answer: str, engine: LLMEngine) -> None:
+        history = turn.history + [ChatMessage(role="assistant", content=answer)]
+        context = turn.state.new_context if engine.supports_context else None
+        self.save(session_id, history, context, _backend_id(engine))
+
+    def stats(self) -> Dict[str, int]:
+        return {"sessions": len(self._sessions), "bytes": self._bytes, "evictions": self.evictions}
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        return cls(
+            max_sessions=int(os.getenv("CHAT_SESSION_MAX", "10000")),
+            max_bytes=int(os.getenv("CHAT_SESSION_MAX_BYTES", str(256 * 1024 * 1024))),
+            idle_ttl_s=float(os.getenv("CHAT_SESSION_IDLE_TTL_S", "1800")),
+        )
+
+
+_store: Optional[SessionStore] = None
+_store_loaded = False
+
+
+# 获取全局会话存储；未开启（CHAT_SESSION_ENABLED=0）时返回 None
+def get_session_store() -> Optional[SessionStore]:
+    global _store, _store_loaded
+    if not _store_loaded:
+        if env_flag("CHAT_SESSION_ENABLED", "1"):
+            _store = SessionStore.from_env()
+        _store_loaded = True
+    return _store
+
+
+# 替换全局会话存储（None 表示关闭），返回旧的存储
+def set_session_store(store: Optional[SessionStore]) -> Optional[SessionStore]:
+    global _store, _store_loaded
+    old, _store, _store_loaded = _store, store, True
+    return old
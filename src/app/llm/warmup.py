@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from src.app.core.config import env_flag
+from src.app.core.resumable import get_replay_store
+from src.app.core.sse import sse_event_bytes
+from src.app.llm.cache import get_cache
+from src.app.llm.coalesce import get_coalescer
+from src.app.llm.context import get_context_budget
+from src.app.llm.engines import EngineRegistry
+from src.app.llm.scheduler import get_admission
+from src.app.llm.sessions import get_session_store
+
+"""启动预热 + 就绪状态（/ready）
+    部署后的第一批请求会碰上冷的 Ollama 模型加载、冷的连接池和各个组件的懒加载，p99 在最初一分钟明显升高。
+    开启 CHAT_WARMUP 后，lifespan 启动时在后台执行预热：
+        - 初始化各个懒加载组件（缓存、合并、会话、上下文预算、准入控制、回放缓冲、SSE 编码）；
+        - 对每台后端：健康检查（建立连接）→ 带 keep_alive 的空 prompt 请求（预加载 OLLAMA_MODEL）→ 1 个 token 的生成；
+        - 每台后端都没有预热成功时，每隔 CHAT_WARMUP_RETRY_S（默认 5）秒重试。
+    /ready 在预热完成前返回 503，完成后返回 200，并报告每台后端的模型加载状态和各阶段耗时。
+    未开启预热时 /ready 直接返回 200（没有需要等待的东西）。
+"""
+
+
+class WarmupState:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        # disabled / pending / running / done
+        self.status = "pending" if enabled else "disabled"
+        self.attempts = 0
+        self.started_at: Optional[float] = None
+        self.duration_ms: Optional[int] = None
+        # provider -> 每台后端的预热结果
+        self.results: Dict[str, List[Dict[str, Any]]] = {}
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status in ("disabled", "done")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "status": self.status,
+            "attempts": self.attempts,
+            "duration_ms": self.duration_ms,
+            "results": self.results,
+        }
+
+
+# 初始化懒加载的组件，避免第一个请求承担这些开销
+def init_components() -> None:
+    get_cache()
+    get_coalescer()
+    get_session_store()
+    get_context_budget()
+    get_admission()
+    get_replay_store()
+    sse_event_bytes("usage", {"warmup": True})
+
+
+def _warmed(results: Dict[str, List[Dict[str, Any]]]) -> bool:
+    # 有后端的引擎至少要有一台预热成功
+    return all(not backends or any(b["ok"] for b in backends) for backends in results.values())
+
+
+async def run_warmup(registry: EngineRegistry, state: WarmupState, retry_s: float = 5.0) -> None:
+    state.status = "running"
+    state.started_at = time.perf_counter()
+    init_components()
+    while True:
+        state.attempts += 1
+        results = {}
+        for provider, engine in registry.engines().items():
+            results[provider] = await engine.warmup()
+        state.results = results
+        if _warmed(results):
+            break
+        await asyncio.sleep(retry_s)
+    state.duration_ms = int((time.perf_counter() - state.started_at) * 1000)
+    state.status = "done"
+
+
+# 在 lifespan 中启动后台预热（不阻塞启动，/health 可以立刻响应，/ready 在预热完成后才返回 200）
+def start_warmup(registry: EngineRegistry) -> WarmupState:
+    state = WarmupState(env_flag("CHAT_WARMUP", "0"))
+    set_warmup_state(state)
+    if state.enabled:
+        retry_s = float(os.getenv("CHAT_WARMUP_RETRY_S", "5"))
+        state.task = asyncio.get_running_loop().create_task(run_warmup(registry, state, retry_s))
+    return state
+
+
+async def stop_warmup(state: WarmupState) -> None:
+    task, state.task = state.task, None
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+
+_state: Optional[WarmupState] = None
+
+
+# 获取全局预热状态；未经过 lifespan（例如直接 TestClient(app)）时视为未开启
+def get_warmup_state() -> WarmupState:
+    global _state
+    if _state is None:
+        _state = WarmupState(enabled=False)
+    return _state
+
+
+def set_warmup_state(state: Optional[WarmupState]) -> Optional[WarmupState]:
+    global _state
+    old, _state = _state, state
+    return old
@@ -1,10 +1,43 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 from src.app.api.routes_chat import router as chat_router
-from src.app.core.logging import install_logging_middleware
+from src.app.api.routes_metrics import router as metrics_router
+from src.app.core.metrics import REGISTRY
+from src.app.core.logging import get_log_sink, install_logging_middleware
+from src.app.llm.engines import EngineRegistry, get_registry, set_registry
+from src.app.llm.warmup import get_warmup_state, start_warmup, stop_warmup
+
+"""应用生命周期（lifespan）
+    启动时创建一次引擎注册表（引擎实例 + 长连接池在整个 app 生命周期内复用）；
+    关闭时统一关闭所有连接池，避免连接泄漏。
+    多进程模式（PROMETHEUS_MULTIPROC_DIR）下启动后台线程定期写指标快照。
+    开启 CHAT_WARMUP 时在后台预热（建立连接、预加载模型、一次极小的生成），完成后 /ready 才返回 200。
+"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry = EngineRegistry()
+    old = set_registry(registry)
+    if old is not None:
+        await old.aclose()
+    app.state.engines = registry
+    # 多后端时启动后台健康检查
+    await registry.start()
+    REGISTRY.start_flusher()
+    warmup = start_warmup(registry)
+    try:
+        yield
+    finally:
+        await stop_warmup(warmup)
+        set_registry(None)
+        await registry.aclose()
+        # 写完队列里剩余的日志
+        get_log_sink().close()
 
 # 创建一个 FastAPI 应用实例 app，这是整个后端服务的核心对象，所有的中间件、路由、配置都挂载在这个实例上；
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 """安装全局日志中间件
     作用：所有通过这个 app 处理的请求（包括 /health、/chat、/chat/stream）都会被中间件拦截，自动添加 trace ID 和耗时统计。
 """
@@ -18,7 +51,25 @@ install_logging_middleware(app)
 def health():
     return {"status": "ok"}
 
+"""定义就绪检查接口
+    与 /health（进程存活）不同，/ready 表示可以接流量：开启预热时，预热完成前返回 503，负载均衡不会把请求转发过来；
+    同时报告每台后端的健康 / 熔断状态、已加载的模型，以及预热各阶段的耗时。
+"""
+@app.get("/ready")
+def ready():
+    warmup = get_warmup_state()
+    backends = {}
+    for provider, engine in get_registry().engines().items():
+        pool = getattr(engine, "backends", None)
+        if pool is not None:
+            backends[provider] = pool.states()
+    body = {"ready": warmup.ready, "warmup": warmup.to_dict(), "backends": backends}
+    return JSONResponse(body, status_code=200 if warmup.ready else 503)
+
 """整合聊天路由模块
 实现路由模块化：把不同功能的接口（聊天、用户、订单等）拆分到不同文件，避免入口文件代码臃肿；
 """
-app.include_router(chat_router)
\ No newline at end of file
+app.include_router(chat_router)
+
+# 指标接口：GET /metrics（Prometheus 文本格式）
+app.include_router(metrics_router)
\ No newline at end of file
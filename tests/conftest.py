@@ -11,4 +11,16 @@ chat-api/          # 项目根目录（我们要添加到sys.path的目录）
 # __file__是当前执行脚本文件路径，转换为Path对象，解析为绝对路径，获取当前路径的第一级父目录
 ROOT = Path(__file__).resolve().parents[1]
 # 将项目根目录加入搜索路径
-sys.path.insert(0, str(ROOT))
\ No newline at end of file
+sys.path.insert(0, str(ROOT))
+
+import pytest
+
+
+# 每个用例结束后重置全局引擎注册表，避免引擎实例（及其读取的环境变量、连接池）在用例之间串用
+@pytest.fixture(autouse=True)
+def reset_engine_registry():
+    yield
+    from src.app.llm.engines import set_registry
+    old = set_registry(None)
+    if old is not None:
+        old.close()
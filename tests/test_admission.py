@@ -0,0 +1,165 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.coalesce import StreamCoalescer, set_coalescer
+from src.app.llm.scheduler import AdmissionController, AdmissionRejected, set_admission
+
+"""准入控制测试
+    - 超过并发上限的请求排队，队列满返回 429，排队超时返回 503，带 Retry-After
+    - 队列按 provider 分别计算：一个 provider 排满不影响其他 provider，不限并发的 provider 不排队
+    - 默认不限制任何 provider 的并发（需要时通过 CHAT_PROVIDER_CONCURRENCY 配置）
+    - 加权公平：重度租户的后续请求排在轻度租户之后
+    - SSE 的 meta/usage 事件带上排队信息
+    - 准入时要加入的合并生成在开始响应前已经结束时，成为 leader 的请求先补拿名额
+"""
+
+
+def test_queue_full_and_timeout():
+    async def main():
+        ctl = AdmissionController(provider_limits={"ollama": 1}, max_queue=1, max_wait_s=0.05)
+        held = await ctl.acquire("ollama", "m", "a", 10)
+        waiting = asyncio.create_task(ctl.acquire("ollama", "m", "b", 10))
+        await asyncio.sleep(0)
+        try:
+            await ctl.acquire("ollama", "m", "c", 10)
+        except AdmissionRejected as e:
+            full = e
+        try:
+            await waiting
+        except AdmissionRejected as e:
+            timeout = e
+        held.release()
+        return full, timeout, ctl
+
+    full, timeout, ctl = asyncio.run(main())
+    assert full.status_code == 429 and full.retry_after >= 1
+    assert timeout.status_code == 503
+    assert ctl.stats()["active"] == {"ollama": 0}
+
+
+def test_queue_is_per_provider():
+    async def main():
+        ctl = AdmissionController(provider_limits={"ollama": 1, "vllm": 1}, max_queue=1)
+        held = await ctl.acquire("ollama", "m", "a", 10)
+        waiting = asyncio.create_task(ctl.acquire("ollama", "m", "b", 10))
+        await asyncio.sleep(0)
+        try:
+            await ctl.acquire("ollama", "m", "c", 10)
+        except AdmissionRejected as e:
+            full = e
+        # ollama 排满时，其他 provider 照常拿名额：不限并发的 mock 直接放行，有上限的 vllm 有自己的队列
+        mock = await ctl.acquire("mock", None, "c", 10)
+        vllm = await ctl.acquire("vllm", "v", "c", 10)
+        stats = ctl.stats()
+        held.release()
+        (await waiting).release()
+        mock.release()
+        vllm.release()
+        return full, mock, stats
+
+    full, mock, stats = asyncio.run(main())
+    assert full.status_code == 429 and mock.wait_ms == 0
+    assert stats["queued"] == {"ollama": 1} and stats["active"]["mock"] == 1
+
+
+def test_no_concurrency_cap_by_default(monkeypatch):
+    monkeypatch.delenv("CHAT_PROVIDER_CONCURRENCY", raising=False)
+    monkeypatch.delenv("CHAT_MODEL_CONCURRENCY", raising=False)
+    ctl = AdmissionController.from_env()
+    assert ctl.provider_limits == {} and ctl.model_limits == {}
+    monkeypatch.setenv("CHAT_PROVIDER_CONCURRENCY", "ollama=8")
+    assert AdmissionController.from_env().provider_limits == {"ollama": 8}
+
+
+def test_weighted_fair_order_across_tenants():
+    async def main():
+        ctl = AdmissionController(provider_limits={"ollama": 1})
+        held = await ctl.acquire("ollama", "m", "heavy", 1000)
+        order = []
+
+        async def req(tenant, cost):
+            slot = await ctl.acquire("ollama", "m", tenant, cost)
+            order.append(tenant)
+            await asyncio.sleep(0)
+            slot.release()
+
+        # 重度租户先排了两个大请求，轻度租户后到但代价小
+        tasks = [asyncio.create_task(req("heavy", 1000)), asyncio.create_task(req("heavy", 1000))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(req("light", 10)))
+        await asyncio.sleep(0)
+        held.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(main()) == ["light", "heavy", "heavy"]
+
+
+def test_model_limit_applies_across_providers():
+    async def main():
+        ctl = AdmissionController(model_limits={"m": 1}, max_wait_s=0.01)
+        held = await ctl.acquire("ollama", "m", "a", 1)
+        other = await ctl.acquire("ollama", "other", "a", 1)  # 不同模型不受影响
+        try:
+            await ctl.acquire("ollama", "m", "b", 1)
+        except AdmissionRejected as e:
+            return e.status_code
+        finally:
+            held.release()
+            other.release()
+
+    assert asyncio.run(main()) == 503
+
+
+def test_chat_rejected_with_retry_after():
+    ctl = AdmissionController(provider_limits={"mock": 1}, max_queue=0)
+    old = set_admission(ctl)
+    try:
+        # 先占满 mock 的名额
+        held = asyncio.run(ctl.acquire("mock", None, "x", 1))
+        client = TestClient(app)
+        r = client.post("/chat", json={"provider": "mock", "messages": [{"role": "user", "content": "hi"}]})
+        assert r.status_code == 429
+        assert int(r.headers["retry-after"]) >= 1
+        held.release()
+        r = client.post("/chat", json={"provider": "mock", "messages": [{"role": "user", "content": "hi"}]})
+        assert r.status_code == 200
+    finally:
+        set_admission(old)
+
+
+def test_stream_events_include_queue_info():
+    client = TestClient(app)
+    payload = {"provider": "mock", "messages": [{"role": "user", "content": "hi"}]}
+    with client.stream("POST", "/chat/stream", json=payload) as r:
+        text = "".join(r.iter_text())
+    assert '"queue_wait_ms": 0' in text
+    assert '"queue_depth": 0' in text
+
+
+class _FinishedFlightCoalescer(StreamCoalescer):
+    """准入检查时报告已有相同的生成，之后该生成已经结束"""
+
+    def __init__(self):
+        super().__init__()
+        self.checks = 0
+
+    def has_flight(self, key):
+        self.checks += 1
+        return self.checks == 1 or super().has_flight(key)
+
+
+def test_coalesce_leader_acquires_slot_when_flight_finished():
+    ctl = AdmissionController(provider_limits={"mock": 1})
+    old_ctl, old_co = set_admission(ctl), set_coalescer(_FinishedFlightCoalescer())
+    try:
+        client = TestClient(app)
+        payload = {"provider": "mock", "temperature": 0, "messages": [{"role": "user", "content": "race"}]}
+        r = client.post("/chat/stream", json=payload)
+    finally:
+        set_admission(old_ctl)
+        set_coalescer(old_co)
+    assert "event: done" in r.text
+    assert ctl.admitted == 1 and ctl.stats()["active"] == {"mock": 0}
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.engines import BackendPool, ClientPool, OllamaEngine, get_registry
+
+"""多后端路由测试
+    - 优先选择已加载目标模型的后端，其次是在途请求最少的
+    - 连续失败后熔断，冷却期内不再被选中
+    - 第一个 token 之前失败时换后端重试；已经发出 token 之后的失败直接返回错误，但仍计入熔断
+    - 非流式的 generate / agenerate 走同一个故障转移循环，结束后不残留在途计数
+"""
+
+A, B = "http://a.test", "http://b.test"
+
+
+def _engine(handler, urls=(A, B)) -> OllamaEngine:
+    return OllamaEngine(base_urls=list(urls), model="m",
+                        pool=ClientPool(5, transport=httpx.MockTransport(handler)))
+
+
+def _stream_body(*tokens: str, done: bool = True) -> bytes:
+    lines = [json.dumps({"response": t, "done": False}) for t in tokens]
+    if done:
+        lines.append(json.dumps({"response": "", "done": True, "eval_count": len(tokens)}))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_pick_prefers_loaded_model_then_least_outstanding():
+    pool = BackendPool([A, B, "http://c.test"], ClientPool(5))
+    a, b, c = pool.backends
+    a.outstanding, b.outstanding, c.outstanding = 3, 1, 2
+    assert pool.pick("m") is b
+    c.models_loaded = {"m"}
+    assert pool.pick("m") is c
+    # b 没有这个模型：排在其他后端之后
+    c.models_loaded, b.models_available = None, {"other"}
+    assert pool.pick("m") is c
+    assert pool.pick("m", exclude=[a, b, c]) is None
+
+
+def test_health_check_reads_tags_and_ps():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "b.test":
+            return httpx.Response(500)
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": [{"name": "m"}, {"name": "n"}]})
+        return httpx.Response(200, json={"models": [{"name": "m", "model": "m"}]})
+
+    engine = _engine(handler)
+    asyncio.run(engine.backends.check_all())
+    a, b = engine.backends.backends
+    assert a.healthy and a.models_available == {"m", "n"} and a.models_loaded == {"m"}
+    assert not b.healthy
+    assert engine.backends.pick("m") is a
+
+
+def test_circuit_breaker_ejects_failing_backend():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host == "a.test":
+            return httpx.Response(503)
+        return httpx.Response(200, json={"response": "ok", "done": True})
+
+    engine = _engine(handler)
+    engine.backends.failure_threshold = 2
+    for _ in range(4):
+        assert asyncio.run(engine.agenerate([], 0, 1, 8)) == "ok"
+    a, b = engine.backends.backends
+    assert a.circuit_open(time.monotonic())
+    # 熔断之后请求直接发往 b
+    assert calls.count("a.test") == 2
+    assert a.outstanding == 0 and b.outstanding == 0
+
+
+def test_stream_fails_over_before_first_token():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "a.test":
+            return httpx.Response(200, content=json.dumps({"error": "model failed to load"}).encode() + b"\n")
+        return httpx.Response(200, content=_stream_body("he", "llo"))
+
+    engine = _engine(handler)
+    get_registry().register("ollama", engine)
+    r = TestClient(app).post("/chat/stream", json={"provider": "ollama", "messages": [{"role": "user", "content": "x"}]})
+    assert "event: token\ndata: he" in r.text and "event: error" not in r.text
+    assert engine.backends.backends[0].failures == 1
+
+
+def test_stream_does_not_retry_after_first_token():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        return httpx.Response(200, content=_stream_body("partial", done=False)
+                              + json.dumps({"error": "gpu reset"}).encode() + b"\n")
+
+    engine = _engine(handler)
+
+    async def main():
+        got = []
+        with pytest.raises(Exception):
+            async for token in engine.stream([], 0, 1, 8):
+                got.append(token)
+        return got
+
+    assert asyncio.run(main()) == ["partial"]
+    assert len(calls) == 1
+    failed = next(b for b in engine.backends.backends if b.url == f"http://{calls[0]}")
+    assert failed.failures == 1
+
+
+def test_generate_and_agenerate_fail_over():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.host)
+        if request.url.host == "a.test":
+            return httpx.Response(503)
+        return httpx.Response(200, json={"response": "ok", "done": True, "eval_count": 1})
+
+    engine = _engine(handler)
+    assert engine.generate([], 0, 1, 8) == "ok"
+    assert asyncio.run(engine.agenerate([], 0, 1, 8)) == "ok"
+    assert calls == ["a.test", "b.test"] * 2
+    assert [b.outstanding for b in engine.backends.backends] == [0, 0]
+
+    engine = _engine(lambda request: httpx.Response(400))
+    with pytest.raises(httpx.HTTPStatusError):
+        engine.generate([], 0, 1, 8)
+    assert [b.outstanding for b in engine.backends.backends] == [0, 0]
@@ -0,0 +1,71 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.core.batching import batch_tokens
+
+"""SSE token 合批测试
+    - 首个 token 立即单独发送
+    - 之后按时间窗口 / 字节阈值合并，内容不丢不乱
+    - 请求级 stream_flush_ms 生效
+"""
+
+
+async def _source(tokens, delay):
+    for t in tokens:
+        await asyncio.sleep(delay)
+        yield t
+
+
+async def _collect(agen):
+    return [t async for t in agen]
+
+
+def test_first_token_flushed_alone_and_rest_batched():
+    chunks = asyncio.run(_collect(batch_tokens(_source(list("abcdefghij"), 0.001), flush_ms=50, flush_bytes=1024)))
+    assert chunks[0] == "a"
+    assert "".join(chunks) == "abcdefghij"
+    assert len(chunks) < 10
+
+
+def test_byte_threshold_flushes_before_window():
+    chunks = asyncio.run(_collect(batch_tokens(_source(list("abcdefg"), 0), flush_ms=10_000, flush_bytes=3)))
+    assert chunks == ["a", "bcd", "efg"]
+
+
+def test_time_window_flushes_when_upstream_stalls():
+    async def stalled():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        seen = []
+        async for chunk in batch_tokens(stalled(), flush_ms=20, flush_bytes=1024):
+            seen.append((chunk, loop.time() - t0))
+        return seen
+
+    seen = asyncio.run(main())
+    assert [c for c, _ in seen] == ["a", "b", "c"]
+    # "b" 在时间窗口到期时就被刷出，而不是等到上游恢复
+    assert seen[1][1] < 0.15
+
+
+def test_zero_window_passes_through():
+    chunks = asyncio.run(_collect(batch_tokens(_source(list("abc"), 0), flush_ms=0, flush_bytes=1)))
+    assert chunks == ["a", "b", "c"]
+
+
+def test_stream_request_level_flush_ms():
+    client = TestClient(app)
+    payload = {"provider": "mock", "messages": [{"role": "user", "content": "hi"}], "stream_flush_ms": 50}
+    with client.stream("POST", "/chat/stream", json=payload) as r:
+        text = "".join(r.iter_text())
+    # mock 逐字符输出约 30 个字符，合批后 token 事件明显减少
+    assert 1 < text.count("event: token") < 20
+    assert "event: token\ndata: [\n\n" in text
+    assert "event: done" in text
@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.api import routes_chat
+from src.app.llm.engines import ClientPool, LLMEngine, MockEngine, OllamaEngine, get_registry
+from src.app.llm.schemas import ChatMessage
+
+"""异步非流式接口测试
+    - /chat 是 async 接口，等待引擎 agenerate，不占用线程池
+    - MockEngine / OllamaEngine 都实现了 agenerate，同步 generate 仍然可用
+    - 只实现了同步 generate 的引擎，默认的 agenerate 在线程池里调用它
+"""
+
+
+def _fake_ollama(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"response": "pong", "done": True})
+
+
+def _ollama_engine() -> OllamaEngine:
+    return OllamaEngine(base_url="http://ollama.test",
+                        pool=ClientPool(5, transport=httpx.MockTransport(_fake_ollama)))
+
+
+def test_chat_route_is_async():
+    assert asyncio.iscoroutinefunction(routes_chat.chat)
+
+
+def test_engines_agenerate_and_sync_wrapper():
+    messages = [ChatMessage(role="user", content="hi")]
+    mock = MockEngine()
+    assert asyncio.run(mock.agenerate(messages, 0.7, 0.9, 16)) == mock.generate(messages, 0.7, 0.9, 16)
+
+    engine = _ollama_engine()
+    assert asyncio.run(engine.agenerate(messages, 0.7, 0.9, 16)) == "pong"
+    assert engine.generate(messages, 0.7, 0.9, 16) == "pong"
+    engine.close()
+
+
+class SyncOnlyEngine(LLMEngine):
+    name = "sync"
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        return f"sync {messages[-1].content}"
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        yield self.generate(messages, temperature, top_p, max_tokens, state)
+
+
+def test_default_agenerate_runs_generate_in_thread():
+    messages = [ChatMessage(role="user", content="hi")]
+    assert asyncio.run(SyncOnlyEngine().agenerate(messages, 0.7, 0.9, 16)) == "sync hi"
+
+
+def test_chat_ollama_uses_agenerate():
+    get_registry().register("ollama", _ollama_engine())
+    client = TestClient(app)
+    r = client.post("/chat", json={"provider": "ollama", "messages": [{"role": "user", "content": "ping"}]})
+    assert r.status_code == 200
+    assert r.json()["answer"] == "pong"
+
+
+def test_chat_ollama_unreachable_returns_502(monkeypatch):
+    monkeypatch.setenv("OLLAMA_BASE_URL", "http://127.0.0.1:1")
+    client = TestClient(app)
+    r = client.post("/chat", json={"provider": "ollama", "messages": [{"role": "user", "content": "hi"}]})
+    assert r.status_code == 502
+    assert "trace_id" in r.json()["detail"]
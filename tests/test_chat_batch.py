@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.engines import LLMEngine, get_registry
+from src.app.llm.scheduler import AdmissionController, set_admission
+
+"""批量接口测试
+    - 结果按完成顺序以 NDJSON 返回，每条带 index，最后一行是汇总
+    - 单条失败不影响其他条目
+    - 同时执行的条数不超过 parallelism
+    - 整个批次按同一个租户（API key / IP）参与准入调度，不按各条的 session_id 拆分
+"""
+
+client = TestClient(app)
+
+
+class RecordingEngine(LLMEngine):
+    name = "ollama"
+    model = "rec"
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        raise NotImplementedError
+
+    async def agenerate(self, messages, temperature, top_p, max_tokens, state=None):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            prompt = messages[-1].content
+            # 越靠前的条目越慢，完成顺序与提交顺序相反
+            await asyncio.sleep(0.01 * int(prompt.split()[-1]))
+            if prompt.startswith("fail"):
+                raise RuntimeError("boom")
+            return prompt.upper()
+        finally:
+            self.active -= 1
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        yield await self.agenerate(messages, temperature, top_p, max_tokens, state)
+
+
+def _lines(r):
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+def test_batch_streams_results_in_completion_order():
+    engine = RecordingEngine()
+    get_registry().register("ollama", engine)
+    prompts = ["ok 6", "fail 4", "ok 2", "ok 0"]
+    items = [{"provider": "ollama", "messages": [{"role": "user", "content": p}]} for p in prompts]
+
+    r = client.post("/chat/batch", json={"items": items, "parallelism": 4})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = _lines(r)
+    results, summary = lines[:-1], lines[-1]
+
+    assert [x["index"] for x in results] == [3, 2, 1, 0]
+    assert results[0]["answer"] == "OK 0"
+    failed = next(x for x in results if x["index"] == 1)
+    assert failed["status"] == 502 and "boom" in failed["error"]
+    assert summary["done"] and summary["total"] == 4 and summary["failed"] == 1
+
+
+def test_batch_respects_parallelism():
+    engine = RecordingEngine()
+    get_registry().register("ollama", engine)
+    items = [{"provider": "ollama", "messages": [{"role": "user", "content": f"ok {i % 3}"}]} for i in range(9)]
+
+    r = client.post("/chat/batch", json={"items": items, "parallelism": 2})
+    results = _lines(r)[:-1]
+    assert sorted(x["index"] for x in results) == list(range(9))
+    assert engine.peak == 2
+
+
+def test_batch_validates_items():
+    assert client.post("/chat/batch", json={"items": []}).status_code == 422
+
+
+class TenantRecorder(AdmissionController):
+    def __init__(self):
+        super().__init__()
+        self.tenants = []
+
+    async def acquire(self, provider, model, tenant, cost):
+        self.tenants.append(tenant)
+        return await super().acquire(provider, model, tenant, cost)
+
+
+def test_batch_is_one_tenant():
+    ctl = TenantRecorder()
+    old = set_admission(ctl)
+    try:
+        items = [{"session_id": f"s{i}", "messages": [{"content": "hi"}]} for i in range(3)]
+        client.post("/chat/batch", json={"items": items})
+        client.post("/chat/batch", json={"items": items}, headers={"x-api-key": "k"})
+    finally:
+        set_admission(old)
+    assert ctl.tenants == ["ip:testclient"] * 3 + ["key:k"] * 3
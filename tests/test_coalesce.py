@@ -0,0 +1,159 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.coalesce import StreamCoalescer, SubscriberOverflow, set_coalescer
+from src.app.llm.engines import LLMEngine, get_registry
+
+"""单飞合并测试
+    - 并发的相同请求只触发一次上游生成，后加入者也能拿到加入前已产生的 token
+    - 慢订阅者缓冲区溢出只断开它自己
+    - 最后一个订阅者离开时取消上游生成
+    - 只合并确定性请求（temperature=0），跟随者的 usage 带 leader 的后端统计
+"""
+
+
+class _Upstream:
+    def __init__(self, tokens, delay=0.0):
+        self.tokens = tokens
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def stream(self):
+        self.calls += 1
+        try:
+            for t in self.tokens:
+                await asyncio.sleep(self.delay)
+                yield t
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+async def _collect(sub):
+    return [t async for t in sub]
+
+
+def test_identical_requests_share_one_upstream():
+    async def main():
+        co = StreamCoalescer()
+        up = _Upstream(list("abcdef"), delay=0.005)
+        first = co.subscribe("k", up.stream)
+        task = asyncio.create_task(_collect(first))
+        await asyncio.sleep(0.02)  # 让 leader 先产生一部分 token
+        second = co.subscribe("k", up.stream)
+        assert first.leader and not second.leader
+        results = await asyncio.gather(task, _collect(second))
+        return up, co, results
+
+    up, co, (a, b) = asyncio.run(main())
+    assert up.calls == 1
+    assert a == b == list("abcdef")
+    assert co.in_flight() == 0
+
+
+def test_slow_subscriber_overflow_does_not_stall_others():
+    async def main():
+        co = StreamCoalescer(buffer_size=2)
+        up = _Upstream(list("abcdefgh"), delay=0.001)
+        fast = co.subscribe("k", up.stream)
+        slow = co.subscribe("k", up.stream)
+        fast_tokens = await _collect(fast)
+        try:
+            await _collect(slow)
+        except SubscriberOverflow:
+            return fast_tokens, True
+        return fast_tokens, False
+
+    fast_tokens, overflowed = asyncio.run(main())
+    assert fast_tokens == list("abcdefgh")
+    assert overflowed
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    async def main():
+        co = StreamCoalescer()
+        up = _Upstream(list("abcdefgh"), delay=0.01)
+        a = co.subscribe("k", up.stream)
+        b = co.subscribe("k", up.stream)
+        it = a.__aiter__()
+        await it.__anext__()
+        a.close()
+        await asyncio.sleep(0.02)
+        assert not up.cancelled  # 还有订阅者 b
+        b.close()
+        await asyncio.sleep(0.02)
+        return up, co
+
+    up, co = asyncio.run(main())
+    assert up.cancelled
+    assert co.in_flight() == 0
+
+
+def test_stream_usage_reports_coalesced_flag():
+    client = TestClient(app)
+    payload = {"provider": "mock", "messages": [{"role": "user", "content": "hi"}]}
+    with client.stream("POST", "/chat/stream", json=payload) as r:
+        text = "".join(r.iter_text())
+    assert '"coalesced": false' in text
+    assert "event: done" in text
+
+
+class _StatsEngine(LLMEngine):
+    name = "ollama"
+    model = "stats"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "ab"
+
+    async def agenerate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "ab"
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        self.calls += 1
+        for t in "ab":
+            await asyncio.sleep(0.02)
+            yield t
+        if state is not None:
+            state.stats.update(eval_count=2, eval_duration=40_000_000)
+
+
+def _usage(text):
+    for block in text.split("\n\n"):
+        if "event: usage" in block:
+            return json.loads(block.split("data: ", 1)[1])
+
+
+def _concurrent_streams(temperature, content):
+    engine = _StatsEngine()
+    get_registry().register("ollama", engine)
+    payload = {"provider": "ollama", "temperature": temperature, "stream_flush_ms": 0,
+               "messages": [{"role": "user", "content": content}]}
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/chat/stream", json=payload) for _ in range(2)))
+
+    old = set_coalescer(StreamCoalescer())
+    try:
+        responses = asyncio.run(main())
+    finally:
+        set_coalescer(old)
+    return engine, [_usage(r.text) for r in responses]
+
+
+def test_only_deterministic_requests_coalesce_and_followers_get_stats():
+    engine, usages = _concurrent_streams(0, "coalesce-det")
+    assert engine.calls == 1
+    assert sorted(u["coalesced"] for u in usages) == [False, True]
+    assert all(u["tokens"] == 2 and u["tokens_per_s"] == 50.0 for u in usages)
+
+    engine, usages = _concurrent_streams(0.7, "coalesce-sampled")
+    assert engine.calls == 2 and not any(u["coalesced"] for u in usages)
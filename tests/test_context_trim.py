@@ -0,0 +1,66 @@
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.context import ContextBudget, TokenCounter, get_context_budget, set_context_budget, trim_messages
+from src.app.llm.schemas import ChatMessage
+
+"""上下文裁剪测试
+    - 保留 system 消息和最新的轮次，超出预算的旧消息被丢弃
+    - token 计数按内容哈希记忆化
+    - usage 事件返回丢弃的消息数 / token 数
+"""
+
+
+def _msgs(*pairs):
+    return [ChatMessage(role=r, content=c) for r, c in pairs]
+
+
+def test_trim_keeps_system_and_newest_turns():
+    counter = TokenCounter()
+    messages = _msgs(("system", "be nice"), ("user", "a" * 400), ("assistant", "b" * 400), ("user", "latest"))
+    trim = trim_messages(messages, budget=50, counter=counter)
+    assert [m.role for m in trim.messages] == ["system", "user"]
+    assert trim.messages[-1].content == "latest"
+    assert trim.dropped_messages == 2
+    assert trim.dropped_tokens == 2 * (100 + 4)
+    assert trim.prompt_tokens <= 50
+
+
+def test_trim_noop_within_budget():
+    trim = trim_messages(_msgs(("user", "hi")), budget=100, counter=TokenCounter())
+    assert trim.dropped_messages == 0
+    assert len(trim.messages) == 1
+
+
+def test_token_counts_are_memoized():
+    counter = TokenCounter()
+    text = "你好，世界 hello world"
+    first = counter.count(text)
+    assert counter.count(text) == first
+    assert counter.hits == 1 and counter.misses == 1
+    # CJK 字符按 1 字符 1 token 估算
+    assert counter.count("你好") == 2
+
+
+def test_budget_per_model():
+    budget = ContextBudget(default_length=4096, lengths={"small": 1024})
+    assert budget.budget("small", 256) == 768
+    assert budget.budget("other", 256) == 3840
+
+
+def test_stream_usage_reports_dropped_messages():
+    old = get_context_budget()
+    set_context_budget(ContextBudget(default_length=300))
+    try:
+        client = TestClient(app)
+        payload = {
+            "provider": "mock",
+            "max_tokens": 200,
+            "messages": [{"role": "user", "content": "x" * 800}, {"role": "user", "content": "hi"}],
+        }
+        with client.stream("POST", "/chat/stream", json=payload) as r:
+            text = "".join(r.iter_text())
+        assert '"dropped_messages": 1' in text
+        assert '"dropped_tokens": 204' in text
+    finally:
+        set_context_budget(old)
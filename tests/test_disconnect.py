@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import pytest
+
+from src.app.main import app
+from src.app.api import routes_chat
+from src.app.core.metrics import REGISTRY
+from src.app.core.resumable import set_replay_store
+from src.app.llm.engines import LLMEngine, get_registry
+
+"""客户端断开测试
+    - SSE 客户端在中途断开后，上游生成被关闭（不再继续产出 token）
+    - 记录 cancelled 结果和已产出的 token 数
+    （开启续传时断开后还有宽限期，见 test_resume.py；这里关闭续传，断开即取消）
+"""
+
+
+class SlowEngine(LLMEngine):
+    name = "ollama"
+    model = "slow"
+
+    def __init__(self):
+        self.produced = 0
+        self.closed = False
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "x"
+
+    async def agenerate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "x"
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        try:
+            for _ in range(200):
+                await asyncio.sleep(0.01)
+                self.produced += 1
+                yield "tok "
+        finally:
+            self.closed = True
+
+
+async def _call_and_disconnect(after_tokens: int, spec_version: str):
+    body = json.dumps({"provider": "ollama", "messages": [{"role": "user", "content": "hi"}]}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": spec_version}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+        "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+    gone = asyncio.Event()
+    sent = {"tokens": 0}
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and b"event: token" in message.get("body", b""):
+            sent["tokens"] += 1
+            if sent["tokens"] >= after_tokens:
+                gone.set()
+
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    return sent["tokens"]
+
+
+# 2.4 之前的 ASGI 版本由 Starlette 监听断开并取消响应任务；2.4 起由接口自己检测
+@pytest.mark.parametrize("spec_version", ["2.3", "2.4"])
+def test_disconnect_cancels_upstream(monkeypatch, spec_version):
+    monkeypatch.setattr(routes_chat, "DISCONNECT_CHECK_S", 0)
+    old = set_replay_store(None)
+    engine = SlowEngine()
+    get_registry().register("ollama", engine)
+
+    def cancelled():
+        snap = REGISTRY.snapshot()["metrics"]["chat_requests_total"]["values"]
+        return sum(v for labels, v in snap if labels[0] == "chat_stream" and labels[3] == "cancelled")
+
+    before = cancelled()
+    try:
+        delivered = asyncio.run(_call_and_disconnect(3, spec_version))
+    finally:
+        set_replay_store(old)
+    assert engine.closed
+    # 断开后最多再多读一个 token，远少于完整的 200 个
+    assert engine.produced < 10 and delivered < 10
+    assert cancelled() == before + 1
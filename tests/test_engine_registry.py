@@ -0,0 +1,51 @@
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.engines import ClientPool, OllamaEngine, PoolConfig, get_engine, get_registry
+
+"""引擎注册表 / 连接池测试
+    - get_engine() 多次调用返回同一个引擎实例（不再每次新建）
+    - OllamaEngine 在多次请求之间复用同一个 httpx 客户端
+    - lifespan 退出时关闭连接池
+"""
+
+
+def _fake_ollama(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={"response": "pong", "done": True})
+
+
+def test_get_engine_reuses_instance():
+    assert get_engine("ollama") is get_engine("ollama")
+    assert get_engine("mock") is get_engine("MOCK")
+    # 未知 provider 回退到 mock
+    assert get_engine("unknown").name == "mock"
+
+
+def test_pool_config_from_env(monkeypatch):
+    monkeypatch.setenv("OLLAMA_POOL_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("OLLAMA_POOL_KEEPALIVE_EXPIRY_S", "2.5")
+    cfg = PoolConfig.from_env("OLLAMA")
+    assert cfg.max_connections == 7
+    assert cfg.keepalive_expiry_s == 2.5
+
+
+def test_ollama_engine_reuses_client_across_requests():
+    engine = OllamaEngine(base_url="http://ollama.test",
+                          pool=ClientPool(5, transport=httpx.MockTransport(_fake_ollama)))
+    get_registry().register("ollama", engine)
+
+    client = TestClient(app)
+    payload = {"provider": "ollama", "messages": [{"role": "user", "content": "ping"}]}
+    assert client.post("/chat", json=payload).json()["answer"] == "pong"
+    first = engine.pool.sync_client()
+    assert client.post("/chat", json=payload).json()["answer"] == "pong"
+    assert engine.pool.sync_client() is first
+
+
+def test_lifespan_closes_pools():
+    with TestClient(app) as client:
+        client.get("/health")
+        engine = get_engine("ollama")
+        sync_client = engine.pool.sync_client()
+    assert sync_client.is_closed
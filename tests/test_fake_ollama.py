@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+from benchmarks.fake_ollama import FakeConfig, create_app
+from benchmarks.load import percentiles
+from src.app.llm.engines import ClientPool, GenerationState, OllamaEngine
+from src.app.llm.schemas import ChatMessage
+
+"""压测工具测试
+    - 假 Ollama 的流式 / 非流式 /api/generate 能被 OllamaEngine 正常消费，生成 num_predict 个 token 并带统计
+    - 注入的流中错误会被引擎当作后端失败
+    - 分位数计算
+"""
+
+
+def _engine(cfg: FakeConfig) -> OllamaEngine:
+    transport = httpx.ASGITransport(app=create_app(cfg))
+    return OllamaEngine(base_url="http://fake", model="m", pool=ClientPool(5, transport=transport))
+
+
+def test_fake_ollama_stream_and_generate():
+    engine = _engine(FakeConfig(prompt_delay_ms=0, tps=0, chunk_tokens=3, token="a"))
+    messages = [ChatMessage(role="user", content="hi")]
+
+    async def main():
+        state = GenerationState()
+        chunks = [t async for t in engine.stream(messages, 0, 1, 7, state=state)]
+        answer = await engine.agenerate(messages, 0, 1, 5)
+        return chunks, state, answer
+
+    chunks, state, answer = asyncio.run(main())
+    assert chunks == ["aaa", "aaa", "a"]
+    assert state.stats["eval_count"] == 7
+    assert answer == "aaaaa"
+
+
+def test_fake_ollama_injected_stream_error():
+    engine = _engine(FakeConfig(prompt_delay_ms=0, tps=0, stream_error_rate=1.0))
+
+    async def main():
+        try:
+            async for _ in engine.stream([ChatMessage(content="hi")], 0, 1, 4):
+                pass
+        except Exception as e:
+            return e
+
+    assert "injected" in str(asyncio.run(main()))
+
+
+def test_percentiles():
+    assert percentiles([]) == {"p50": None, "p95": None, "p99": None}
+    p = percentiles([float(i) for i in range(1, 101)])
+    assert p["p50"] == 51 and p["p95"] == 96 and p["p99"] == 100
@@ -0,0 +1,59 @@
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.core.logging import LogSink, set_log_sink
+
+"""日志中间件测试
+    - x-trace-id：沿用客户端传入的，没有时生成，写回响应头
+    - 访问日志是 JSON，包含响应头耗时和响应体发完的耗时
+    - 采样 / 限流：普通请求按比例丢弃，错误总是记录
+"""
+
+client = TestClient(app)
+
+
+def _records(stream: io.StringIO):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_trace_id_and_json_access_log():
+    out = io.StringIO()
+    sink = LogSink(stream=out)
+    old = set_log_sink(sink)
+    try:
+        r = client.get("/health", headers={"x-trace-id": "abc"})
+        assert r.headers["x-trace-id"] == "abc"
+        r = client.post("/chat/stream", json={"provider": "mock", "messages": [{"role": "user", "content": "hi"}]})
+        trace_id = r.headers["x-trace-id"]
+        assert trace_id and f'"trace_id": "{trace_id}"' in r.text
+        sink.flush()
+    finally:
+        set_log_sink(old)
+        sink.close()
+
+    records = _records(out)
+    health = next(x for x in records if x["event"] == "request" and x["path"] == "/health")
+    assert health["trace_id"] == "abc" and health["status"] == 200
+    stream = next(x for x in records if x["event"] == "request" and x["path"] == "/chat/stream")
+    # 流式响应：响应体发完的时间不早于响应头发出的时间
+    assert stream["total_ms"] >= stream["header_ms"]
+    assert any(x["event"] == "stream" and x["trace_id"] == trace_id for x in records)
+
+
+def test_sampling_and_rate_limit():
+    out = io.StringIO()
+    sampled = LogSink(stream=out, sample_rate=0.0)
+    assert not sampled.emit({"event": "request"})
+    assert sampled.emit({"event": "request", "status": 500}, force=True)
+    sampled.flush()
+    sampled.close()
+    assert len(_records(out)) == 1 and sampled.stats()["sampled_out"] == 1
+
+    limited = LogSink(stream=io.StringIO(), rate_limit=2)
+    results = [limited.emit({"n": i}) for i in range(5)]
+    limited.flush()
+    limited.close()
+    assert results.count(True) == 2 and limited.stats()["rate_limited"] == 3
@@ -0,0 +1,74 @@
+import json
+import os
+
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.core.metrics import MetricsRegistry
+
+"""指标测试
+    - /metrics 返回 Prometheus 文本格式，请求计数 / 首 token 延迟直方图随请求增长
+    - 直方图的桶是累计值，_count 等于 +Inf 桶
+    - 多进程模式下合并各 worker 的快照：counter 求和，已退出进程的 gauge 不计入
+"""
+
+client = TestClient(app)
+
+
+def _value(text: str, prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_endpoint_counts_requests():
+    before = client.get("/metrics").text
+    ok = 'chat_requests_total{endpoint="chat_stream",provider="mock",model="",outcome="ok"}'
+    ttft = 'chat_time_to_first_token_seconds_count{provider="mock",model=""}'
+
+    r = client.post("/chat/stream", json={"provider": "mock", "messages": [{"role": "user", "content": "hi"}]})
+    assert r.status_code == 200
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    assert "# TYPE chat_requests_total counter" in text
+    assert "# TYPE chat_time_to_first_token_seconds histogram" in text
+    assert _value(text, ok) == _value(before, ok) + 1
+    assert _value(text, ttft) == _value(before, ttft) + 1
+    assert 'chat_streams_in_flight{provider="mock"} 0' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    reg = MetricsRegistry()
+    h = reg.histogram("lat_seconds", "latency", ("op",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.observe(v, op="x")
+    text = reg.render()
+    assert 'lat_seconds_bucket{op="x",le="0.1"} 1' in text
+    assert 'lat_seconds_bucket{op="x",le="1"} 3' in text
+    assert 'lat_seconds_bucket{op="x",le="+Inf"} 4' in text
+    assert 'lat_seconds_count{op="x"} 4' in text
+    assert 'lat_seconds_sum{op="x"} 4.05' in text
+
+
+def test_multiprocess_merge(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    reg = MetricsRegistry()
+    reg.counter("jobs_total", "jobs", ("kind",)).inc(2, kind="a")
+    reg.gauge("open_streams", "streams").inc(1)
+
+    # 另一个已经退出的 worker 留下的快照
+    other = reg.snapshot()
+    other["pid"] = 2 ** 22 + 12345
+    other["metrics"]["jobs_total"]["values"] = [[["a"], 3.0]]
+    other["metrics"]["open_streams"]["values"] = [[[], 5.0]]
+    with open(os.path.join(tmp_path, "metrics_other.json"), "w", encoding="utf-8") as f:
+        json.dump(other, f)
+
+    text = reg.render()
+    assert 'jobs_total{kind="a"} 5' in text
+    assert "open_streams 1" in text
+    assert os.path.exists(os.path.join(tmp_path, f"metrics_{os.getpid()}.json"))
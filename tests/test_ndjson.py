@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.engines import ClientPool, GenerationState, OllamaEngine, get_registry
+from src.app.llm.ndjson import NDJSONDecoder, final_stats
+from src.app.llm.schemas import ChatMessage
+
+"""增量 NDJSON 解码测试
+    - 跨字节块的半行能正确拼接，坏行跳过
+    - Ollama 最终帧的统计字段被保留并出现在 usage 事件里
+"""
+
+FINAL = {"response": "", "done": True, "total_duration": 900, "prompt_eval_count": 5,
+         "prompt_eval_duration": 100, "eval_count": 2, "eval_duration": 400, "context": [1, 2]}
+BODY = (json.dumps({"response": "he", "done": False}) + "\n"
+        + "not json\n"
+        + json.dumps({"response": "llo", "done": False}) + "\n"
+        + json.dumps(FINAL) + "\n").encode()
+
+
+def test_decoder_handles_lines_split_across_chunks():
+    decoder = NDJSONDecoder()
+    objs = []
+    for i in range(0, len(BODY), 7):
+        objs.extend(decoder.feed(BODY[i:i + 7]))
+    objs.extend(decoder.flush())
+    assert [o["response"] for o in objs] == ["he", "llo", ""]
+    assert objs[-1]["done"] is True
+
+
+def test_decoder_flushes_unterminated_last_line():
+    decoder = NDJSONDecoder()
+    assert decoder.feed(b'{"response": "a"}') == []
+    assert decoder.flush() == [{"response": "a"}]
+
+
+def test_final_stats_keeps_only_stat_fields():
+    stats = final_stats(FINAL)
+    assert stats == {"total_duration": 900, "prompt_eval_count": 5, "prompt_eval_duration": 100,
+                     "eval_count": 2, "eval_duration": 400}
+
+
+class _ChunkedStream(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        for i in range(0, len(BODY), 5):
+            yield BODY[i:i + 5]
+
+
+def _engine() -> OllamaEngine:
+    transport = httpx.MockTransport(lambda request: httpx.Response(200, stream=_ChunkedStream()))
+    return OllamaEngine(base_url="http://ollama.test", pool=ClientPool(5, transport=transport))
+
+
+def test_ollama_stream_parses_chunked_bytes_and_records_stats():
+    async def main():
+        state = GenerationState()
+        tokens = [t async for t in _engine().stream([ChatMessage(content="hi")], 0, 1, 8, state=state)]
+        return tokens, state
+
+    tokens, state = asyncio.run(main())
+    assert tokens == ["he", "llo"]
+    assert state.stats["eval_count"] == 2
+    assert state.new_context == [1, 2]
+
+
+def test_stream_usage_contains_backend_stats():
+    get_registry().register("ollama", _engine())
+    client = TestClient(app)
+    payload = {"provider": "ollama", "messages": [{"role": "user", "content": "hi"}]}
+    with client.stream("POST", "/chat/stream", json=payload) as r:
+        text = "".join(r.iter_text())
+    assert '"backend_stats": {' in text
+    assert '"eval_count": 2' in text
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from benchmarks.fake_ollama import FakeConfig, create_app
+from src.app.main import app
+from src.app.llm.engines import ClientPool, EngineRegistry, OllamaEngine, get_registry
+from src.app.llm.warmup import WarmupState, run_warmup, set_warmup_state
+
+"""预热 / 就绪测试
+    - 未开启预热时 /ready 直接就绪
+    - 预热完成前 /ready 返回 503，完成后返回 200，报告后端模型加载状态和各阶段耗时
+    - 预热依次请求 /api/tags、/api/ps、预加载（空 prompt + keep_alive）、1 个 token 的生成
+"""
+
+client = TestClient(app)
+
+
+def test_ready_without_warmup():
+    set_warmup_state(None)
+    r = client.get("/ready")
+    assert r.status_code == 200 and r.json()["warmup"]["status"] == "disabled"
+
+
+def test_warmup_preloads_model_and_gates_ready(monkeypatch):
+    monkeypatch.setenv("OLLAMA_KEEP_ALIVE", "30m")
+    fake = create_app(FakeConfig(prompt_delay_ms=0, tps=0, model="m"))
+    seen = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        body = request.content.decode() if request.method == "POST" else ""
+        seen.append((request.url.path, body))
+        return await httpx.ASGITransport(app=fake).handle_async_request(request)
+
+    engine = OllamaEngine(base_url="http://warm", model="m", pool=ClientPool(5, transport=httpx.MockTransport(handler)))
+    registry = EngineRegistry()
+    registry.register("ollama", engine)
+    get_registry().register("ollama", engine)
+
+    state = WarmupState(enabled=True)
+    set_warmup_state(state)
+    try:
+        assert client.get("/ready").status_code == 503
+        asyncio.run(run_warmup(registry, state))
+        r = client.get("/ready")
+    finally:
+        set_warmup_state(None)
+
+    assert r.status_code == 200
+    body = r.json()
+    result = body["warmup"]["results"]["ollama"][0]
+    assert result["ok"] and {"connect_ms", "load_ms", "generate_ms"} <= set(result)
+    assert body["backends"]["ollama"][0]["models_loaded"] == ["m"]
+    paths = [p for p, _ in seen]
+    assert paths[:4] == ["/api/tags", "/api/ps", "/api/generate", "/api/generate"]
+    preload, probe = json.loads(seen[2][1]), json.loads(seen[3][1])
+    assert preload["prompt"] == "" and preload["keep_alive"] == "30m"
+    assert probe["options"]["num_predict"] == 1
+
+
+def test_warmup_retries_until_a_backend_is_up():
+    calls = {"n": 0}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls["n"] += 1
+        if calls["n"] <= 1:
+            raise httpx.ConnectError("down")
+        if request.url.path in ("/api/tags", "/api/ps"):
+            return httpx.Response(200, json={"models": [{"name": "m"}]})
+        return httpx.Response(200, json={"response": "", "done": True})
+
+    engine = OllamaEngine(base_url="http://warm", model="m", pool=ClientPool(5, transport=httpx.MockTransport(handler)))
+    registry = EngineRegistry()
+    registry.register("ollama", engine)
+    state = WarmupState(enabled=True)
+    asyncio.run(run_warmup(registry, state, retry_s=0))
+    assert state.ready and state.attempts == 2
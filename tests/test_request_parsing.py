@@ -0,0 +1,112 @@
+import json
+import warnings
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.core.fastjson import FastJSONResponse
+from src.app.llm.parsing import InvalidRequest, RequestLimits, RequestParser, set_request_parser
+from src.app.llm.schemas import ChatMessage, ChatRequest
+
+"""请求体解析测试
+    - 快速路径与 pydantic 路径解析结果一致（包括序列化，不产生 pydantic 警告），校验错误格式与 FastAPI 默认的 422 一致
+    - 消息条数 / 总字符数超限返回 422，请求体超过字节上限返回 413（Content-Length 和分块上传都能拦住）
+    - /chat/batch 的每一条都按单个请求的限制检查
+"""
+
+client = TestClient(app)
+
+BODY = {
+    "session_id": None,
+    "messages": [{"role": "system", "content": "be brief"}, {"content": "你好"}, {"role": "assistant", "content": "hi"}],
+    "temperature": 0.2,
+    "max_tokens": 16,
+    "stream_flush_ms": 0,
+}
+
+
+@pytest.fixture
+def limits():
+    lim = RequestLimits(max_body_bytes=2048, max_batch_body_bytes=4096, max_messages=4, max_chars=100)
+    old = set_request_parser(RequestParser(lim))
+    yield lim
+    set_request_parser(old)
+
+
+def test_fast_path_matches_pydantic():
+    raw = json.dumps(BODY).encode()
+    fast = RequestParser(fast=True).parse_chat(raw)
+    slow = RequestParser(fast=False).parse_chat(raw)
+    assert isinstance(fast.messages[0], ChatMessage)
+    assert fast.messages == slow.messages
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert fast.model_dump() == slow.model_dump()
+        assert fast.model_dump_json() == slow.model_dump_json()
+    assert [m.role for m in fast.messages] == ["system", "user", "assistant"]
+
+
+def test_validation_errors_match_pydantic():
+    raw = json.dumps({"messages": [{"role": "bot", "content": 1}, "x"], "temperature": "hot"}).encode()
+    with pytest.raises(InvalidRequest) as fast:
+        RequestParser(fast=True).parse_chat(raw)
+    with pytest.raises(InvalidRequest) as slow:
+        RequestParser(fast=False).parse_chat(raw)
+    key = lambda errs: sorted((e["type"], e["loc"]) for e in errs)
+    assert key(fast.value.errors) == key(slow.value.errors)
+
+
+def test_chat_uses_fast_json_response(limits):
+    r = client.post("/chat", json=BODY)
+    assert r.status_code == 200 and r.headers["content-type"] == "application/json"
+    assert r.json() == {"trace_id": r.headers["x-trace-id"], "session_id": None, "answer": "[mock] you said: 你好"}
+    assert FastJSONResponse({"a": "你好"}).body == '{"a":"你好"}'.encode()
+
+
+def test_invalid_body_returns_422(limits):
+    r = client.post("/chat", json={"messages": [{"role": "bot", "content": "x"}]})
+    assert r.status_code == 422
+    assert r.json()["detail"][0]["loc"] == ["body", "messages", 0, "role"]
+    assert client.post("/chat", content=b"{oops", headers={"content-type": "application/json"}).status_code == 422
+    assert client.post("/chat/stream", json={"max_tokens": 1}).status_code == 422
+
+
+def test_message_limits_return_422(limits):
+    r = client.post("/chat", json={"messages": [{"content": "x"}] * 5})
+    assert r.status_code == 422 and r.json()["detail"][0]["ctx"]["max_length"] == 4
+    r = client.post("/chat/stream", json={"messages": [{"content": "x" * 60}, {"content": "y" * 60}]})
+    assert r.status_code == 422 and r.json()["detail"][0]["ctx"]["actual_chars"] == 120
+
+
+def test_body_limit_returns_413(limits):
+    big = {"messages": [{"content": "x" * 3000}]}
+    r = client.post("/chat", json=big)
+    assert r.status_code == 413 and "2048" in r.json()["detail"]["error"]
+
+    # 没有 Content-Length（分块上传）时边读边数
+    def chunks():
+        yield b'{"messages": [{"content": "'
+        for _ in range(10):
+            yield b"x" * 500
+        yield b'"}]}'
+
+    r = client.post("/chat", content=chunks(), headers={"content-type": "application/json"})
+    assert r.status_code == 413
+
+
+def test_batch_items_checked_against_limits(limits):
+    ok = {"messages": [{"content": "hi"}]}
+    r = client.post("/chat/batch", json={"items": [ok, {"messages": [{"content": "x"}] * 5}]})
+    assert r.status_code == 422 and r.json()["detail"][0]["loc"] == ["body", "items", 1, "messages"]
+    assert client.post("/chat/batch", json={"items": [ok], "parallelism": 0}).status_code == 422
+    r = client.post("/chat/batch", json={"items": [ok, ok], "parallelism": 2})
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert r.status_code == 200 and lines[-1]["total"] == 2 and lines[-1]["failed"] == 0
+
+
+def test_pydantic_path_still_enforces_limits():
+    parser = RequestParser(RequestLimits(max_messages=1), fast=False)
+    with pytest.raises(InvalidRequest):
+        parser.parse_chat(json.dumps({"messages": [{"content": "a"}, {"content": "b"}]}).encode())
+    assert isinstance(parser.parse_chat(b'{"messages": [{"content": "a"}]}'), ChatRequest)
@@ -0,0 +1,105 @@
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.cache import ResponseCache, get_cache, request_key, set_cache
+from src.app.llm.engines import ClientPool, OllamaEngine, get_registry
+from src.app.llm.schemas import ChatRequest
+
+"""响应缓存测试
+    - temperature=0 的请求第二次命中缓存，不再请求后端
+    - /chat/stream 命中时按 token/usage/done 回放，usage 中带 cache=hit
+    - LRU 字节上限淘汰、TTL 过期与计数
+"""
+
+
+class _Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if b'"stream":true' in request.content.replace(b" ", b""):
+            body = b'{"response":"po","done":false}\n{"response":"ng","done":true}\n'
+            return httpx.Response(200, content=body)
+        return httpx.Response(200, json={"response": "pong", "done": True})
+
+
+def _setup(cache: ResponseCache) -> _Counter:
+    counter = _Counter()
+    engine = OllamaEngine(base_url="http://ollama.test", pool=ClientPool(5, transport=httpx.MockTransport(counter)))
+    get_registry().register("ollama", engine)
+    old = get_cache()
+    set_cache(cache)
+    return counter, old
+
+
+def _read_stream(client: TestClient, payload: dict) -> str:
+    with client.stream("POST", "/chat/stream", json=payload) as r:
+        return "".join(r.iter_text())
+
+
+def test_chat_cache_hit_skips_backend():
+    cache = ResponseCache()
+    counter, old = _setup(cache)
+    try:
+        client = TestClient(app)
+        payload = {"provider": "ollama", "temperature": 0, "messages": [{"role": "user", "content": "faq"}]}
+        assert client.post("/chat", json=payload).json()["answer"] == "pong"
+        assert client.post("/chat", json=payload).json()["answer"] == "pong"
+        assert counter.calls == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+        # 非确定性请求不走缓存
+        payload["temperature"] = 0.7
+        client.post("/chat", json=payload)
+        assert counter.calls == 2
+    finally:
+        set_cache(old)
+
+
+def test_stream_cache_replays_tokens():
+    cache = ResponseCache()
+    counter, old = _setup(cache)
+    try:
+        client = TestClient(app)
+        payload = {"provider": "ollama", "temperature": 0, "messages": [{"role": "user", "content": "faq"}]}
+        first = _read_stream(client, payload)
+        second = _read_stream(client, payload)
+        assert counter.calls == 1
+        assert '"cache": "miss"' in first
+        assert '"cache": "hit"' in second
+        assert "id: 2\nevent: token\ndata: po\n\nid: 3\nevent: token\ndata: ng\n\n" in second
+        assert "event: done" in second
+    finally:
+        set_cache(old)
+
+
+def test_cache_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=1500)
+    cache.put("a", ["x" * 300])
+    cache.put("b", ["y" * 300])
+    assert cache.get("a") is not None  # a 变为最近使用
+    cache.put("c", ["z" * 300])  # 超出预算，淘汰最久未使用的 b
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cache_ttl_expiry():
+    cache = ResponseCache(ttl_s=0.01)
+    cache.put("k", ["v"])
+    time.sleep(0.02)
+    assert cache.get("k") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_request_key_depends_on_fields():
+    a = ChatRequest(messages=[{"role": "user", "content": "hi"}], temperature=0)
+    b = ChatRequest(messages=[{"role": "user", "content": "hi"}], temperature=0, max_tokens=8)
+    assert request_key(a, "m") == request_key(a, "m")
+    assert request_key(a, "m") != request_key(b, "m")
+    assert request_key(a, "m") != request_key(a, "other")
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.api import routes_chat
+from src.app.core import resumable
+from src.app.core.resumable import ReplayStore, set_replay_store
+from src.app.llm.engines import LLMEngine, get_registry
+
+"""可续传 SSE 测试
+    - 每个事件带递增 id
+    - 带服务端返回的 x-stream-id + Last-Event-ID 重连：结束的流只回放断点之后的事件；进行中的流直接接上，不再请求后端
+    - 请求体 / API key 不一致时拒绝续传；客户端复用 x-trace-id 不会接上或顶掉别人的流
+    - 断开后宽限期内无人重连才取消上游；缓冲区有字节上限，断点被挤出时返回 409
+"""
+
+client = TestClient(app)
+PAYLOAD = {"provider": "ollama", "messages": [{"role": "user", "content": "hi"}]}
+
+
+class CountingEngine(LLMEngine):
+    name = "ollama"
+    model = "count"
+
+    def __init__(self, n: int = 5, delay: float = 0.0):
+        self.n = n
+        self.delay = delay
+        self.calls = 0
+        self.closed = False
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "x"
+
+    async def agenerate(self, messages, temperature, top_p, max_tokens, state=None):
+        return "x"
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        self.calls += 1
+        try:
+            for i in range(self.n):
+                await asyncio.sleep(self.delay)
+                yield f"t{i} "
+        finally:
+            self.closed = True
+
+
+def _ids(text: str):
+    return [int(x) for x in re.findall(r"^id: (\d+)$", text, re.M)]
+
+
+def _tokens(text: str):
+    return re.findall(r"event: token\ndata: (.*)\n", text)
+
+
+@pytest.fixture
+def replay():
+    store = ReplayStore()
+    old = set_replay_store(store)
+    yield store
+    set_replay_store(old)
+
+
+def test_events_have_ids_and_finished_stream_replays_tail(replay):
+    engine = CountingEngine(n=4)
+    get_registry().register("ollama", engine)
+    r = client.post("/chat/stream", json=PAYLOAD)
+    first, stream_id = r.text, r.headers["x-stream-id"]
+    ids = _ids(first)
+    assert ids == list(range(1, len(ids) + 1))
+
+    # 只收到了 meta + 前两个 token，从 id 3 之后续传
+    again = client.post("/chat/stream", json=PAYLOAD, headers={"x-stream-id": stream_id, "last-event-id": "3"}).text
+    assert _ids(again) == ids[3:]
+    assert _tokens(again) == ["t2 ", "t3 "]
+    assert "event: done" in again
+    assert engine.calls == 1
+
+
+def test_resume_requires_server_stream_id_and_same_request(replay):
+    engine = CountingEngine(n=4)
+    get_registry().register("ollama", engine)
+    stream_id = client.post("/chat/stream", json=PAYLOAD, headers={"x-trace-id": "shared"}).headers["x-stream-id"]
+
+    # 只带 trace id 续传：不会接上别人的流，而是重新生成一次（也不会顶掉原来的流）
+    r = client.post("/chat/stream", json=PAYLOAD, headers={"x-trace-id": "shared", "last-event-id": "3"})
+    assert engine.calls == 2 and r.headers["x-stream-id"] != stream_id
+    assert replay.stats()["streams"] == 2
+
+    # 拿到了流 id 但请求体或 API key 不一致：拒绝
+    other = {**PAYLOAD, "messages": [{"role": "user", "content": "other"}]}
+    assert client.post("/chat/stream", json=other,
+                       headers={"x-stream-id": stream_id, "last-event-id": "3"}).status_code == 403
+    assert client.post("/chat/stream", json=PAYLOAD,
+                       headers={"x-stream-id": stream_id, "last-event-id": "3", "x-api-key": "k"}).status_code == 403
+    assert engine.calls == 2
+
+
+def test_resume_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("CHAT_RESUME_ENABLED", raising=False)
+    monkeypatch.setattr(resumable, "_store_loaded", False)
+    monkeypatch.setattr(resumable, "_store", None)
+    assert resumable.get_replay_store() is None
+    get_registry().register("ollama", CountingEngine(n=2))
+    r = client.post("/chat/stream", json=PAYLOAD)
+    assert "x-stream-id" not in r.headers and _ids(r.text) == list(range(1, 6))
+
+
+async def _asgi(headers, until_tokens=None, after_stop=0.0, response_headers=None):
+    """直接驱动 ASGI 应用；收到 until_tokens 个 token 后模拟客户端断开，返回收到的响应体（响应头写进 response_headers）"""
+    body = json.dumps(PAYLOAD).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream",
+        "query_string": b"", "root_path": "", "client": ("test", 1), "server": ("test", 80),
+        "headers": [(b"content-type", b"application/json")] + [(k.encode(), v.encode()) for k, v in headers.items()],
+    }
+    gone = asyncio.Event()
+    chunks = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and response_headers is not None:
+            response_headers.update((k.decode(), v.decode()) for k, v in message["headers"])
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if until_tokens is not None and b"".join(chunks).count(b"event: token") >= until_tokens:
+                gone.set()
+
+    await app(scope, receive, send)
+    await asyncio.sleep(after_stop)
+    return b"".join(chunks).decode()
+
+
+def test_reconnect_attaches_to_running_generation(monkeypatch):
+    monkeypatch.setattr(routes_chat, "DISCONNECT_CHECK_S", 0)
+    old = set_replay_store(ReplayStore(grace_s=1.0))
+    engine = CountingEngine(n=20, delay=0.005)
+    get_registry().register("ollama", engine)
+
+    async def main():
+        headers = {}
+        first = await _asgi({}, until_tokens=2, response_headers=headers)
+        last = _ids(first)[-1]
+        second = await _asgi({"x-stream-id": headers["x-stream-id"], "last-event-id": str(last)})
+        return first, second
+
+    try:
+        first, second = asyncio.run(main())
+    finally:
+        set_replay_store(old)
+    # 两次响应拼起来正好是一次完整、不重复的生成
+    assert _tokens(first) + _tokens(second) == [f"t{i} " for i in range(20)]
+    assert _ids(second)[0] == _ids(first)[-1] + 1
+    assert engine.calls == 1 and "event: done" in second
+
+
+def test_generation_cancelled_after_grace(monkeypatch):
+    monkeypatch.setattr(routes_chat, "DISCONNECT_CHECK_S", 0)
+    old = set_replay_store(ReplayStore(grace_s=0.05))
+    engine = CountingEngine(n=200, delay=0.01)
+    get_registry().register("ollama", engine)
+
+    async def main():
+        await _asgi({}, until_tokens=2)
+        # 宽限期内生成仍在进行
+        await asyncio.sleep(0.01)
+        running = not engine.closed
+        await asyncio.sleep(0.1)
+        return running
+
+    try:
+        running = asyncio.run(main())
+    finally:
+        set_replay_store(old)
+    assert running and engine.closed
+
+
+def test_replay_buffer_caps_and_gap():
+    old = set_replay_store(ReplayStore(stream_bytes=120))
+    get_registry().register("ollama", CountingEngine(n=10))
+    try:
+        stream_id = client.post("/chat/stream", json=PAYLOAD).headers["x-stream-id"]
+        r = client.post("/chat/stream", json=PAYLOAD, headers={"x-stream-id": stream_id, "last-event-id": "1"})
+        assert r.status_code == 409
+    finally:
+        set_replay_store(old)
+
+    async def main():
+        store = ReplayStore(max_bytes=200, ttl_s=60)
+
+        async def source(n):
+            for i in range(n):
+                yield b"event: token\ndata: %d\n\n" % i
+
+        a = store.start(source(5))
+        await a.task
+        b = store.start(source(5))
+        await b.task
+        return store, a, b
+
+    store, a, b = asyncio.run(main())
+    # 总量超限时先淘汰已结束的流 a
+    assert store.stats()["streams"] == 1 and store.stats()["bytes"] <= 200
+    assert a.key != b.key and store.get(b.key) is b and store.get(a.key) is None
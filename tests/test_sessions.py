@@ -0,0 +1,119 @@
+import json
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from src.app.main import app
+from src.app.llm.engines import ClientPool, MockEngine, OllamaEngine, get_registry
+from src.app.llm.schemas import ChatMessage
+from src.app.llm.sessions import SessionStore, get_session_store, session_key, set_session_store
+
+"""服务端会话记忆测试
+    - 第二轮只发送新消息 + 上一轮的 context（KV 缓存复用）
+    - 客户端仍发送完整历史时自动识别已保存的前缀
+    - 会话数上限 / 空闲 TTL 淘汰
+    - 会话按调用方隔离：另一个 API key 用同样的 session_id 看不到、也覆盖不了已保存的历史
+"""
+
+
+class _FakeOllama:
+    def __init__(self):
+        self.payloads = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.payloads.append(payload)
+        ctx = list(payload.get("context") or []) + [len(self.payloads)]
+        if payload["stream"]:
+            body = json.dumps({"response": "ok", "done": True, "context": ctx}) + "\n"
+            return httpx.Response(200, content=body.encode())
+        return httpx.Response(200, json={"response": "ok", "done": True, "context": ctx})
+
+
+def _setup():
+    fake = _FakeOllama()
+    engine = OllamaEngine(base_url="http://ollama.test", pool=ClientPool(5, transport=httpx.MockTransport(fake)))
+    get_registry().register("ollama", engine)
+    store = SessionStore()
+    # 记下原来的存储（默认开启的那个），测试结束后恢复，不影响之后的测试
+    old = get_session_store()
+    set_session_store(store)
+    return fake, store, old
+
+
+def test_followup_turn_sends_only_new_message_with_context():
+    fake, store, old = _setup()
+    try:
+        client = TestClient(app)
+        first = {"provider": "ollama", "session_id": "s1", "messages": [{"role": "user", "content": "hello"}]}
+        assert client.post("/chat", json=first).status_code == 200
+        second = {"provider": "ollama", "session_id": "s1", "messages": [{"role": "user", "content": "again"}]}
+        assert client.post("/chat", json=second).status_code == 200
+
+        assert "context" not in fake.payloads[0]
+        assert fake.payloads[1]["context"] == [1]
+        assert fake.payloads[1]["prompt"] == "user: again"
+        # 服务端保存了完整历史（含 assistant 回复）
+        sess = store.get(session_key("ip:testclient", "s1"))
+        assert [m.content for m in sess.messages] == ["hello", "ok", "again", "ok"]
+        assert sess.context.tolist() == [1, 2]
+    finally:
+        set_session_store(old)
+
+
+def test_stream_turn_with_full_history_resend_reuses_context():
+    fake, store, old = _setup()
+    try:
+        client = TestClient(app)
+        msgs = [{"role": "user", "content": "hello"}]
+        with client.stream("POST", "/chat/stream", json={"provider": "ollama", "session_id": "s2", "messages": msgs}) as r:
+            "".join(r.iter_text())
+        # 客户端发送完整历史：已保存的前缀会被识别出来
+        msgs = msgs + [{"role": "assistant", "content": "ok"}, {"role": "user", "content": "more"}]
+        with client.stream("POST", "/chat/stream", json={"provider": "ollama", "session_id": "s2", "messages": msgs}) as r:
+            text = "".join(r.iter_text())
+        assert '"session": "context"' in text
+        assert fake.payloads[1]["prompt"] == "user: more"
+        assert fake.payloads[1]["context"] == [1]
+    finally:
+        set_session_store(old)
+
+
+def test_session_isolated_per_api_key():
+    fake, store, old = _setup()
+    try:
+        client = TestClient(app)
+        body = {"provider": "ollama", "session_id": "shared", "messages": [{"role": "user", "content": "secret"}]}
+        assert client.post("/chat", json=body, headers={"x-api-key": "alice"}).status_code == 200
+        probe = {**body, "messages": [{"role": "user", "content": "what did I say?"}]}
+        assert client.post("/chat", json=probe, headers={"x-api-key": "mallory"}).status_code == 200
+
+        # 另一个调用方：既没有带上 alice 的 context，prompt 里也没有 alice 的历史
+        assert "context" not in fake.payloads[1]
+        assert fake.payloads[1]["prompt"] == "user: what did I say?"
+        # alice 的会话没有被覆盖
+        sess = store.get(session_key("key:alice", "shared"))
+        assert [m.content for m in sess.messages] == ["secret", "ok"]
+    finally:
+        set_session_store(old)
+
+
+def test_store_without_context_support_sends_full_history():
+    store = SessionStore()
+    engine = MockEngine()
+    turn = store.begin("s", [ChatMessage(content="a")], engine)
+    store.commit("s", turn, "b", engine)
+    turn = store.begin("s", [ChatMessage(content="c")], engine)
+    assert [m.content for m in turn.prompt_messages] == ["a", "b", "c"]
+    assert not turn.reused_context
+
+
+def test_store_limits_and_idle_ttl():
+    store = SessionStore(max_sessions=2, idle_ttl_s=0.05)
+    for sid in ("a", "b", "c"):
+        store.save(sid, [ChatMessage(content=sid)], None, "mock:None")
+    assert store.get("a") is None  # 超过会话数上限，淘汰最久未使用的
+    assert store.get("c") is not None
+    time.sleep(0.06)
+    assert store.get("c") is None  # 空闲过期
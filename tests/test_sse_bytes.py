@@ -0,0 +1,26 @@
+from src.app.core.sse import sse_event, sse_event_bytes
+
+"""字节级 SSE 编码测试：sse_event_bytes 与 sse_event(...).encode() 逐字节一致"""
+
+CASES = [
+    "hello",
+    "",
+    "你好",
+    "line1\nline2",
+    "trailing\n",
+    "\n",
+    "a\r\nb",
+    "tab\there",
+    "uni\u2028sep",
+    "next\x85line",
+    {"trace_id": "t", "latency_ms": 1, "error": "x\ny"},
+    {"text": "含中文"},
+    ["a", 1, None],
+    "[DONE]",
+]
+
+
+def test_sse_event_bytes_matches_str_encoder():
+    for event in ("token", "usage", "meta", "done", "error", "custom"):
+        for data in CASES:
+            assert sse_event_bytes(event, data) == sse_event(event, data).encode("utf-8"), (event, data)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+from benchmarks.fake_ollama import FakeConfig, create_app
+from src.app.main import app
+from src.app.core.profiling import SlowRequestProfiler, set_profiler
+from src.app.core.timing import SpanRecorder, backend_throughput
+from src.app.llm.engines import ClientPool, LLMEngine, OllamaEngine, get_registry
+
+"""分阶段耗时测试
+    - /chat 的 Server-Timing 响应头包含读取 / 解析 / 组装 prompt / 排队 / 后端 / Ollama 统计等阶段，响应体带真实的 tokens/s
+    - /chat/stream 的 usage 事件带 timings（connect / ttft / decode / Ollama 的 prompt 评估与解码）和真实的 tokens/s
+    - 慢请求采样分析：超过阈值时回调带调用栈的记录，没超过时不回调
+"""
+
+client = TestClient(app)
+
+
+def _usage(text: str) -> dict:
+    for block in text.split("\n\n"):
+        if "event: usage" in block:
+            return json.loads(block.split("data: ", 1)[1])
+    raise AssertionError("no usage event")
+
+
+def _ollama(cfg: FakeConfig) -> OllamaEngine:
+    transport = httpx.ASGITransport(app=create_app(cfg))
+    engine = OllamaEngine(base_url="http://fake", model="m", pool=ClientPool(5, transport=transport))
+    get_registry().register("ollama", engine)
+    return engine
+
+
+def test_span_recorder():
+    spans = SpanRecorder(started=0.0)
+    spans.add("queue", 0.001)
+    spans.add("queue", 0.002)
+    spans.merge_backend({"prompt_eval_duration": 5_000_000, "eval_duration": 0})
+    assert spans.to_dict() == {"queue_ms": 3.0, "backend_prompt_eval_ms": 5.0}
+    assert spans.server_timing() == "queue;dur=3.00, backend_prompt_eval;dur=5.00"
+    assert backend_throughput({"eval_count": 50, "eval_duration": 500_000_000}) == {"tokens": 50, "tokens_per_s": 100.0}
+
+
+def test_chat_server_timing_header():
+    _ollama(FakeConfig(prompt_delay_ms=5, tps=0))
+    r = client.post("/chat", json={"provider": "ollama", "max_tokens": 4, "messages": [{"content": "hi"}]})
+    assert r.status_code == 200
+    names = [part.split(";")[0] for part in r.headers["server-timing"].split(", ")]
+    for name in ("read", "parse", "prompt", "queue", "backend", "backend_prompt_eval", "total"):
+        assert name in names
+
+
+def test_chat_reports_true_tokens_per_s():
+    _ollama(FakeConfig(prompt_delay_ms=5, tps=2000))
+    r = client.post("/chat", json={"provider": "ollama", "max_tokens": 20, "messages": [{"content": "hi"}]})
+    usage = r.json()["usage"]
+    assert usage["tokens"] == 20 and usage["tokens_per_s"] > 0
+    assert usage["prompt_tokens"] >= 1 and usage["prompt_tokens_per_s"] > 0
+    # mock 没有后端统计：不带 usage
+    assert "usage" not in client.post("/chat", json={"messages": [{"content": "hi"}]}).json()
+
+
+def test_stream_usage_has_timings_and_true_tokens_per_s():
+    _ollama(FakeConfig(prompt_delay_ms=5, tps=2000, chunk_tokens=4))
+    r = client.post("/chat/stream", json={"provider": "ollama", "max_tokens": 20, "stream_flush_ms": 0,
+                                          "messages": [{"content": "hi"}]})
+    usage = _usage(r.text)
+    # 每个事件 4 个 token：事件数不是 token 数
+    assert usage["token_events"] == 5 and usage["tokens"] == 20
+    assert usage["tokens_per_s"] > 0 and usage["prompt_tokens"] >= 1
+    timings = usage["timings"]
+    for key in ("parse_ms", "prompt_ms", "queue_ms", "connect_ms", "ttft_ms", "decode_ms", "backend_prompt_eval_ms",
+                "backend_eval_ms", "total_ms"):
+        assert key in timings
+    assert timings["ttft_ms"] <= timings["total_ms"]
+
+
+class SlowEngine(LLMEngine):
+    name = "ollama"
+    model = "slow"
+
+    def generate(self, messages, temperature, top_p, max_tokens, state=None):
+        raise NotImplementedError
+
+    async def agenerate(self, messages, temperature, top_p, max_tokens, state=None):
+        await asyncio.sleep(0.08)
+        return "done"
+
+    async def stream(self, messages, temperature, top_p, max_tokens, state=None):
+        yield "done"
+
+
+def test_slow_request_profiler_captures_stacks():
+    get_registry().register("ollama", SlowEngine())
+    records = []
+    old = set_profiler(SlowRequestProfiler(threshold_ms=40, interval_ms=2, on_slow=records.append))
+    try:
+        client.post("/chat", json={"provider": "ollama", "messages": [{"content": "slow"}]})
+        client.post("/chat", json={"provider": "mock", "messages": [{"content": "fast"}]})
+    finally:
+        set_profiler(old)
+    assert len(records) == 1
+    record = records[0]
+    assert record["endpoint"] == "chat" and record["elapsed_ms"] >= 40 and record["samples"] > 0
+    assert "backend_ms" in record["timings"]
+    assert any("agenerate" in s["stack"] for s in record["task_stacks"])